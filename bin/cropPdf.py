@@ -2,13 +2,23 @@
 
 r"""given a pdf file with large white margins
 this scrips will remove them.
+The diagrams generated with a tight bounding box are left untouched.
 """
 
 import os
 import argparse
-import pdfCropMargins
 import subprocess
-import shutil
+
+# first line of the tex sources whose pdf is already cropped (see ptree/tree.py)
+TIGHT_BBOX_MARK = "% ptree: tight bounding box"
+
+
+def is_tight(filename):
+    tex_file = os.path.splitext(filename)[0] + ".tex"
+    if not os.path.exists(tex_file):
+        return False
+    with open(tex_file, 'r') as fin:
+        return fin.readline().strip() == TIGHT_BBOX_MARK
 
 
 def crop_file(filename):
@@ -17,19 +27,19 @@ def crop_file(filename):
         print("No valid filename provided")
         exit()
 
-    # make a backup iof the file
-    bk_file = os.path.splitext(filename)[0] + "_bk.pdf"
-    shutil.copyfile(filename, bk_file)
+    if is_tight(filename):
+        print(f"{filename} already cropped")
+        return
 
-    cmd = "pdf-crop-margins -v -s -u " + filename
+    cropped_file = os.path.splitext(filename)[0] + "_cropped.pdf"
 
-    proc = subprocess.Popen(cmd.split())
-    proc.wait()
+    cmd = ["pdf-crop-margins", "-v", "-s", "-u", "-o", cropped_file, filename]
 
-    fname = os.path.basename(filename)
-    cropped_file = os.path.splitext(fname)[0] + "_cropped.pdf"
+    proc = subprocess.Popen(cmd)
+    proc.wait()
 
-    shutil.move(cropped_file, filename)
+    if proc.returncode == 0 and os.path.exists(cropped_file):
+        os.replace(cropped_file, filename)
 
 
 if __name__ == "__main__":
@@ -37,7 +47,7 @@ if __name__ == "__main__":
     formatter = argparse.RawDescriptionHelpFormatter
     parser = argparse.ArgumentParser(description=description,
                                      formatter_class=formatter)
-    
+
     parser.add_argument('-f', '--file', help="""Pdf file to crop.""")
 
     args = parser.parse_args()
@@ -5,8 +5,9 @@
 from __future__ import print_function
 
 from treelib import Tree
+from ptree.util import Product
+from ptree.producttable import open_table, read_rows
 import argparse
-import csv
 import re
 import requests
 import pandoc
@@ -15,20 +16,6 @@ import pandoc
 outputfile = "swProducts.tex"
 
 
-class Product(object):
-    def __init__(self, id, name, parent, desc, wbs, manager, owner,
-                 kind, pkgs):
-        self.id = id
-        self.name = name
-        self.parent = parent
-        self.desc = desc
-        self.wbs = wbs
-        self.manager = manager
-        self.owner = owner
-        self.kind = kind
-        self.pkgs = pkgs
-
-
 def fixIdTex(text):
     id= re.sub(r"\s+","", text)
     id= id.replace("(","")
@@ -51,54 +38,26 @@ def readinputfile(inputfile):
     "Read the csv input file and construct  a tree structure"
     count = 0
     ptree = Tree()
-    with open(inputfile, 'r') as fin:
-        reader= csv.reader(fin,dialect='excel')
-        for line in reader:
+    with open_table(inputfile) as fin:
+        for row in read_rows(fin):
             count = count + 1
-            if count == 1: # skip the header
-                continue
-            part = line
-            id = fixIdTex(part[1]) #make an id from the name
-            pid= fixIdTex(part[3]) #use the same formaula on the parent name then we are good
-            name= fixTex(part[2])
-            prod = Product(id, name, pid, "", part[4], part[6],
-                           part[7], "", part[8])
-            if (count == 2):  # root node
+            id = fixIdTex(row['id']) #make an id from the name
+            pid= fixIdTex(row['parent']) #use the same formaula on the parent name then we are good
+            name= fixTex(row['shortname'])
+            prod = Product(id, name, pid, "", row['wbs'], row['manager'],
+                           row['owner'], "", row['pkgs'])
+            if (count == 1):  # root node
                 ptree.create_node(prod.id, prod.id, data=prod)
             else:
                 if prod.parent != "":
                     ptree.create_node(prod.id, prod.id, data=prod,
                                       parent=prod.parent)
                 else:
-                    print(part[0] + " no parent")
+                    print(row['id'] + " no parent")
 
-        print("{} Product lines".format(count))
+        print("{} Product lines".format(count + 1))
     return ptree
 
-def slice(ptree, outdepth):
-    if (ptree.depth() == outdepth):
-        return ptree
-    # copy the tree but stopping at given depth
-    ntree = Tree()
-    nodes = ptree.expand_tree()
-    count = 0  # subtree in input
-    for n in nodes:
-        #print("Accesing {}".format(n))
-        depth = ptree.depth(n)
-        prod = ptree[n].data
-
-        #print("outd={od} mydepth={d} Product: {p.id} name: {p.name} parent: {p.parent}".format(od=outdepth, d=depth, p=prod))
-        if (depth <= outdepth):
-            # print(" YES ", end='')
-            if (count == 0):
-                ntree.create_node(prod.id, prod.id, data=prod)
-            else:
-                ntree.create_node(prod.id, prod.id, data=prod,
-                                  parent=prod.parent)
-            count = count + 1
-         #print()
-    return ntree
-
 def getContent(pkg):
     subText = ''
     readMe = ''
@@ -245,8 +204,8 @@ swtree = ptree.subtree('DMSW')
 
 #print(swtree)
 
-stub = slice(swtree, 1) # I get the first row
-nodes = stub.expand_tree(mode=Tree.WIDTH)
+# the first row
+nodes = [swtree.root] + [child.identifier for child in sorted(swtree.children(swtree.root))]
 
 output = ""
 for n in nodes:
@@ -18,12 +18,20 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 
+import os
 import click
 import pandoc
 from base64 import b64encode
 
 from .config import Config
 from .mdtree import generate_document
+from .mdcache import ElementCache
+from .mdthrottle import MDAuthError
+from .gittree import GitHubAccessError
+from . import metrics
+from . import bench
+from .build import build_diagrams
+from .texconv import check_fast_path
 
 
 @click.group()
@@ -40,22 +48,169 @@ def cli(namespace):
 @cli.command("generate")
 @click.option('--format', default='latex', help='Pandoc output format (see pandoc for options)')
 @click.option('--compact', default=True, help='Ladscape Product Tree compact (default True)')
-@click.option('--username', prompt="MagicDraw Username", envvar="MD_USER", help="MagicDraw username")
-@click.option('--password', prompt="MagicDraw Password", hide_input=True,
-              envvar="MD_PASSWORD", help="MagicDraw Password")
+@click.option('--username', envvar="MD_USER", help="MagicDraw username (prompted if needed)")
+@click.option('--password', envvar="MD_PASSWORD", help="MagicDraw Password (prompted if needed)")
 @click.option('--tokenpath', default='~/.sq_github_token', help="Path to the Github generated token")
 @click.option('--csvonly', default=False,
               help='If True skip MagicDraw extraction and generate only Git section from csv files')
 @click.option('--partial', default="",
               help='Given a product KEY, extracts the corresponding subtree and csv file.')
-def generate(format, username, password, tokenpath, compact, csvonly, partial):
+@click.option('--md-cache', default=os.path.join(Config.CACHE_DIR, 'md_elements.sqlite'),
+              help='File caching the MagicDraw elements between runs (empty string to keep it in memory only)')
+@click.option('--md-connections', default=Config.MD_MAX_IN_FLIGHT, type=int,
+              help='Max number of concurrent requests to the MagicDraw server')
+@click.option('--md-rate', default=Config.MD_RATE, type=float,
+              help='Max requests per second to the MagicDraw server (default 0, no limit)')
+@click.option('--git-workers', default=Config.GIT_WORKERS, type=int,
+              help='Number of concurrent workers fetching the GitHub packages')
+@click.option('--refresh-git', is_flag=True, default=False,
+              help='Ignore the GitHub packages cached by previous runs and fetch them again')
+@click.option('--git-backend', default=Config.GIT_BACKEND, type=click.Choice(['rest', 'graphql']),
+              help='GitHub API used to get the packages information: rest (default) or graphql (batched queries)')
+@click.option('--snapshot', default=os.path.join(Config.CACHE_DIR, 'snapshot.json.gz'),
+              help='File where to save the product trees and GitHub packages extracted '
+                   '(empty string to not save them)')
+@click.option('--from-snapshot', default="",
+              help='Generate the document from a saved snapshot, without accessing MagicDraw and GitHub')
+@click.option('--metrics', 'metrics_file', default="",
+              help='File where to save the metrics of the run (time per phase, requests, caches, pandoc runs)')
+@click.option('--profile', default=None, type=click.Choice(['cprofile', 'pyinstrument']),
+              help='Profile each phase, the profiles are saved in --profile-dir')
+@click.option('--profile-dir', default="profiles", help='Folder of the phase profiles (default profiles)')
+def generate(format, username, password, tokenpath, compact, csvonly, partial, md_cache, md_connections, md_rate,
+             git_workers, refresh_git, git_backend, snapshot, from_snapshot, metrics_file, profile, profile_dir):
     """Generate product tree document
     """
 
-    usr_pwd = username + ":" + password
-    connection_str = b64encode(usr_pwd.encode("ascii")).decode("ascii")
+    connection_str = ""
+    if not csvonly and not from_snapshot:
+        if not username:
+            username = click.prompt("MagicDraw Username")
+        if not password:
+            password = click.prompt("MagicDraw Password", hide_input=True)
+        usr_pwd = username + ":" + password
+        connection_str = b64encode(usr_pwd.encode("ascii")).decode("ascii")
 
-    generate_document(connection_str, format, tokenpath, compact, csvonly, partial)
+    Config.MD_CACHE = ElementCache(md_cache if md_cache else None)
+    Config.MD_MAX_IN_FLIGHT = max(1, md_connections)
+    Config.MD_RATE = max(0.0, md_rate)
+    Config.GIT_WORKERS = max(1, git_workers)
+    Config.GIT_REFRESH = refresh_git
+    Config.GIT_BACKEND = git_backend
+    metrics.profiler = profile
+    metrics.profile_dir = profile_dir
+    try:
+        generate_document(connection_str, format, tokenpath, compact, csvonly, partial, snapshot, from_snapshot)
+    except (MDAuthError, GitHubAccessError) as e:
+        raise click.ClickException(str(e))
+    finally:
+        if metrics_file:
+            metrics.save(metrics_file)
+            print(f"Metrics saved in {metrics_file}")
+        Config.MD_CACHE.close()
+
+
+@cli.command("build")
+@click.option('--jobs', default=0, type=int, help='Number of concurrent builds (default the number of cores)')
+@click.option('--force', is_flag=True, default=False, help='Rebuild also the up to date diagrams')
+@click.option('--no-crop', is_flag=True, default=False, help='Do not crop the margins of the diagrams')
+@click.argument('folders', nargs=-1)
+def build(jobs, force, no_crop, folders):
+    """Build the tree and subtree diagrams pdf (default folders: trees, subtrees)
+    """
+    failed = build_diagrams(list(folders), jobs, force, not no_crop)
+    if failed:
+        raise click.ClickException(f"{failed} diagrams failed to build")
+
+
+@cli.command("check-latex")
+@click.option('--md-cache', default=os.path.join(Config.CACHE_DIR, 'md_elements.sqlite'),
+              help='MagicDraw elements cache, whose comment bodies are checked')
+@click.option('--show', default=5, type=int, help='Number of differences to print')
+@click.argument('files', nargs=-1)
+def check_latex(md_cache, show, files):
+    """Check that the html fragments converted to LaTeX without pandoc give the same result as pandoc.
+    The fragments are the MagicDraw comments in the cache and the content of the FILES given.
+    """
+    fragments = []
+    if md_cache and os.path.exists(md_cache):
+        cache = ElementCache(md_cache)
+        fragments = cache.comments()
+        cache.close()
+    for file in files:
+        with open(file) as f:
+            fragments.append(f.read())
+    fast, differ = check_fast_path(fragments)
+    print(f"{len(fragments)} fragments, {fast} converted without pandoc, {len(differ)} different from pandoc")
+    for fragment, result, expected in differ[:show]:
+        print("---- html\n" + fragment + "\n---- converted\n" + result + "---- pandoc\n" + expected)
+    if differ:
+        raise click.ClickException("the LaTeX conversion differs from pandoc")
+
+
+@cli.command("bench")
+@click.option('--sizes', default="100,1000,10000", help='Comma separated sizes (nodes) of the synthetic trees')
+@click.option('--fanout', default=5, type=int, help='Average number of children per product')
+@click.option('--depth', default=0, type=int, help='Max depth of the synthetic trees (0 for no limit)')
+@click.option('--repeat', default=3, type=int, help='Runs per benchmark, the best time is kept')
+@click.option('--only', multiple=True, type=click.Choice(list(bench.BENCHMARKS.keys())),
+              help='Benchmark to run (repeatable, default all)')
+@click.option('--output', default="", help='File where to save the results (json)')
+@click.option('--baseline', default="", help='Results of a previous run, to report the regressions')
+@click.option('--threshold', default=1.5, type=float, help='Slowdown over the baseline reported as regression')
+def bench_cmd(sizes, fanout, depth, repeat, only, output, baseline, threshold):
+    """Time the diagram builders, order_tree_level, do_csv and the section rendering on synthetic trees
+    """
+    report = bench.run_benchmarks([int(size) for size in sizes.split(",")], fanout, depth, max(1, repeat),
+                                  list(only))
+    for name, exponents in report['growth'].items():
+        print(f"  {name:20s} growth {exponents}")
+    if output:
+        bench.save(report, output)
+        print(f"Results saved in {output}")
+    if baseline:
+        slower = bench.regressions(report, bench.load(baseline), threshold)
+        for name, size, seconds, reference in slower:
+            print(f"  REGRESSION {name} at {size} nodes: {seconds:.4f}s (was {reference:.4f}s)")
+        if slower:
+            raise click.ClickException(f"{len(slower)} benchmarks slower than {threshold}x the baseline")
+
+
+@cli.command("bench-crawl")
+@click.option('--size', default=200, type=int, help='Number of products of the synthetic tree')
+@click.option('--fanout', default=5, type=int, help='Average number of children per product')
+@click.option('--seed', default=0, type=int, help='Seed of the synthetic tree and packages')
+@click.option('--from-snapshot', default="", help='Serve the trees and packages of a snapshot instead')
+@click.option('--latency', default=0.0, type=float, help='Milliseconds added to each request')
+@click.option('--jitter', default=0.0, type=float, help='Latency variation, as fraction of the latency')
+@click.option('--max-sessions', default=0, type=int,
+              help='Concurrent MagicDraw requests above which the server answers 401 (0 for no limit)')
+@click.option('--refuse-every', default=0, type=int, help='The MagicDraw server answers 401 to one request every N')
+@click.option('--rate-limit', default=5000, type=int, help='GitHub requests allowed per --reset seconds')
+@click.option('--reset', default=3600, type=int, help='Seconds of the GitHub rate limit window')
+@click.option('--md-connections', default=Config.MD_MAX_IN_FLIGHT, type=int,
+              help='Max number of concurrent requests to the MagicDraw server')
+@click.option('--git-workers', default=Config.GIT_WORKERS, type=int,
+              help='Number of concurrent workers fetching the GitHub packages')
+@click.option('--git-backend', default=Config.GIT_BACKEND, type=click.Choice(['rest', 'graphql']),
+              help='GitHub API used to get the packages information')
+@click.option('--output', default="", help='File where to save the results (json)')
+def bench_crawl(size, fanout, seed, from_snapshot, latency, jitter, max_sessions, refuse_every, rate_limit, reset,
+                md_connections, git_workers, git_backend, output):
+    """Time the whole generation against local MagicDraw and GitHub stand-in servers
+    """
+    report = bench.run_crawl(size, fanout, seed, from_snapshot, latency / 1000, jitter, max_sessions, refuse_every,
+                             rate_limit, reset, git_backend, max(1, md_connections), max(1, git_workers))
+    print(f"{report['products']} products, {report['packages']} packages: {report['seconds']:.2f}s")
+    for server in ('magicdraw', 'github'):
+        stats = report[server]
+        print(f"  {server:10s} {sum(stats['requests'].values()):6d} requests in {stats['seconds']:.2f}s "
+              f"({stats['requests_per_second']} req/s), {stats['connections']} connections")
+    print(f"  {report['magicdraw']['refused']} MagicDraw requests refused, "
+          f"{report['github']['rate_limited']} GitHub requests over the rate limit")
+    if output:
+        bench.save(report, output)
+        print(f"Results saved in {output}")
 
 
 @cli.command("diagram")
@@ -0,0 +1,281 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Benchmarks of the document generation steps on synthetic product trees of growing size.
+The results (best time of the repetitions, per step and tree size) are compared with
+a previous run to find the regressions, and the growth between sizes shows where the
+time stops scaling linearly.
+The crawl benchmark runs the whole generation against the MagicDraw and GitHub stand-ins.
+"""
+
+import os
+import io
+import json
+import math
+import time
+import yaml
+import tempfile
+from contextlib import redirect_stdout
+from .config import Config
+from .synthetic import synthetic_tree, synthetic_packages
+from .snapshot import Snapshot
+from .mdcache import ElementCache
+from .util import GitPkg
+from .standin import TwcModel, TwcStandin, GitHubStandin
+from .tree import TreeIndex, make_tree_portrait, make_tree_landmix1, make_full_tree, make_subtrees
+from .render import get_template, write_template
+from . import mdtree
+from . import treeview
+from . import metrics
+
+
+def bench_tree_index(ptree):
+    TreeIndex(ptree)
+
+
+def bench_portrait(ptree):
+    make_tree_portrait(ptree, "trees/bench_portrait.tex", "Bench")
+
+
+def bench_landmix1(ptree):
+    make_tree_landmix1(ptree, "trees/bench_mixedLand.tex", "Bench", True)
+
+
+def bench_full_tree(ptree):
+    make_full_tree(ptree, "trees/bench_full.tex", "Bench", True)
+
+
+def bench_subtrees(ptree):
+    make_subtrees(ptree, "bench", "Bench", True)
+
+
+def bench_order_tree_level(ptree):
+    mdtree.tree_dict = {n: ptree[n].data for n in ptree.nodes}
+    mdp = ptree.to_dict(with_data=False)
+    for k0 in mdp:
+        mdtree.order_tree_level(mdp[k0])
+
+
+def bench_do_csv(ptree):
+    mdtree.do_csv(list(treeview.products(ptree)), "bench")
+
+
+def bench_render(ptree):
+    products = list(treeview.products(ptree))
+    tree_dict = {prod.id: prod for prod in products}
+    mdtree.tree_dict = tree_dict
+    mdp = ptree.to_dict(with_data=False)
+    template = get_template(f"section.{Config.TEMPLATE_LANGUAGE}.jinja2")
+    write_template(template, "bench.tex", Config.TEMPLATE_LANGUAGE,
+                   dict(metadata={'template': template.filename},
+                        mdrev="0",
+                        filename="bench",
+                        doc_handler="DMTN-000",
+                        mdt_dict=tree_dict,
+                        mdp={k0: mdtree.order_tree_level(mdp[k0]) for k0 in mdp},
+                        mdps=products))
+
+
+BENCHMARKS = {'tree_index': bench_tree_index,
+              'make_tree_portrait': bench_portrait,
+              'make_tree_landmix1': bench_landmix1,
+              'make_full_tree': bench_full_tree,
+              'make_subtrees': bench_subtrees,
+              'order_tree_level': bench_order_tree_level,
+              'do_csv': bench_do_csv,
+              'render': bench_render}
+
+
+def best_time(func, ptree, repeat):
+    """
+    Best wall time of repeat runs of func (the output is discarded)
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            func(ptree)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def growth(results, sizes):
+    """
+    Exponent of the time growth between consecutive sizes: 1 is linear, 2 quadratic
+    """
+    exponents = dict()
+    for small, large in zip(sizes, sizes[1:]):
+        t_small, t_large = results.get(str(small)), results.get(str(large))
+        if t_small and t_large and large > small:
+            exponents[f"{small}-{large}"] = round(math.log(t_large / t_small) / math.log(large / small), 2)
+    return exponents
+
+
+def run_benchmarks(sizes, fanout=5, depth=0, repeat=3, names=None, seed=0):
+    """
+    Run the benchmarks on synthetic trees of the given sizes, in a temporary folder
+    :param names: benchmarks to run (default all)
+    :return: dictionary of the results
+    """
+    names = names if names else list(BENCHMARKS.keys())
+    results = {name: dict() for name in names}
+    nodes = dict()
+    manifest = Config.OUTPUT_MANIFEST
+    Config.OUTPUT_MANIFEST = None  # always write the diagrams
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            for size in sizes:
+                ptree = synthetic_tree(size, fanout, depth, seed)
+                nodes[str(size)] = ptree.size()
+                for name in names:
+                    results[name][str(size)] = round(best_time(BENCHMARKS[name], ptree, repeat), 6)
+                    print(f"  {name:20s} {ptree.size():7d} nodes  {results[name][str(size)]:9.4f}s")
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        Config.OUTPUT_MANIFEST = manifest
+    return {'sizes': sizes,
+            'nodes': nodes,
+            'fanout': fanout,
+            'depth': depth,
+            'repeat': repeat,
+            'seconds': results,
+            'growth': {name: growth(results[name], sizes) for name in names}}
+
+
+def regressions(report, baseline, threshold=1.5):
+    """
+    Benchmarks slower than threshold times the baseline, as list of (name, size, seconds, baseline seconds)
+    """
+    slower = []
+    for name, times in report['seconds'].items():
+        for size, seconds in times.items():
+            reference = baseline.get('seconds', {}).get(name, {}).get(size)
+            if reference and seconds > threshold * reference:
+                slower.append((name, size, seconds, reference))
+    return slower
+
+
+def save(report, filename):
+    with open(filename, 'w') as fout:
+        json.dump(report, fout, indent=1)
+
+
+def load(filename):
+    with open(filename, 'r') as fin:
+        return json.load(fin)
+
+
+# Config attributes changed by the crawl benchmark, restored at the end
+CRAWL_CONFIG = ['MD_COMP_URL', 'MD_BULK_URL', 'MD_REVDIFF_URL', 'MD_BULK', 'MD_CACHE', 'MD_MAX_IN_FLIGHT',
+                'GIT_API_URL', 'GIT_GRAPHQL_URL', 'GIT_BACKEND', 'GIT_WORKERS', 'GIT_CACHE_FILE', 'OUTPUT_MANIFEST',
+                'CACHED_GIT_REPOS', 'MISSING_GIT_REPOS']
+
+
+def crawl_models(size, fanout, seed, snapshot_file):
+    """
+    The product trees (dictionary subtree name: tree) and the GitHub packages to serve,
+    from a snapshot file if given, otherwise synthetic
+    """
+    if snapshot_file:
+        snapshot = Snapshot.load(snapshot_file)
+        trees = {name: snapshot.get_subtree(name)[0] for name in snapshot.subtrees}
+        packages = {pkg: GitPkg.from_dict(values) for pkg, values in snapshot.git_repos.items()}
+    else:
+        ptree = synthetic_tree(size, fanout, 0, seed)
+        trees = {'Synthetic': ptree}
+        packages = synthetic_packages(ptree, seed)
+    return trees, packages
+
+
+def run_crawl(size=200, fanout=5, seed=0, snapshot_file="", latency=0.0, jitter=0.0, max_sessions=0,
+              refuse_every=0, rate_limit=5000, reset_seconds=3600, git_backend="rest", md_connections=4,
+              git_workers=8):
+    """
+    Run generate_document in a temporary folder against the MagicDraw and GitHub stand-ins,
+    serving synthetic trees (or the ones in snapshot_file) and their packages.
+    The elements are not cached between runs, all of them are requested to the stand-in.
+    :param latency: seconds added to each request (+/- jitter, as fraction)
+    :param max_sessions: concurrent MagicDraw requests above which the stand-in answers 401
+    :param refuse_every: the MagicDraw stand-in answers 401 to one request every refuse_every
+    :param rate_limit: GitHub requests allowed per reset_seconds
+    :return: dictionary of the results
+    """
+    trees, packages = crawl_models(size, fanout, seed, snapshot_file)
+    model = TwcModel()
+    subtrees = {name: {'id': model.add_tree(ptree), 'DoTree': True} for name, ptree in trees.items()}
+    saved = {name: getattr(Config, name) for name in CRAWL_CONFIG}
+    cwd = os.getcwd()
+    md = TwcStandin(model.elements, latency=latency, jitter=jitter, max_sessions=max_sessions,
+                    refuse_every=refuse_every)
+    git = GitHubStandin(packages, latency=latency, jitter=jitter, rate_limit=rate_limit,
+                        reset_seconds=reset_seconds)
+    try:
+        with tempfile.TemporaryDirectory() as workdir, md, git:
+            os.chdir(workdir)
+            with open(Config.SUBSYSTEM_YML_FILE, 'w') as fout:
+                yaml.safe_dump({'subsystem': {'name': 'Bench', 'doc': 'DMTN-000', 'id': 'bench',
+                                              'subtrees': subtrees}}, fout)
+            with open("github_token", 'w') as fout:
+                fout.write("bench\n")
+            md.configure()
+            git.configure()
+            Config.MD_CACHE = ElementCache(None)
+            Config.MD_MAX_IN_FLIGHT = md_connections
+            Config.GIT_BACKEND = git_backend
+            Config.GIT_WORKERS = git_workers
+            Config.GIT_CACHE_FILE = None
+            Config.CACHED_GIT_REPOS = dict()
+            Config.MISSING_GIT_REPOS = set()
+            metrics.reset()
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                mdtree.generate_document("YmVuY2g6YmVuY2g=", Config.TEMPLATE_LANGUAGE, "github_token", True, False,
+                                         "", "", "")
+            seconds = time.perf_counter() - start
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        for name, value in saved.items():
+            setattr(Config, name, value)
+    phases = metrics.report()['phases']
+    md_seconds = phases.get('build_md_tree', {}).get('seconds', 0)
+    git_seconds = phases.get('do_github_section', {}).get('seconds', 0)
+    md_requests = sum(md.requests.values())
+    git_requests = sum(git.requests.values())
+    return {'products': sum([ptree.size() for ptree in trees.values()]),
+            'packages': len(packages),
+            'latency': latency,
+            'seconds': round(seconds, 3),
+            'magicdraw': {'requests': md.requests,
+                          'connections': md.connections,
+                          'refused': md.refused,
+                          'seconds': md_seconds,
+                          'requests_per_second': round(md_requests / md_seconds, 1) if md_seconds else None},
+            'github': {'backend': git_backend,
+                       'requests': git.requests,
+                       'connections': git.connections,
+                       'rate_limited': git.limited,
+                       'seconds': git_seconds,
+                       'requests_per_second': round(git_requests / git_seconds, 1) if git_seconds else None},
+            'phases': phases}
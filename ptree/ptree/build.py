@@ -0,0 +1,121 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Parallel build of the tree and subtree diagrams (xelatex + margins cropping)
+"""
+
+import os
+import glob
+import time
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .tree import TIGHT_BBOX_MARK
+
+DIAGRAM_FOLDERS = ["trees", "subtrees"]
+
+
+def is_stale(tex_file):
+    """
+    True if the pdf of tex_file is missing or older than the tex source
+    """
+    pdf_file = os.path.splitext(tex_file)[0] + ".pdf"
+    if not os.path.exists(pdf_file):
+        return True
+    return os.path.getmtime(pdf_file) < os.path.getmtime(tex_file)
+
+
+def is_tight(tex_file):
+    """
+    True if tex_file produces a page already cropped to the diagram
+    """
+    with open(tex_file, 'r') as fin:
+        return fin.readline().strip() == TIGHT_BBOX_MARK
+
+
+def crop_pdf(pdf_file):
+    """
+    Remove the white margins of pdf_file, using pdf-crop-margins
+    """
+    cropped_file = os.path.splitext(pdf_file)[0] + "_cropped.pdf"
+    proc = subprocess.run(["pdf-crop-margins", "-s", "-u", "-o", cropped_file, pdf_file],
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if proc.returncode != 0 or not os.path.exists(cropped_file):
+        return proc.stdout
+    os.replace(cropped_file, pdf_file)
+    return None
+
+
+def build_diagram(tex_file, crop=True):
+    """
+    Compile tex_file in its folder and crop the resulting pdf
+    :return: (tex_file, elapsed seconds, error message or None)
+    """
+    start = time.time()
+    folder, name = os.path.split(tex_file)
+    jobname = os.path.splitext(name)[0]
+    proc = subprocess.run(["xelatex", "-interaction=nonstopmode", "-halt-on-error",
+                           f"-jobname={jobname}", name],
+                          cwd=folder if folder else None,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if proc.returncode != 0:
+        return tex_file, time.time() - start, "\n".join(proc.stdout.splitlines()[-20:])
+    error = None
+    pdf_file = os.path.splitext(tex_file)[0] + ".pdf"
+    if crop and not is_tight(tex_file):
+        error = crop_pdf(pdf_file)
+        if error and os.path.exists(pdf_file):
+            # keep it stale, to be built again at the next run
+            os.remove(pdf_file)
+    return tex_file, time.time() - start, error
+
+
+def build_diagrams(folders=None, jobs=None, force=False, crop=True):
+    """
+    Build in parallel the stale diagrams in folders
+    :param folders: folders containing the diagrams tex files
+    :param jobs: number of concurrent processes, default the number of cores
+    :param force: if True, build also the up to date diagrams
+    :param crop: if True, crop the margins of the generated pdf files
+    :return: number of failed builds
+    """
+    if not folders:
+        folders = DIAGRAM_FOLDERS
+    tex_files = []
+    for folder in folders:
+        tex_files.extend(sorted(glob.glob(os.path.join(folder, "*.tex"))))
+    to_build = [tex_file for tex_file in tex_files if force or is_stale(tex_file)]
+    print(f"{len(to_build)} diagrams to build, {len(tex_files) - len(to_build)} up to date")
+    if not to_build:
+        return 0
+
+    failed = 0
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=jobs if jobs else os.cpu_count()) as executor:
+        futures = [executor.submit(build_diagram, tex_file, crop) for tex_file in to_build]
+        for future in as_completed(futures):
+            tex_file, elapsed, error = future.result()
+            if error:
+                failed = failed + 1
+                print(f"  {tex_file}: FAILED ({elapsed:.1f}s)\n{error}")
+            else:
+                print(f"  {tex_file}: {elapsed:.1f}s")
+    print(f"Built {len(to_build) - failed} diagrams in {time.time() - start:.1f}s, {failed} failed")
+    return failed
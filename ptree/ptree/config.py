@@ -25,10 +25,43 @@ import pandoc
 
 class Config:
     MD_COMP_URL = f"https://twcloud.lsst.org:8111/osmc/resources/{{res}}/elements/{{comp}}"
+    MD_REVDIFF_URL = f"https://twcloud.lsst.org:8111/osmc/resources/{{res}}/revisiondiff?source={{source}}&target={{target}}"
+    # persistent cache of the MagicDraw elements (see mdcache.ElementCache)
+    CACHE_DIR = ".ptree_cache"
+    MD_CACHE = None
+    # digests of the generated diagrams (see util.OutputManifest), None to always regenerate
+    OUTPUT_MANIFEST = None
+    # max number of concurrent requests to the MagicDraw REST server
+    MD_MAX_IN_FLIGHT = 4
+    # transport retries (connection errors, 502/503/504) of the MagicDraw requests, see util.md_session
+    MD_RETRIES = 3
+    MD_RETRY_BACKOFF = 0.5
+    # requests refused by the server (session limit), see mdthrottle.MDThrottle
+    MD_RATE = 0  # max requests per second, 0 for no limit
+    MD_BACKOFF_BASE = 5
+    MD_BACKOFF_MAX = 600
+    MD_MAX_RETRIES = 10
+    MD_AUTH_RETRIES = 2
+    # bulk retrieval of elements (POST of a list of ids), disabled if not supported by the server
+    MD_BULK_URL = f"https://twcloud.lsst.org:8111/osmc/resources/{{res}}/elements"
+    MD_BULK = True
+    MD_BULK_SIZE = 100
     PANDOC_TYPE = None
     DOC = pandoc.Document()
     OUTPUT_FORMAT = None
     CACHED_GIT_REPOS = {}
+    # packages not found on GitHub
+    MISSING_GIT_REPOS = set()
+    # concurrent workers fetching the GitHub packages
+    GIT_WORKERS = 8
+    GIT_API_URL = "https://api.github.com"
+    # GitHub backend: rest (PyGithub) or graphql (see gitgraphql.GraphQLBackend)
+    GIT_BACKEND = "rest"
+    GIT_GRAPHQL_URL = "https://api.github.com/graphql"
+    GIT_GRAPHQL_BATCH = 50
+    # persistent cache of the GitHub packages (see gitcache.GitRepoCache), None to disable
+    GIT_CACHE_FILE = os.path.join(CACHE_DIR, "git_repos.json")
+    GIT_REFRESH = False
     # to store here git trees when MD Section is ongoing to avoid rate limit problem?
     CACHED_GIT_TREES = []
     MODE_PREFIX = None
@@ -0,0 +1,112 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Persistent cache of the package information retrieved from GitHub
+"""
+
+import os
+import json
+import threading
+import requests
+from github import GithubException
+from .util import GitPkg, split_pkg_name
+
+
+class GitRepoCache(object):
+    """
+    GitPkg records saved between runs, keyed by package name.
+    Each record is valid for the commit at the head of the repository default branch.
+    The head is checked with a conditional request (If-None-Match on the stored ETag):
+    when the repository did not change GitHub answers 304, that does not count
+    against the rate limit.
+    Note that changes of description or teams not associated with a commit are not detected,
+    use refresh to force the invalidation of all records.
+    """
+
+    def __init__(self, path, gs, refresh=False):
+        """
+        :param gs: GitScheduler executing the GitHub calls, the head checks included
+        """
+        self.path = path
+        self.gs = gs
+        self.refresh = refresh
+        self.records = dict()
+        self.reused = 0
+        self.fetched = 0
+        self._lock = threading.Lock()
+        if os.path.exists(path) and not refresh:
+            with open(path, 'r') as fin:
+                self.records = json.load(fin)
+
+    def get_head(self, pkg, etag=None):
+        """
+        Returns the default branch head commit SHA and its ETag,
+        (None, etag) if not modified since etag, (None, None) if not available.
+        The request is sent by the PyGithub requester, authenticated as the other calls
+        and updating the rate limit seen by the scheduler.
+        """
+        org, repo = split_pkg_name(pkg)
+        headers = {'Accept': 'application/vnd.github.sha'}
+        if etag:
+            headers['If-None-Match'] = etag
+        try:
+            status, resp_headers, body = self.gs.call(self.gs.g.requester.requestJson, "GET",
+                                                      f"/repos/{org}/{repo}/commits/HEAD", headers=headers)
+        except (GithubException, requests.RequestException):
+            return None, None
+        if status == 304:
+            return None, etag
+        if status != 200:
+            return None, None
+        return body.strip(), resp_headers.get('etag')
+
+    def lookup(self, pkg):
+        """
+        Returns the cached GitPkg if still valid, otherwise None and the current head (sha, etag),
+        to be given to store after the package has been fetched
+        """
+        record = self.records.get(pkg)
+        etag = record['etag'] if record else None
+        sha, new_etag = self.get_head(pkg, etag)
+        if record and ((sha is None and new_etag is not None) or (sha is not None and sha == record['sha'])):
+            with self._lock:
+                record['etag'] = new_etag
+                self.reused = self.reused + 1
+            return GitPkg.from_dict(record['pkg']), None
+        return None, (sha, new_etag)
+
+    def store(self, pkg, gitpkg, head):
+        if not head or not head[0]:
+            return
+        with self._lock:
+            self.records[pkg] = {'sha': head[0], 'etag': head[1], 'pkg': gitpkg.to_dict()}
+            self.fetched = self.fetched + 1
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with self._lock:
+            with open(self.path, 'w') as fout:
+                json.dump(self.records, fout)
+
+    def summary(self):
+        return f"{self.reused} packages unchanged on GitHub, {self.fetched} fetched and cached"
@@ -0,0 +1,256 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+GitHub GraphQL backend: package information for a batch of repositories in a single query
+"""
+
+import os
+import json
+import hashlib
+import requests
+from .config import Config
+from .util import GitPkg, split_pkg_name, parse_ups_table
+
+REPO_QUERY = """
+  r{i}: repository(owner: {org}, name: {repo}) {{
+    name
+    description
+    defaultBranchRef {{ target {{ oid }} }}
+    root: object(expression: "HEAD:") {{ ... on Tree {{ entries {{ name type }} }} }}
+    ups: object(expression: {ups}) {{ ... on Blob {{ text }} }}
+  }}"""
+
+README_QUERY = """
+  r{i}: repository(owner: {org}, name: {repo}) {{ {files} }}"""
+
+FILE_QUERY = """f{j}: object(expression: {path}) {{ ... on Blob {{ text }} }} """
+
+TEAMS_QUERY = """
+{{
+  organization(login: {org}) {{
+    teams(first: 100{after}) {{
+      pageInfo {{ hasNextPage endCursor }}
+      nodes {{
+        id
+        name
+        repositories(first: 100) {{ pageInfo {{ hasNextPage endCursor }} nodes {{ name }} }}
+      }}
+    }}
+  }}
+}}"""
+
+TEAM_REPOS_QUERY = """
+{{
+  node(id: {team}) {{
+    ... on Team {{
+      repositories(first: 100, after: {after}) {{ pageInfo {{ hasNextPage endCursor }} nodes {{ name }} }}
+    }}
+  }}
+}}"""
+
+
+def gql_str(text):
+    """ GraphQL string literal """
+    return json.dumps(text)
+
+
+class HttpTransport(object):
+    """
+    Sends the queries to the GitHub GraphQL endpoint.
+    The GraphQL rate limit (remaining points, reset time) of the last response is kept in rate_limiting.
+    """
+
+    def __init__(self, token, url=None):
+        self.url = url if url else Config.GIT_GRAPHQL_URL
+        self.rate_limiting = None
+        self.session = requests.Session()
+        if token:
+            self.session.headers.update({'Authorization': f"bearer {token}"})
+
+    def __call__(self, query):
+        resp = self.session.post(self.url, json={'query': query})
+        if 'X-RateLimit-Remaining' in resp.headers and 'X-RateLimit-Reset' in resp.headers:
+            self.rate_limiting = (int(resp.headers['X-RateLimit-Remaining']), int(resp.headers['X-RateLimit-Reset']))
+        resp.raise_for_status()
+        return resp.json()
+
+
+class RecordingTransport(object):
+    """
+    Saves in folder the responses obtained from transport, one json file per query
+    """
+
+    def __init__(self, transport, folder):
+        self.transport = transport
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    @property
+    def rate_limiting(self):
+        return getattr(self.transport, 'rate_limiting', None)
+
+    def __call__(self, query):
+        response = self.transport(query)
+        key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        with open(os.path.join(self.folder, key + ".json"), 'w') as fout:
+            json.dump({'query': query, 'response': response}, fout, indent=1)
+        return response
+
+
+class ReplayTransport(object):
+    """
+    Answers the queries with the responses recorded by RecordingTransport
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def __call__(self, query):
+        key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        with open(os.path.join(self.folder, key + ".json"), 'r') as fin:
+            return json.load(fin)['response']
+
+
+class GraphQLBackend(object):
+    """
+    Fills GitPkg objects like gittree.get_gitpkg_content, but
+    for up to Config.GIT_GRAPHQL_BATCH repositories per query:
+    one query for description, root listing and ups table, one for the READMEs.
+    The teams are obtained once per organization.
+    """
+
+    def __init__(self, token, gs, transport=None, batch=None):
+        """
+        :param token: GitHub token
+        :param gs: GitScheduler, pacing and counting the queries
+        :param transport: callable sending a query and returning the json response
+        :param batch: max repositories per query
+        """
+        self.gs = gs
+        self.transport = transport if transport else HttpTransport(token)
+        self.batch = batch if batch else Config.GIT_GRAPHQL_BATCH
+        self.teams = dict()
+
+    def query(self, query):
+        response = self.gs.call_graphql(self.transport, query)
+        data = response.get('data')
+        return data if data else dict()
+
+    def get_org_teams(self, org):
+        """
+        Returns a dictionary repository: list of team names, for all teams in org
+        """
+        if org in self.teams:
+            return self.teams[org]
+        repo_teams = dict()
+        after = ""
+        while True:
+            data = self.query(TEAMS_QUERY.format(org=gql_str(org), after=after))
+            teams = (data.get('organization') or {}).get('teams')
+            if not teams:
+                break
+            for team in teams['nodes']:
+                repos = team['repositories']
+                names = [repo['name'] for repo in repos['nodes']]
+                while repos['pageInfo']['hasNextPage']:
+                    node = self.query(TEAM_REPOS_QUERY.format(team=gql_str(team['id']),
+                                                              after=gql_str(repos['pageInfo']['endCursor'])))
+                    repos = (node.get('node') or {}).get('repositories')
+                    if not repos:
+                        break
+                    names.extend([repo['name'] for repo in repos['nodes']])
+                for name in names:
+                    repo_teams.setdefault(name, []).append(team['name'])
+            if not teams['pageInfo']['hasNextPage']:
+                break
+            after = ", after: " + gql_str(teams['pageInfo']['endCursor'])
+        self.teams[org] = repo_teams
+        return repo_teams
+
+    def get_gitpkgs(self, pkgs):
+        """
+        Returns a dictionary package: GitPkg (None if the package can't be retrieved)
+        """
+        result = dict()
+        for start in range(0, len(pkgs), self.batch):
+            result.update(self.get_batch(pkgs[start:start + self.batch]))
+            print(".", end="", flush=True)
+        return result
+
+    def get_batch(self, pkgs):
+        names = [split_pkg_name(pkg) for pkg in pkgs]
+        query = "{" + "".join([REPO_QUERY.format(i=i, org=gql_str(org), repo=gql_str(repo),
+                                                 ups=gql_str(f"HEAD:ups/{repo}.table"))
+                               for i, (org, repo) in enumerate(names)]) + "\n}"
+        data = self.query(query)
+
+        # READMEs in the root folder
+        readme_files = dict()
+        for i, (org, repo) in enumerate(names):
+            repo_data = data.get(f"r{i}")
+            if repo_data and repo_data['root']:
+                readme_files[i] = [entry['name'] for entry in repo_data['root']['entries']
+                                   if "README" in entry['name'] and entry['type'] == 'blob']
+        readme_data = dict()
+        if any(readme_files.values()):
+            query = "{" + "".join([README_QUERY.format(i=i, org=gql_str(names[i][0]), repo=gql_str(names[i][1]),
+                                                       files="".join([FILE_QUERY.format(j=j, path=gql_str("HEAD:" + f))
+                                                                      for j, f in enumerate(files)]))
+                                   for i, files in readme_files.items() if files]) + "\n}"
+            readme_data = self.query(query)
+
+        result = dict()
+        for i, (pkg, (org, repo)) in enumerate(zip(pkgs, names)):
+            result[pkg] = self.make_gitpkg(org, repo, data.get(f"r{i}"), readme_files.get(i, []),
+                                           readme_data.get(f"r{i}"))
+        return result
+
+    def make_gitpkg(self, org, repo, repo_data, readme_files, readme_data):
+        if not repo_data or not repo_data['root']:
+            print(f"eRE({repo})]]", end="", flush=True)
+            return None
+        readme = dict()
+        for j, readme_file in enumerate(readme_files):
+            blob = (readme_data or {}).get(f"f{j}")
+            if not blob or blob.get('text') is None:
+                print(f"eRM({repo})", end="", flush=True)
+                return None
+            readme[readme_file] = '\n'.join(blob['text'].splitlines()[:20])
+        ups_table = []
+        if any("ups" in entry['name'] for entry in repo_data['root']['entries']):
+            if not repo_data['ups'] or repo_data['ups'].get('text') is None:
+                print(f"eUT({repo})", end="", flush=True)
+                return None
+            ups_table = parse_ups_table(repo_data['ups']['text'].splitlines())
+        # converted to LaTeX by gittree.convert_summaries
+        pkg_desc = ""
+        if repo_data['description']:
+            pkg_desc = repo_data['description']
+        return GitPkg("",
+                      repo,
+                      org,
+                      readme,
+                      ups_table,
+                      list(self.get_org_teams(org).get(repo_data['name'], [])),
+                      pkg_desc,
+                      "",
+                      "")
@@ -0,0 +1,116 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Rate limit aware scheduling of the GitHub API calls
+"""
+
+import time
+import threading
+
+
+class GitScheduler(object):
+    """
+    Runs the GitHub calls at full speed while the rate limit quota allows it.
+    When the remaining calls go below the reserve, the calls are given time slots
+    spread until the quota reset time, and when the quota is exhausted they wait for the reset.
+    The slots are shared by all the threads, so that concurrent calls do not fire together.
+    The REST quota is read from the X-RateLimit-Remaining/Reset headers of the last response,
+    as exposed by PyGithub. GraphQL queries have their own points budget, they are paced
+    on the rate limit headers of the last GraphQL response.
+    """
+
+    def __init__(self, g, reserve=100):
+        """
+        :param g: github.Github instance
+        :param reserve: remaining calls below which the calls are throttled
+        """
+        self.g = g
+        self.reserve = reserve
+        self.calls = 0
+        self.waited = 0.0
+        self.next_slot = {'core': 0.0, 'graphql': 0.0}
+        # GraphQL (remaining, reset time), unknown until the first query
+        self.graphql_rate = (-1, 0)
+        self._lock = threading.Lock()
+
+    def quota(self, resource):
+        """
+        Returns the remaining calls of resource ('core' or 'graphql'), and the reset time
+        if the calls need throttling
+        """
+        if resource == 'graphql':
+            return self.graphql_rate
+        remaining, limit = self.g.rate_limiting
+        if remaining < 0 or remaining > self.reserve:
+            return remaining, 0
+        return remaining, self.g.rate_limiting_resettime
+
+    def wait_time(self, resource='core'):
+        """
+        Reserves the time slot of the next call, returns the seconds to wait for it
+        """
+        remaining, reset = self.quota(resource)
+        if remaining < 0 or remaining > self.reserve:
+            return 0
+        with self._lock:
+            now = time.time()
+            if reset <= now:
+                return 0
+            if remaining == 0:
+                # the quota is full again after the reset
+                return reset + 1 - now
+            slot = max(now, self.next_slot[resource])
+            self.next_slot[resource] = slot + (reset - now) / remaining
+            return slot - now
+
+    def throttle(self, resource='core'):
+        wait = self.wait_time(resource)
+        if wait > 0:
+            with self._lock:
+                self.waited = self.waited + wait
+            time.sleep(wait)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Execute a function doing one GitHub API call
+        """
+        self.throttle()
+        with self._lock:
+            self.calls = self.calls + 1
+        return func(*args, **kwargs)
+
+    def call_graphql(self, transport, query):
+        """
+        Send a GraphQL query, paced on the GraphQL budget only
+        :param transport: callable sending the query, exposing the (remaining, reset time)
+                          of its last response in rate_limiting (if known)
+        """
+        self.throttle('graphql')
+        with self._lock:
+            self.calls = self.calls + 1
+        response = transport(query)
+        rate = getattr(transport, 'rate_limiting', None)
+        if rate:
+            self.graphql_rate = rate
+        return response
+
+    def summary(self):
+        return f"{self.calls} GitHub calls, {self.waited:.1f}s waiting for rate limit"
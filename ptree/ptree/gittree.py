@@ -27,83 +27,182 @@ import os
 import click
 import sys
 import re
-import time
-from .util import GitPkg, _as_output_format, fix_tex, html_to_latex
+from concurrent.futures import ThreadPoolExecutor
+from .util import GitPkg, fix_tex, html_to_latex_batch, split_pkg_name, parse_ups_table
+from .render import get_template, write_template
 from .config import Config
-from jinja2 import Environment, PackageLoader, TemplateNotFound, ChoiceLoader, FileSystemLoader
+from jinja2 import TemplateNotFound
 from treelib import Tree
 from .make_graphs import make_graph
+from .gitscheduler import GitScheduler
+from .gitcache import GitRepoCache
+from .gitgraphql import GraphQLBackend
+from . import metrics
 
 
-def do_github_section(md_trees, token_path, output_format):
+class GitHubAccessError(Exception):
+    """ The GitHub organization of a package can't be accessed """
+    pass
+
+
+def do_github_section(md_trees, token_path, output_format, offline=False):
     """
 
     :param md_trees: list of MagicDraw tree dictionaries
-    :return:
+    :param offline: if True, use only the packages already in Config (e.g. loaded from a snapshot)
+    :return: the package matrix (package: list of top products using it)
     """
     global template_path
-    global git_calls
     global pkg_matrix
-    git_calls = 0
     git_trees_dict = dict()
     graphs = dict()
     pkg_matrix = dict()
 
 
+    token = None
     full_token_path = os.path.expanduser(token_path)
-    with open(full_token_path, 'r') as fdo:
-        token = fdo.readline().strip()
-    g = github.Github(token)
+    if not offline or os.path.exists(full_token_path):
+        with open(full_token_path, 'r') as fdo:
+            token = fdo.readline().strip()
+    # GitScheduler is the only throttle of the calls, the PyGithub spacing between requests is disabled
+    gs = GitScheduler(github.Github(token, base_url=Config.GIT_API_URL,
+                                    seconds_between_requests=None, seconds_between_writes=None))
+
+    # fetch all packages and their dependencies first, then assemble the trees in the MD order
+    top_pkgs = []
+    for tree in md_trees:
+        for product in tree:
+            if tree[product].pkgs:
+                top_pkgs.extend(tree[product].pkgs)
+    git_cache = None
+    backend = None
+    if offline:
+        print(f"  {len(Config.CACHED_GIT_REPOS)} packages from snapshot")
+        Config.MISSING_GIT_REPOS.update([pkg for pkg in top_pkgs if pkg not in Config.CACHED_GIT_REPOS])
+    else:
+        if Config.GIT_BACKEND == 'graphql':
+            # a handful of queries, the persistent cache is not needed
+            backend = GraphQLBackend(token, gs)
+        elif Config.GIT_CACHE_FILE:
+            git_cache = GitRepoCache(Config.GIT_CACHE_FILE, gs, Config.GIT_REFRESH)
+        fetch_git_packages(top_pkgs, gs, Config.GIT_WORKERS, git_cache, backend)
+        print(f"\n  {len(Config.CACHED_GIT_REPOS)} packages fetched from GitHub")
+        if git_cache:
+            git_cache.save()
+            print(f"  {git_cache.summary()}")
+
     for tree in md_trees:
         for product in tree:
             if tree[product].pkgs:
                 for pkg in tree[product].pkgs:
-                    tmp_tree = get_git_tree(pkg, g, tree[product])
-                    if tmp_tree:
+                    tmp_tree = get_git_tree(pkg, gs, tree[product])
+                    if tmp_tree and tmp_tree['tree']:
                         root = tmp_tree['tree'].root
                         git_trees_dict[pkg] = {'root': tmp_tree['tree'][root].data, 'deps': tmp_tree['deps']}
                         # git_trees_dict[pkg] = tmp_tree['tree'][root].data
-                        print(f"({git_calls})")
+                        print(f"({gs.calls})")
                         graphs[pkg] = make_graph(git_trees_dict[pkg])
-
-    envs = Environment(loader=ChoiceLoader([FileSystemLoader(Config.TEMPLATE_DIRECTORY),
-                                           PackageLoader('ptree', 'templates')]),
-                       lstrip_blocks=True, trim_blocks=True, autoescape=None)
+    print(f"  {gs.summary()}")
+    metrics.set_counters('github', {'calls': gs.calls, 'waited': round(gs.waited, 3)})
+    if git_cache:
+        metrics.set_counters('git_cache', {'reused': git_cache.reused, 'fetched': git_cache.fetched,
+                                           'hit_rate': metrics.hit_rate(git_cache.reused, git_cache.fetched)})
 
     # convert objects dictionary to full dictionary
     all_pkgs = dict()
     for pkg in Config.CACHED_GIT_REPOS.keys():
-        all_pkgs[pkg] = Config.CACHED_GIT_REPOS[pkg].__dict__
+        all_pkgs[pkg] = Config.CACHED_GIT_REPOS[pkg].to_dict()
 
     try:
         template_path = f"gitsection.{Config.TEMPLATE_LANGUAGE}.jinja2"
-        template = envs.get_template(template_path)
+        template = get_template(template_path)
     except TemplateNotFound:
         click.echo(f"No Template Found: {template_path}", err=True)
         sys.exit(1)
     metadata = dict()
     metadata["template"] = template.filename
-    text = template.render(metadata=metadata,
-                           all_pkgs=all_pkgs,
-                           graphs=graphs,
-                           pkg_matrix=pkg_matrix,
-                           git_trees=git_trees_dict)
     tex_file_name = "git_pkgs_section.tex"
-    file = open(tex_file_name, "w")
-    print(_as_output_format(text, output_format), file=file)
-    file.close()
+    write_template(template, tex_file_name, output_format,
+                   dict(metadata=metadata,
+                        all_pkgs=all_pkgs,
+                        graphs=graphs,
+                        pkg_matrix=pkg_matrix,
+                        git_trees=git_trees_dict))
+    return pkg_matrix
 
 
-def get_gitpkg_content(pkg, g):
+def load_gitpkg(pkg, gs, git_cache):
     """
+    Get the package information from the persistent cache if still valid, otherwise from GitHub
+    :return: GitPkg or None, True if fetched from GitHub, the head to cache it with
+    """
+    head = None
+    if git_cache:
+        pkg_content, head = git_cache.lookup(pkg)
+        if pkg_content:
+            return pkg_content, False, None
+    return get_gitpkg_content(pkg, gs), True, head
 
-    :return:
+
+def convert_summaries(gitpkgs):
+    """
+    Convert to LaTeX, in a single batch, the GitHub descriptions
     """
-    global git_calls
+    summaries = html_to_latex_batch([gitpkg.summary for gitpkg in gitpkgs])
+    for gitpkg, summary in zip(gitpkgs, summaries):
+        gitpkg.summary = summary
 
-    sleep_time = 1  # delay seconds each time a call to git is done
-                    # to avoid rate limit problem
 
+def fetch_git_packages(pkgs, gs, workers, git_cache=None, backend=None):
+    """
+    Fetch from GitHub the packages and their full ups dependency closure, breadth first,
+    using concurrent workers. The results are stored in Config.CACHED_GIT_REPOS,
+    the packages that can't be retrieved in Config.MISSING_GIT_REPOS.
+    :param pkgs: list of package names
+    :param gs: GitScheduler executing the GitHub calls
+    :param workers: number of concurrent workers
+    :param git_cache: GitRepoCache with the packages from previous runs, or None
+    :param backend: GraphQLBackend retrieving each level in batches, or None to use the REST API
+    """
+    def todo(names):
+        return [name for name in dict.fromkeys(names)
+                if name != '' and name not in Config.CACHED_GIT_REPOS and name not in Config.MISSING_GIT_REPOS]
+
+    level = todo(pkgs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while level:
+            next_level = []
+            if backend:
+                fetched = backend.get_gitpkgs(level)
+                results = [(fetched[name], True, None) for name in level]
+            else:
+                try:
+                    results = list(pool.map(lambda name: load_gitpkg(name, gs, git_cache), level))
+                except GitHubAccessError:
+                    # do not wait for the packages still to fetch
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+            convert_summaries([pkg_content for pkg_content, is_new, head in results if pkg_content and is_new])
+            # the caches are updated only here, in the main thread
+            for pkg, (pkg_content, is_new, head) in zip(level, results):
+                if git_cache and pkg_content and is_new:
+                    git_cache.store(pkg, pkg_content, head)
+                if pkg_content:
+                    Config.CACHED_GIT_REPOS[pkg] = pkg_content
+                    next_level.extend(pkg_content.ups_table)
+                else:
+                    Config.MISSING_GIT_REPOS.add(pkg)
+            level = todo(next_level)
+
+
+def get_gitpkg_content(pkg, gs):
+    """
+    Get the package information from GitHub
+    :param pkg: package name, [org/]repo
+    :param gs: GitScheduler executing the GitHub calls
+    :return: GitPkg or None
+    :raise GitHubAccessError: if the organization can't be accessed
+    """
     readme = dict()
     ups_table = []
     pkg_teams = []
@@ -112,42 +211,30 @@ def get_gitpkg_content(pkg, g):
     if pkg == '':
         return None
 
-    spkg = pkg.split("/")
-    if len(spkg) == 2:
-        org = spkg[0]
-        repo = spkg[1]
-    else:
-        org = 'lsst'
-        repo = pkg
+    org, repo = split_pkg_name(pkg)
     # print(f"  > {pkg.strip()}", end="", flush=True)
     try:
-        git_calls = git_calls + 1
-        gg = g.get_organization(org)
-        time.sleep(sleep_time)
+        gg = gs.call(gs.g.get_organization, org)
         print(".", end="", flush=True)
     except Exception as ex:
-        print(f"[[Error accessing organization {org} --> git calls {git_calls}]]")
-        print(ex)
-        exit()
+        raise GitHubAccessError(f"Error accessing organization {org} (after {gs.calls} GitHub calls): {ex}")
     try:
-        git_calls = git_calls + 1
-        repository = gg.get_repo(repo)
-        time.sleep(sleep_time)
+        repository = gs.call(gg.get_repo, repo)
+        # get_repo may return a lazy object (PyGithub 2), the description loads it
+        raw_description = gs.call(lambda: repository.description)
         print(".", end="", flush=True)
     except Exception as ex:
         print(f"eRE({repo})]]", end="", flush=True)
         # print(f"[[Error accessing repository {repo} in organization {org} --> {ex}]]", end="", flush=True)
         return None
-    git_calls = git_calls + 1
-    rc = repository.get_contents("")
-    time.sleep(sleep_time)
+    rc = gs.call(repository.get_contents, "")
     print(".", end="", flush=True)
     # finding the readme(s?) and dependencies
     for f in rc:
         if "README" in f.path:
             readme_file = f.path
             try:
-                readme_full = repository.get_file_contents(readme_file).decoded_content
+                readme_full = gs.call(repository.get_contents, readme_file).decoded_content
             except:
                 print(f"eRM({repo})", end="", flush=True)
                 # print(f"[[Error in reading {repo} {readme_file} (readme) file]]", end="", flush=True)
@@ -158,37 +245,25 @@ def get_gitpkg_content(pkg, g):
         if "ups" in f.path:
             ups_path = 'ups/' + repo + '.table'
             try:
-                git_calls = git_calls + 1
-                ups_content = repository.get_file_contents(ups_path).decoded_content.decode('UTF-8').splitlines()
-                time.sleep(sleep_time)
+                ups_content = gs.call(repository.get_contents, ups_path).decoded_content.decode('UTF-8').splitlines()
                 print(".", end="", flush=True)
             except:
                 print(f"eUT({repo})", end="", flush=True)
                 # print(f"[[Error in reading {repo} {ups_path} (ups table) file]]", end="", flush=True)
                 return None
-            for line in ups_content:
-                if "setupRequired" in line and line[:1] != "#":
-                    # dependency = fix_tex(re.search(r'\((.*?)\)', line).group(1))
-                    dependency = re.search(r'\((.*?)\)', line).group(1)
-                    # use only what in "
-                    if dependency[:1] == "\"":
-                        dependency = re.search(r'\"(.*?)\"', dependency).group(1)
-                    if dependency not in ups_table:
-                        ups_table.append(dependency)
-
-    # get description
-    raw_description = repository.description
+            for dependency in parse_ups_table(ups_content):
+                if dependency not in ups_table:
+                    ups_table.append(dependency)
+
+    # description, converted to LaTeX by convert_summaries
     if raw_description:
-        pkg_desc = html_to_latex(raw_description)
+        pkg_desc = raw_description
 
     # get teams
     try:
-        git_calls = git_calls + 1
-        teams = repository.get_teams()
-        time.sleep(sleep_time)
+        # the team list is paginated, it is retrieved when iterated
+        pkg_teams = gs.call(lambda: [t.name for t in repository.get_teams()])
         print(".", end="", flush=True)
-        for t in teams:
-            pkg_teams.append(t.name)
     except:
         print(f"eT({repo})", end="", flush=True)
         # print(f"[[Error getting teams for {repo}]]", end="", flush=True)
@@ -206,7 +281,7 @@ def get_gitpkg_content(pkg, g):
     return gp
 
 
-def get_git_tree(pkg, g, top_prd):
+def get_git_tree(pkg, gs, top_prd):
     """
 
     :return:
@@ -226,8 +301,12 @@ def get_git_tree(pkg, g, top_prd):
     if pkg in Config.CACHED_GIT_REPOS:
         pkg_content = Config.CACHED_GIT_REPOS[pkg]
         print("^", end="", flush=True)
+    elif pkg in Config.MISSING_GIT_REPOS:
+        pkg_content = None
     else:
-        pkg_content = get_gitpkg_content(pkg, g)
+        pkg_content = get_gitpkg_content(pkg, gs)
+        if pkg_content:
+            convert_summaries([pkg_content])
 
     if pkg_content:
         # first node in the tree
@@ -245,7 +324,7 @@ def get_git_tree(pkg, g, top_prd):
             Config.CACHED_GIT_REPOS[pkg] = pkg_content
             print("+", end="", flush=True)
         for child in pkg_content.ups_table:
-            walk_git_tree(child, g, pkg_content.key, top_prd)
+            walk_git_tree(child, gs, pkg_content.key, top_prd)
     else:
         return {'tree': None, 'deps': None}
     # print(pkg_tree)
@@ -253,11 +332,11 @@ def get_git_tree(pkg, g, top_prd):
     return {'tree': pkg_tree, 'deps': pkg_list}
 
 
-def walk_git_tree(pkg, g, pkey, top_prd):
+def walk_git_tree(pkg, gs, pkey, top_prd):
     """
 
     :param pkg:
-    :param g:
+    :param gs: GitScheduler executing the GitHub calls
     :return:
     """
     global pkg_tree
@@ -271,9 +350,12 @@ def walk_git_tree(pkg, g, pkey, top_prd):
     if pkg in Config.CACHED_GIT_REPOS.keys():
         pkg_content = Config.CACHED_GIT_REPOS[pkg]
         print("^", end="", flush=True)
+    elif pkg in Config.MISSING_GIT_REPOS:
+        pkg_content = None
     else:
-        pkg_content = get_gitpkg_content(pkg, g)
+        pkg_content = get_gitpkg_content(pkg, gs)
         if pkg_content:
+            convert_summaries([pkg_content])
             Config.CACHED_GIT_REPOS[pkg] = pkg_content
             print("+", end="", flush=True)
 
@@ -290,7 +372,7 @@ def walk_git_tree(pkg, g, pkey, top_prd):
             pkg_tree.create_node(pkg_content.key, pkg_content.key, data=pkg_content, parent=pkey)
             pkg_list[pkg_content.name] = {"parents": [pkey], "childs": pkg_content.ups_table}
             for child in pkg_content.ups_table:
-                walk_git_tree(child, g, pkg_content.key, top_prd)
+                walk_git_tree(child, gs, pkg_content.key, top_prd)
         else:
             if pkey not in pkg_list[pkg_content.name]["parents"]:
                 pkg_list[pkg_content.name]["parents"].append(pkey)
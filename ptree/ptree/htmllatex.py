@@ -0,0 +1,308 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+In process conversion of simple html fragments to LaTeX, producing the same output as pandoc.
+Only paragraphs, bold, italic, links, line breaks and flat bullet lists are supported,
+anything else (other tags, characters that pandoc rewrites) makes the conversion return None,
+so that the fragment can be given to pandoc.
+"""
+
+import re
+from html.parser import HTMLParser
+
+LINE_WIDTH = 72  # pandoc default --columns
+LIST_INDENT = 2
+
+# characters escaped with a backslash
+ESCAPES = {'&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#', '_': r'\_', '{': r'\{', '}': r'\}',
+           '[': '{[}', ']': '{]}', '\xa0': '~'}
+# characters that pandoc rewrites depending on the context, or that are not one column wide
+UNSUPPORTED_CHARS = re.compile('[~^\\\\<>|\'"`\x00-\x08\x0b-\x1f\x7f-\x9f\u00ad\u0300-\u036f\u1100-\U0010ffff]|--')
+URL_CHARS = re.compile(r"^[A-Za-z0-9:/._\-?=%#+,;@!*()]+$")
+INLINE_TAGS = {'b': r'\textbf{', 'strong': r'\textbf{', 'i': r'\emph{', 'em': r'\emph{'}
+IGNORED_TAGS = ('html', 'body')
+SKIPPED_TAGS = ('head', 'style', 'title', 'script')
+VOID_TAGS = ('meta', 'link')
+
+SPACE = 0
+BREAK = 1
+
+
+class Unsupported(Exception):
+    pass
+
+
+def escape_text(text):
+    if UNSUPPORTED_CHARS.search(text):
+        raise Unsupported(text)
+    return "".join([ESCAPES.get(char, char) for char in text])
+
+
+def escape_url(url):
+    if not URL_CHARS.match(url):
+        raise Unsupported(url)
+    return url.replace('%', r'\%').replace('#', r'\#')
+
+
+class FragmentParser(HTMLParser):
+    """
+    Splits a fragment in blocks: ('para', inlines) or ('list', [inlines, ...]).
+    The inlines are text strings, SPACE, BREAK and LaTeX command parts (('cmd', text))
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.blocks = []
+        self.inlines = None      # inlines of the current paragraph or list item
+        self.items = None        # items of the current list
+        self.stack = []          # open inline tags
+        self.links = []          # (href, position in inlines) of the open links
+        self.skip = 0
+
+    def start_para(self):
+        if self.inlines is None:
+            self.inlines = []
+            self.blocks.append(('para', self.inlines))
+
+    def end_para(self):
+        if self.stack:
+            raise Unsupported("block in inline element")
+        self.inlines = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip = self.skip + 1
+        elif self.skip or tag in IGNORED_TAGS or tag in VOID_TAGS:
+            pass
+        elif tag == 'p':
+            if self.items is not None:
+                raise Unsupported("paragraph in list")
+            self.end_para()
+            self.start_para()
+        elif tag == 'ul':
+            if self.items is not None:
+                raise Unsupported("nested list")
+            self.end_para()
+            self.items = []
+            self.blocks.append(('list', self.items))
+        elif tag == 'li':
+            if self.items is None or self.stack:
+                raise Unsupported("list item outside list")
+            self.inlines = []
+            self.items.append(self.inlines)
+        elif tag in INLINE_TAGS or tag == 'a':
+            self.start_inline()
+            self.stack.append(tag)
+            if tag == 'a':
+                if self.links:
+                    raise Unsupported("nested link")
+                href = dict(attrs).get('href')
+                if not href:
+                    raise Unsupported("link without href")
+                self.links.append((href, len(self.inlines)))
+            else:
+                self.inlines.append(('cmd', INLINE_TAGS[tag]))
+        elif tag == 'br':
+            self.start_inline()
+            self.inlines.append(BREAK)
+        else:
+            raise Unsupported(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ('br',) + VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip = self.skip - 1
+        elif self.skip or tag in IGNORED_TAGS or tag in VOID_TAGS or tag == 'br':
+            pass
+        elif tag == 'p':
+            self.end_para()
+        elif tag == 'li':
+            if self.stack:
+                raise Unsupported("unclosed inline element")
+            self.inlines = None
+        elif tag == 'ul':
+            if self.stack:
+                raise Unsupported("unclosed inline element")
+            self.items = None
+            self.inlines = None
+        elif tag in INLINE_TAGS or tag == 'a':
+            if not self.stack or self.stack[-1] != tag:
+                raise Unsupported("misnested " + tag)
+            self.stack.pop()
+            if tag == 'a':
+                self.close_link()
+            else:
+                if not [x for x in self.inlines[self.last_cmd():] if isinstance(x, str)]:
+                    raise Unsupported("empty " + tag)
+                self.inlines.append(('cmd', '}'))
+        else:
+            raise Unsupported(tag)
+
+    def last_cmd(self):
+        for i in range(len(self.inlines) - 1, -1, -1):
+            if isinstance(self.inlines[i], tuple) and self.inlines[i][1] != '}':
+                return i
+        return 0
+
+    def close_link(self):
+        href, start = self.links.pop()
+        content = self.inlines[start:]
+        text = [x for x in content if isinstance(x, str)]
+        if not text:
+            raise Unsupported("empty link")
+        if "".join([x if isinstance(x, str) else " " for x in content]) == href:
+            del self.inlines[start:]
+            self.inlines.append(('cmd', r'\url{' + escape_url(href) + '}'))
+        else:
+            self.inlines.insert(start, ('cmd', r'\href{' + escape_url(href) + '}{'))
+            self.inlines.append(('cmd', '}'))
+
+    def start_inline(self):
+        if self.items is not None and self.inlines is None:
+            raise Unsupported("text in list")
+        self.start_para()
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        if not data.strip(' \t\n\r'):
+            if data and self.inlines is not None:
+                self.inlines.append(SPACE)
+            return
+        self.start_inline()
+        words = re.split(r'[ \t\n\r]+', data)
+        for i, word in enumerate(words):
+            if i > 0:
+                self.inlines.append(SPACE)
+            if word:
+                self.inlines.append(word)
+
+    def close(self):
+        HTMLParser.close(self)
+        if self.stack or self.skip:
+            raise Unsupported("unclosed element")
+
+
+def is_open(item):
+    """ True for the beginning of a bold, italic or link command """
+    return isinstance(item, tuple) and item[1].endswith('{')
+
+
+def words_of(inlines):
+    """
+    Returns the lines of words (lists of strings not to be broken) of the inlines, split at the line breaks
+    """
+    # spaces at the beginning or end of bold/italic/link text go outside
+    items = list(inlines)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(items) - 1):
+            a, b = items[i], items[i + 1]
+            if is_open(a) and b == SPACE:
+                items[i], items[i + 1] = b, a
+                changed = True
+            elif a == SPACE and isinstance(b, tuple) and b[1] == '}':
+                items[i], items[i + 1] = b, a
+                changed = True
+    # pandoc writes the line breaks not between text as \hfill\break
+    for i, item in enumerate(items):
+        if item == BREAK:
+            before = [x for x in items[:i] if x != SPACE][-1:]
+            after = [x for x in items[i + 1:] if x != SPACE][:1]
+            if not before or not after or before[0] == BREAK or is_open(before[0]) or \
+                    not (isinstance(after[0], str) or is_open(after[0])):
+                raise Unsupported("line break")
+        # pandoc merges adjacent bold or italic elements
+        elif item == ('cmd', '}') and i + 1 < len(items) and is_open(items[i + 1]):
+            raise Unsupported("adjacent elements")
+    lines = [[]]
+    word = None
+    for item in items:
+        if item == BREAK:
+            if word is not None:
+                lines[-1].append(word)
+            word = None
+            lines.append([])
+        elif item == SPACE:
+            if word is not None:
+                lines[-1].append(word)
+            word = None
+        else:
+            text = item[1] if isinstance(item, tuple) else escape_text(item)
+            word = text if word is None else word + text
+    if word is not None:
+        lines[-1].append(word)
+    return lines
+
+
+def wrap(inlines, width):
+    """
+    Fill the words in lines of at most width characters, where possible
+    """
+    out = []
+    lines = words_of(inlines)
+    for count, words in enumerate(lines):
+        line = ""
+        if count < len(lines) - 1:
+            # the line break is part of the last word
+            words[-1] = words[-1] + "\\\\"
+        for word in words:
+            if line and len(line) + 1 + len(word) > width:
+                out.append(line)
+                line = word
+            elif line:
+                line = line + " " + word
+            else:
+                line = word
+        out.append(line)
+    return out
+
+
+def html_to_latex(fragment):
+    """
+    Returns the LaTeX conversion of fragment, None if it uses html not supported here
+    """
+    parser = FragmentParser()
+    try:
+        parser.feed(fragment)
+        parser.close()
+        blocks = []
+        for kind, content in parser.blocks:
+            if kind == 'para':
+                lines = wrap(content, LINE_WIDTH)
+                if "".join(lines):
+                    blocks.append("\n".join(lines))
+            else:
+                if not content:
+                    raise Unsupported("empty list")
+                text = "\\begin{itemize}\n\\tightlist\n"
+                for item in content:
+                    lines = wrap(item, LINE_WIDTH - LIST_INDENT)
+                    text = text + "\\item\n" + "".join([" " * LIST_INDENT + line + "\n" for line in lines if line])
+                blocks.append(text + "\\end{itemize}")
+    except Unsupported:
+        return None
+    return "\n\n".join(blocks) + "\n"
@@ -19,8 +19,10 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 
 
+import os
 from graphviz import Digraph
 from .config import Config
+from .util import write_if_changed
 
 
 def walk_deps(pkg):
@@ -68,7 +70,9 @@ def make_graph(tree_data):
                 # print(" ** -- ", Config.CACHED_GIT_REPOS[dep].ups_table)
 
         graph_file = "dot/" + root.name.lower() + ".dot"
-        dot.render(graph_file)
+        # render (running dot) only if the graph changed
+        if write_if_changed(graph_file, dot.source) or not os.path.exists(graph_file + "." + graph_format):
+            dot.render(graph_file)
 
         return graph_file + ".ps"
     else:
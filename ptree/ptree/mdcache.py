@@ -0,0 +1,181 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Persistent cache of the MagicDraw (Teamwork Cloud) REST elements
+"""
+
+import os
+import json
+import sqlite3
+import threading
+
+
+class ElementCache(object):
+    """
+    Element responses, as returned by rsget, keyed by request url.
+    The content is valid for one trunk revision per MagicDraw resource:
+    when the revision moves, only the changed elements are dropped (if known),
+    otherwise the whole resource content is invalidated.
+    If no path is given the cache lives only in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.elements = dict()
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            folder = os.path.dirname(path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS elements "
+                             "(url TEXT PRIMARY KEY, res TEXT, comp TEXT, body TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS elements_comp ON elements (res, comp)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS revisions (res TEXT PRIMARY KEY, revision TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS features "
+                             "(res TEXT, comp TEXT, name TEXT, PRIMARY KEY (res, comp))")
+            self._db.commit()
+
+    @staticmethod
+    def split_url(url):
+        """
+        Returns the resource and the element id of a MD_COMP_URL
+        """
+        parts = url.rstrip('/').split('/')
+        if len(parts) > 3 and parts[-2] == 'elements':
+            return parts[-3], parts[-1]
+        return "", parts[-1]
+
+    def get(self, url):
+        with self._lock:
+            if url in self.elements:
+                self.hits = self.hits + 1
+                return self.elements[url]
+            if self._db:
+                row = self._db.execute("SELECT body FROM elements WHERE url = ?", (url,)).fetchone()
+                if row:
+                    element = json.loads(row[0])
+                    self.elements[url] = element
+                    self.hits = self.hits + 1
+                    return element
+            self.misses = self.misses + 1
+        return None
+
+    def put(self, url, element):
+        with self._lock:
+            self.elements[url] = element
+            if self._db:
+                res, comp = self.split_url(url)
+                self._db.execute("INSERT OR REPLACE INTO elements VALUES (?, ?, ?, ?)",
+                                 (url, res, comp, json.dumps(element)))
+                self._pending = self._pending + 1
+                if self._pending >= 500:
+                    self._db.commit()
+                    self._pending = 0
+
+    def get_features(self, res):
+        """
+        Returns the persisted property names of res, as dictionary definingFeature id: name
+        """
+        if not self._db:
+            return dict()
+        with self._lock:
+            rows = self._db.execute("SELECT comp, name FROM features WHERE res = ?", (res,)).fetchall()
+        return dict(rows)
+
+    def put_features(self, res, features):
+        if not self._db:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?)",
+                                 [(res, comp, name) for comp, name in features.items()])
+            self._db.commit()
+
+    def get_revision(self, res):
+        """
+        Returns the trunk revision the cached content of res refers to
+        """
+        if not self._db:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT revision FROM revisions WHERE res = ?", (res,)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def set_revision(self, res, revision, changed=None):
+        """
+        Move the cached content of res to a new revision
+        :param res: MagicDraw resource id
+        :param revision: the new trunk revision
+        :param changed: ids of the elements changed since the cached revision,
+                        None if unknown (in this case all res elements are dropped)
+        :return: number of invalidated elements
+        """
+        with self._lock:
+            if changed is None:
+                dropped = [url for url in self.elements if self.split_url(url)[0] == res]
+            else:
+                dropped = [url for url in self.elements
+                           if self.split_url(url)[0] == res and self.split_url(url)[1] in changed]
+            for url in dropped:
+                del self.elements[url]
+            count = len(dropped)
+            if self._db:
+                if changed is None:
+                    cur = self._db.execute("DELETE FROM elements WHERE res = ?", (res,))
+                    count = cur.rowcount
+                    self._db.execute("DELETE FROM features WHERE res = ?", (res,))
+                else:
+                    count = 0
+                    for comp in changed:
+                        cur = self._db.execute("DELETE FROM elements WHERE res = ? AND comp = ?", (res, comp))
+                        count = count + cur.rowcount
+                        self._db.execute("DELETE FROM features WHERE res = ? AND comp = ?", (res, comp))
+                self._db.execute("INSERT OR REPLACE INTO revisions VALUES (?, ?)", (res, revision))
+                self._db.commit()
+        return count
+
+    def comments(self):
+        """
+        Returns the (html) bodies of the cached uml:Comment elements
+        """
+        elements = list(self.elements.values())
+        if self._db:
+            with self._lock:
+                elements = [json.loads(row[0]) for row in self._db.execute("SELECT body FROM elements")]
+        bodies = []
+        for element in elements:
+            data = element[1] if isinstance(element, list) and len(element) > 1 else element
+            if isinstance(data, dict) and data.get('@type') == 'uml:Comment':
+                bodies.append(data['kerml:esiData']['body'])
+        return bodies
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._db.commit()
+                self._db.close()
+                self._db = None
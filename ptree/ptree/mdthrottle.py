@@ -0,0 +1,171 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Retry policy of the MagicDraw (Teamwork Cloud) REST requests
+"""
+
+import time
+import random
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+
+# responses meaning that the server is refusing requests for a while
+THROTTLE_STATUS = (401, 429, 503)
+
+
+class MDAuthError(Exception):
+    """ The MagicDraw server does not accept the credentials """
+    pass
+
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average, with bursts up to capacity requests
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, returns the seconds to wait before using it
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens = self.tokens - 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+def retry_after(resp):
+    """
+    Seconds requested by the Retry-After header of the response, None if not given
+    """
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (date - datetime.datetime.now(date.tzinfo)).total_seconds())
+
+
+class MDThrottle(object):
+    """
+    Sends the MagicDraw requests, retrying the ones refused by the server.
+    Teamwork Cloud answers 401 both to wrong credentials and when the max number of sessions is reached:
+    a 401 before any request succeeded is retried only auth_retries times, then it is an authentication failure.
+    The other refusals (401 after a success, 429, 503) are retried with exponential backoff and jitter,
+    or after the time given in Retry-After. The wait is shared by all the threads.
+    If rate is given, a token bucket keeps the requests under rate per second.
+    """
+
+    def __init__(self, rate=0, burst=1, base=5, max_wait=600, max_retries=10, auth_retries=2):
+        """
+        :param rate: max requests per second (0 for no limit)
+        :param burst: requests that can be sent at once within the rate
+        :param base: first backoff wait (seconds), doubled at each consecutive refusal
+        :param max_wait: max backoff wait (seconds)
+        :param max_retries: retries of a request before giving up
+        :param auth_retries: retries of a 401 before any success
+        """
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.base = base
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.auth_retries = auth_retries
+        self.authorized = False
+        self.resume_at = 0
+        self.refusals = 0    # consecutive refusals
+        self.requests = 0
+        self.retries = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Wait for the end of a backoff and for the token bucket
+        """
+        pause = self.resume_at - time.time()
+        if self.bucket:
+            pause = max(pause, 0) + self.bucket.reserve()
+        if pause > 0:
+            with self._lock:
+                self.waited = self.waited + pause
+            time.sleep(pause)
+
+    def backoff(self, resp):
+        """
+        Suspend the requests after a refusal
+        :return: the seconds to wait
+        """
+        with self._lock:
+            self.refusals = self.refusals + 1
+            wait = retry_after(resp)
+            if wait is None:
+                wait = min(self.max_wait, self.base * 2 ** (self.refusals - 1)) * random.uniform(0.5, 1)
+            self.resume_at = max(self.resume_at, time.time() + wait)
+        return wait
+
+    def send(self, request, url):
+        """
+        Send a request until it is not refused
+        :param request: function doing the request, returns the response
+        :param url: for the messages
+        :raise MDAuthError: if the credentials are not accepted
+        """
+        attempt = 0
+        while True:
+            self.wait()
+            resp = request()
+            with self._lock:
+                self.requests = self.requests + 1
+            if resp.status_code not in THROTTLE_STATUS:
+                with self._lock:
+                    self.authorized = self.authorized or resp.status_code < 400
+                    self.refusals = 0
+                return resp
+            if resp.status_code == 401 and not self.authorized and attempt >= self.auth_retries:
+                raise MDAuthError(f"MagicDraw server refused the credentials (401 on {url})")
+            if attempt >= self.max_retries:
+                resp.raise_for_status()
+            attempt = attempt + 1
+            with self._lock:
+                self.retries = self.retries + 1
+            wait = self.backoff(resp)
+            now = datetime.datetime.now()
+            print(now.strftime("%H:%M:%S"), f'MagicDraw server refused the request ({resp.status_code}), '
+                                            f'waiting {wait:.1f} seconds before retry {attempt}:')
+            print('  --  ', url)
+
+    def summary(self):
+        return f"{self.requests} MagicDraw requests, {self.retries} retries, {self.waited:.1f}s waiting"
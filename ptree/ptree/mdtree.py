@@ -21,19 +21,26 @@
 """
 Code for generation Product Tree document from MagicDraw
 """
-import requests
 import click
 import sys
 import os
-import csv
+import io
+from concurrent.futures import ThreadPoolExecutor
 from .config import Config
-from jinja2 import Environment, PackageLoader, TemplateNotFound, ChoiceLoader, FileSystemLoader
-from .util import get_pkg_properties, rsget, fix_tex, fix_id_tex, Product, html_to_latex, get_yaml, _as_output_format
-from .tree import make_tree_portrait, make_tree_landmix1, make_subtrees, make_full_tree
+from .util import get_pkg_properties, rsget, fix_tex, fix_id_tex, Product, html_to_latex_batch, get_yaml
+from .util import md_session, md_throttle, md_get_elements, md_feature_names, md_forget_features, write_if_changed, OutputManifest
+from .tree import make_tree_portrait, make_tree_landmix1, make_subtrees, make_full_tree, TreeIndex
+from . import treeview
+from . import producttable
+from . import metrics
+from .render import get_template, write_template
 from treelib import Tree
 from .gittree import do_github_section
+from .snapshot import Snapshot
 
 requirements = {}
+# definingFeature of the requirement Id property
+REQ_ID_FEATURE = "ff8cae42-782e-4158-aed0-56d589bfa42b"
 
 
 def get_dep_key(rcs, mres, mdid):
@@ -107,10 +114,10 @@ def get_requirements(rcs, mres, mdid):
         req['name'] = fix_tex(supplier[1]["kerml:name"]).lstrip('0123456789.- ')
         ispec_id = supplier[1]["kerml:esiData"]["appliedStereotypeInstance"]['@id']
         ispec = rsget(rcs, Config.MD_COMP_URL.format(res=mres, comp=ispec_id), True)
-        for el in ispec[0]["ldp:contains"]:
-            tmp_resp = rsget(rcs, Config.MD_COMP_URL.format(res=mres, comp=el['@id']), True)
+        slots = md_get_elements(rcs, mres, [el['@id'] for el in ispec[0]["ldp:contains"]])
+        for tmp_resp in slots:
             # print(tmp_resp[1]["kerml:esiData"]["definingFeature"])
-            if tmp_resp[1]["kerml:esiData"]["definingFeature"]['@id'] == "ff8cae42-782e-4158-aed0-56d589bfa42b":
+            if tmp_resp[1]["kerml:esiData"]["definingFeature"]['@id'] == REQ_ID_FEATURE:
                 lpd = tmp_resp[0]["ldp:contains"]
                 slot_resp = rsget(rcs, Config.MD_COMP_URL.format(res=mres, comp=lpd[0]['@id']), True)
                 # print(slot_resp[0]["@type"])
@@ -121,13 +128,11 @@ def get_requirements(rcs, mres, mdid):
     return req
 
 
-def walk_tree(rcs, mres, mdid, pkey):
+def get_product(rcs, mres, mdid, pkey):
     """ Product Class Object
-    id, name, parent, desc, wbs, manager, owner, kind, pkgs, elId"""
-
-    global products_count
-    global productTree
-    products_count = products_count + 1
+    id, name, parent, desc, wbs, manager, owner, kind, pkgs, elId
+    Returns a dictionary with the product and the MD ids of its sub packages and classes,
+    or None if the product is obsolete"""
 
     resp = rsget(rcs, Config.MD_COMP_URL.format(res=mres, comp=mdid), True)
     if resp[1]['@type'] not in ('uml:Package', 'uml:Class'):
@@ -138,7 +143,9 @@ def walk_tree(rcs, mres, mdid, pkey):
         pkg_index = int(resp[1]['kerml:name'].split()[0])
     except ValueError:
         pkg_index = ""
-    print(f"{products_count}: {pkg_name}.{pkg_index}", end='')
+    if any(x in pkg_name for x in ["Obsolete", "obsolete"]):
+        # When an OBSOLETE product is found, it is not added to the Tree
+        return None
     # print(Config.MD_COMP_URL.format(res=mres, comp=mdid))
     pkg_sub_pkgs = []
     pkg_classes = []
@@ -148,19 +155,14 @@ def walk_tree(rcs, mres, mdid, pkey):
     pkg_usedin = []
     reqs = []
 
-    for el in resp[0]['ldp:contains']:
-        tmp = rsget(rcs, Config.MD_COMP_URL.format(res=mres, comp=el['@id']), True)
+    contained = md_get_elements(rcs, mres, [el['@id'] for el in resp[0]['ldp:contains']])
+    for el, tmp in zip(resp[0]['ldp:contains'], contained):
         if tmp[1]['@type'] == 'uml:Package':
             pkg_sub_pkgs.append(el['@id'])
         elif tmp[1]['@type'] == 'uml:Class':
             pkg_classes.append(el['@id'])
         elif tmp[1]['@type'] == 'uml:InstanceSpecification':
             pkg_properties = get_pkg_properties(rcs, mres, el['@id'])
-            if 'product key' in pkg_properties.keys():
-                print(f" ({{k}}), ".format(k=pkg_properties['product key'][0]), end='')
-                sys.stdout.flush()
-            else:
-                print(" () ", end="")
         elif tmp[1]['@type'] == 'uml:Property':
             continue
         elif tmp[1]['@type'] == 'uml:Comment':
@@ -178,7 +180,6 @@ def walk_tree(rcs, mres, mdid, pkey):
         nreqs = len(reqs)
         if nreqs > 1:
             reqs = sorted(reqs, key= lambda req: req['id'])
-        print(f"[{nreqs}] -- ", end='')
         # get dependencies
         if resp[1]['kerml:esiData']['_typedElementOfType']:
             for typed in resp[1]['kerml:esiData']['_typedElementOfType']:
@@ -245,42 +246,83 @@ def walk_tree(rcs, mres, mdid, pkey):
                                     if relation not in pkg_usedin:
                                         pkg_usedin.append(relation)
 
-    if not any(x in pkg_name for x in ["Obsolete", "obsolete"]):
-        # When an OBSOLETE product is found, it is not added to the Tree
-        pkg_id = fix_id_tex(pkg_properties['product key'][0])
-        prod = Product(pkg_id,                            # 1  (0 is self)
-                       pkg_name.strip(),                  # 2
-                       pkey,                              # 3
-                       html_to_latex(pkg_comments),       # 4
-                       pkg_properties["WBS"],             # 5
-                       pkg_properties["manager"][0],      # 6
-                       pkg_properties["product owner"],   # 7
-                       "",                                # 8
-                       pkg_properties["packages"],        # 9
-                       pkg_depends,                       # 10
-                       mdid,                              # 11
-                       pkg_properties["hyperlinkText"],   # 12
-                       pkg_properties["team"],            # 13
-                       html_to_latex(pkg_properties["short name"][0].strip()),   # 14 - shortname
-                       pkg_usedin,                        # 15
-                       reqs,                              # 16
-                       pkg_properties["docs"],            # 17
-                       pkg_index)                         # 18
-        if pkey == "":  # first node in the tree
-            prod.name = prod.shortname  # this is required, since the first node in MD usually is not meaningful.
-            productTree.create_node(prod.id, prod.id, data=prod)
-        else:
-            if pkey != '':
-                productTree.create_node(prod.id, prod.id, data=prod, parent=prod.parent)
-            else:
-                print('No parent for product:', pkg_name)
-                exit()
+    pkg_id = fix_id_tex(pkg_properties['product key'][0])
+    prod = Product(pkg_id,                            # 1  (0 is self)
+                   pkg_name.strip(),                  # 2
+                   pkey,                              # 3
+                   pkg_comments,                      # 4  html, see convert_products
+                   pkg_properties["WBS"],             # 5
+                   pkg_properties["manager"][0],      # 6
+                   pkg_properties["product owner"],   # 7
+                   "",                                # 8
+                   pkg_properties["packages"],        # 9
+                   pkg_depends,                       # 10
+                   mdid,                              # 11
+                   pkg_properties["hyperlinkText"],   # 12
+                   pkg_properties["team"],            # 13
+                   pkg_properties["short name"][0].strip(),   # 14 - shortname, html
+                   pkg_usedin,                        # 15
+                   reqs,                              # 16
+                   pkg_properties["docs"],            # 17
+                   pkg_index)                         # 18
+    return {'product': prod, 'children': pkg_sub_pkgs + pkg_classes}
+
+
+def prefetch_level(rcs, mres, mdids):
+    """ Retrieve in bulk the elements of a tree level, the elements they contain
+    and the product properties (slots, defining features and values),
+    so that get_product finds them in Config.MD_CACHE"""
+    if not Config.MD_CACHE:
+        return
+    elements = md_get_elements(rcs, mres, mdids)
+    contained = []
+    for element in elements:
+        contained.extend([el['@id'] for el in element[0]['ldp:contains']])
+    slot_ids = []
+    for element in md_get_elements(rcs, mres, contained):
+        if element[1]['@type'] == 'uml:InstanceSpecification':
+            slot_ids.extend([el['@id'] for el in element[0]['ldp:contains']])
+    feature_ids = []
+    value_ids = []
+    for slot in md_get_elements(rcs, mres, slot_ids):
+        if slot[1]['@type'] == 'uml:Slot':
+            feature_ids.append(slot[1]['kerml:esiData']['definingFeature']['@id'])
+            value_ids.extend([el['@id'] for el in slot[0]['ldp:contains']])
+    md_feature_names(rcs, mres, feature_ids)
+    instance_ids = [value[1]['kerml:esiData']['instance']['@id']
+                    for value in md_get_elements(rcs, mres, value_ids) if value[1]['@type'] == 'uml:InstanceValue']
+    md_get_elements(rcs, mres, instance_ids)
 
-        for pkg in pkg_sub_pkgs:
-            walk_tree(rcs, mres, pkg, pkg_id)
 
-        for cls in pkg_classes:
-            walk_tree(rcs, mres, cls, pkg_id)
+def walk_tree(rcs, mres, mdid, pkey):
+    """ Walk the MagicDraw tree starting from mdid and add the products to productTree.
+    The tree is crawled one level at the time: the products in the same level are fetched
+    concurrently, and added to the tree in the MagicDraw order (packages first, then classes)"""
+
+    global products_count
+    global productTree
+
+    level = [(mdid, pkey)]
+    with ThreadPoolExecutor(max_workers=Config.MD_MAX_IN_FLIGHT) as pool:
+        while level:
+            next_level = []
+            prefetch_level(rcs, mres, [item[0] for item in level])
+            results = pool.map(lambda item: get_product(rcs, mres, item[0], item[1]), level)
+            for (el_id, parent), result in zip(level, results):
+                products_count = products_count + 1
+                if result is None:
+                    print(f"{products_count}: obsolete ({el_id}), ", end='')
+                    continue
+                prod = result['product']
+                print(f"{products_count}: {prod.name}.{prod.index} ({prod.id}) [{len(prod.reqs)}] -- ", end='')
+                sys.stdout.flush()
+                if parent == "":
+                    productTree.create_node(prod.id, prod.id, data=prod)
+                else:
+                    productTree.create_node(prod.id, prod.id, data=prod, parent=prod.parent)
+                for child in result['children']:
+                    next_level.append((child, prod.id))
+            level = next_level
 
 
 def get_md_revision(rs, mres, mdid):
@@ -288,7 +330,7 @@ def get_md_revision(rs, mres, mdid):
     Returns the last trunk MagicDraw revision that is extracted
 
     """
-    resp = rsget(rs, Config.MD_COMP_URL.format(res=mres, comp=mdid), True)
+    resp = rsget(rs, Config.MD_COMP_URL.format(res=mres, comp=mdid), True, cached=False)
     if resp[1]['kerml:revision']:
         rev_path = resp[1]['kerml:revision']
         rev_split = rev_path.split("/")
@@ -297,27 +339,88 @@ def get_md_revision(rs, mres, mdid):
         return "---"
 
 
+def get_md_changed_elements(rs, mres, source, target):
+    """
+    Returns the ids of the elements changed between two MagicDraw revisions,
+    or None if the revision difference is not available
+
+    """
+    req = rs.get(Config.MD_REVDIFF_URL.format(res=mres, source=source, target=target), verify=True)
+    if req.status_code != 200:
+        return None
+    try:
+        diff = req.json()
+    except ValueError:
+        return None
+    if not isinstance(diff, dict):
+        return None
+    changed = set()
+    for entries in diff.values():
+        if isinstance(entries, list):
+            for entry in entries:
+                if isinstance(entry, dict) and '@id' in entry:
+                    changed.add(entry['@id'])
+                elif isinstance(entry, str):
+                    changed.add(entry)
+    return changed
+
+
+def update_md_cache(rs, mres, md_revision):
+    """
+    Align the MagicDraw element cache to the given trunk revision.
+    Only the elements changed since the cached revision are invalidated.
+    """
+    cache = Config.MD_CACHE
+    if not cache:
+        return
+    cached_revision = cache.get_revision(mres)
+    if cached_revision == md_revision:
+        print("  Element cache up to date with revision", md_revision)
+        return
+    changed = None
+    if cached_revision and cached_revision != "---" and md_revision != "---":
+        changed = get_md_changed_elements(rs, mres, cached_revision, md_revision)
+    dropped = cache.set_revision(mres, md_revision, changed)
+    md_forget_features(mres, changed)
+    if changed is None:
+        print(f"  Element cache reset (was revision {cached_revision})")
+    else:
+        print(f"  Element cache moved from revision {cached_revision}: {dropped} changed elements to fetch")
+
+
 def build_md_tree(mres, mdid, connection_id):
     """ Build the tree reading from MD
     """
     global products_count
     products_count = 0
 
-    headers = {
-        'accept': 'application/json',
-        'authorization': 'Basic %s' % connection_id,
-        'Connection': 'close'
-    }
+    with md_session(connection_id) as rs:
+        md_revision = get_md_revision(rs, mres, mdid)
+        print("Magic Draw trunk revision:", md_revision)
+        update_md_cache(rs, mres, md_revision)
 
-    rs = requests.Session()
-    rs.headers = headers
+        walk_tree(rs, mres, mdid, "")
+    throttle = md_throttle()
+    print(f"  {throttle.summary()}")
+    metrics.set_counters('md_requests', {'requests': throttle.requests, 'retries': throttle.retries,
+                                         'waited': round(throttle.waited, 3)})
+    with metrics.phase('convert_products'):
+        convert_products(productTree)
 
-    md_revision = get_md_revision(rs, mres, mdid)
-    print("Magic Draw trunk revision:", md_revision)
+    return md_revision
 
-    walk_tree(rs, mres, mdid, "")
 
-    return md_revision
+def convert_products(ptree):
+    """
+    Convert to LaTeX, in a single batch, the descriptions and short names extracted from MagicDraw in html
+    """
+    products = [node.data for node in ptree.all_nodes()]
+    texts = html_to_latex_batch([prod.desc for prod in products] + [prod.shortname for prod in products])
+    for prod, desc, shortname in zip(products, texts[:len(products)], texts[len(products):]):
+        prod.desc = desc
+        prod.shortname = shortname
+    root = ptree[ptree.root].data
+    root.name = root.shortname  # this is required, since the first node in MD usually is not meaningful.
 
 
 def do_csv(products, output_file):
@@ -327,28 +430,10 @@ def do_csv(products, output_file):
     :param output_file:
     :return:
     """
-    csv = '"#","Product key","Short name","Parent","WBS","Team","Manager",' \
-          '"Product Owner","Packages","Name","MD Order"\n'
-    i = 0
-    for p in products:
-        if not any(x in p.name for x in ["Obsolete", "obsolete"]):
-            i = i + 1
-            pkey = p.id
-            snm = p.shortname.rstrip()
-            pid = p.parent
-            wbs = ' '.join(p.wbs)
-            team = p.teams[0]
-            mng = p.manager
-            owner = p.owner[0]
-            pkgs = ' '.join(p.pkgs)
-            name = p.name.rstrip()
-            pkg_index = p.index
-            csv = csv + f'"{i}","{pkey}","{snm}","{pid}","{wbs}","{team}","{mng}",' \
-                        f'"{owner}","{pkgs}","{name}","{pkg_index}"\n'
+    buf = io.StringIO()
+    producttable.write_products(buf, [p for p in products if not any(x in p.name for x in ["Obsolete", "obsolete"])])
     csv_filename = "csv/" + output_file + ".csv"
-    file = open(csv_filename, "w")
-    print(csv, file=file)
-    file.close()
+    write_if_changed(csv_filename, buf.getvalue())
 
 
 def do_trees_diagrams(tree, filename, scope, compact):
@@ -359,17 +444,20 @@ def do_trees_diagrams(tree, filename, scope, compact):
     :param scope:
     :return: none
     """
+    index = TreeIndex(tree)
+
     # build the portrait tree
-    make_tree_portrait(tree, "trees/" + filename + "_portrait.tex", scope)
+    make_tree_portrait(tree, "trees/" + filename + "_portrait.tex", scope, index)
 
     # build landscape tree
-    make_tree_landmix1(tree, "trees/" + filename + "_mixedLand.tex", scope, compact)
+    make_tree_landmix1(tree, "trees/" + filename + "_mixedLand.tex", scope, compact, index)
 
     # build subtrees
-    make_subtrees(tree, filename, scope, compact)
+    make_subtrees(tree, filename, scope, compact, index)
 
 
-def do_md_section(sysid, levelid, connection_str, output_format, output_file, compact, doc_handler, dotree):
+def do_md_section(sysid, levelid, connection_str, output_format, output_file, compact, doc_handler, dotree,
+                  snapshot=None):
     """
     Given the MD ids, dump the content in the output file and produce the product tree diagrams
     :param sysid: MagicDraw subsystem id
@@ -379,35 +467,39 @@ def do_md_section(sysid, levelid, connection_str, output_format, output_file, co
     :param output_file: File to dump
     :param compact: True if the portrait diagrams have to be in compact form
     :param doc_handler: the document id
-    :param sub_name: name of the subsystem
+    :param snapshot: Snapshot the tree is taken from (if present) or added to
     :return: none
     """
     global template_path
     global productTree
     global tree_dict
-    productTree = Tree()
     products = []
     tree_dict = {}
 
-    # get the information from MagicDraw
-    mdr = build_md_tree(sysid, levelid, connection_str)
+    if snapshot is not None and snapshot.has_subtree(output_file):
+        # no MagicDraw access
+        productTree, mdr = snapshot.get_subtree(output_file)
+    else:
+        # get the information from MagicDraw
+        productTree = Tree()
+        with metrics.phase('build_md_tree'):
+            mdr = build_md_tree(sysid, levelid, connection_str)
+        if snapshot is not None:
+            snapshot.add_subtree(output_file, productTree, mdr)
     print("\n  Product tree depth:", productTree.depth())
 
-    nodes = productTree.expand_tree(key=lambda x: x.data.index, sorting=True)
-    for n in nodes:
-        products.append(productTree[n].data)
-        tree_dict[productTree[n].data.id] = productTree[n].data
+    for prod in treeview.products(productTree):
+        products.append(prod)
+        tree_dict[prod.id] = prod
     print(f"  Found {{np}} products (including container folders).".format(np=len(tree_dict)))
 
-    envs = Environment(loader=ChoiceLoader([FileSystemLoader(Config.TEMPLATE_DIRECTORY),
-                                           PackageLoader('ptree', 'templates')]),
-                       lstrip_blocks=True, trim_blocks=True, autoescape=None)
-
     # dump a csv file
     if dotree:
-        do_csv(products, output_file)
+        with metrics.phase('do_csv'):
+            do_csv(products, output_file)
         # create the diagrams tex files
-        do_trees_diagrams(productTree, output_file, products[0].shortname, compact)
+        with metrics.phase('do_trees_diagrams'):
+            do_trees_diagrams(productTree, output_file, products[0].shortname, compact)
         # define the template
         template_path = f"section.{Config.TEMPLATE_LANGUAGE}.jinja2"
     else:
@@ -420,7 +512,7 @@ def do_md_section(sysid, levelid, connection_str, output_format, output_file, co
     mdp = productTree.to_dict(with_data=False)
 
     # get ordered dictionary
-    template = envs.get_template(template_path)
+    template = get_template(template_path)
     new_mdpt = dict()
     for k0 in mdp:
         new_mdpt[k0] = order_tree_level(mdp[k0])
@@ -428,17 +520,15 @@ def do_md_section(sysid, levelid, connection_str, output_format, output_file, co
     # dump the tex section
     metadata = dict()
     metadata["template"] = template.filename
-    text = template.render(metadata=metadata,
-                           mdrev=mdr,
-                           filename=output_file,
-                           doc_handler=doc_handler,
-                           mdt_dict=tree_dict,
-                           mdp=new_mdpt,
-                           mdps=products)
     tex_file_name = output_file + ".tex"
-    file = open(tex_file_name, "w")
-    print(_as_output_format(text, output_format), file=file)
-    file.close()
+    write_template(template, tex_file_name, output_format,
+                   dict(metadata=metadata,
+                        mdrev=mdr,
+                        filename=output_file,
+                        doc_handler=doc_handler,
+                        mdt_dict=tree_dict,
+                        mdp=new_mdpt,
+                        mdps=products))
     return tree_dict
 
 
@@ -528,39 +618,9 @@ def get_csvfiles(filename):
 
     if os.path.exists(fname_with_path):
         print(fname_with_path, ": ", end="")
-        with open(fname_with_path, 'r') as csvf:
-            reader = csv.reader(csvf, dialect='excel')
-            count = 0
-            for line in reader:
-                # print(len(line), line)
-                if count == 0:
-                    # first line
-                    count = count + 1
-                    continue
-                else:
-                    # ID, Product key, Short name, Parent, WBS, Team, Manager, Product owner, Packages, Name
-                    # 0   1            2           3       4    5     6        7              8         9
-                    if len(line) != 0:
-                        count = count + 1
-                        p = Product(line[1],             # 1   key
-                                    line[9],             # 2   name
-                                    line[3],             # 3   parent
-                                    "",                  # 4   description
-                                    line[4].split(" "),  # 5   WBS
-                                    line[6].split(" "),  # 6   manager
-                                    line[7].split(" "),  # 7   owner
-                                    "",                  # 8   kind
-                                    line[8].split(' '),  # 9   pkgs
-                                    [],                  # 10  depends
-                                    "",                  # 11  MagicDraw Element Server Id
-                                    [],                  # 12  links
-                                    line[5].split(" "),  # 13  teams
-                                    line[2],             # 14  shortname
-                                    [],                  # 15  usedin
-                                    [],                  # 16  requirements
-                                    [],                  # 17  docs
-                                    "")                  # 18  the position assigned in MD (number before the name)
-                    products[p.id] = p
+        with producttable.open_table(fname_with_path) as csvf:
+            for p in producttable.read_products(csvf):
+                products[p.id] = p
         print(f"got {len(products)} products.")
     else:
         print(f"No {fname_with_path} file found!")
@@ -570,24 +630,25 @@ def get_csvfiles(filename):
 def do_partial(full_tree, partial):
     """ extract partial information in tree form"""
 
-    partial_tree = full_tree.subtree(partial)
-    partial_data = partial_tree[partial].data
+    index = TreeIndex(full_tree)
+    partial_data = index.data(partial)
     pname = partial_data.shortname.strip().replace(" ", "_")
     filedir = "partials"
     if not os.path.exists(filedir):
         os.makedirs(filedir)
     filename = f"{filedir}/{pname}.tex"
     print(f"Generating files {partial}: {filename}[.tex/.csv]")
-    make_tree_landmix1(partial_tree, filename, pname, False)
-    products = []
-    nodes = partial_tree.expand_tree(key=lambda x: x.data.index, sorting=True)
-    for n in nodes:
-        products.append(partial_tree[n].data)
+    make_tree_landmix1(full_tree, filename, pname, False, index, partial)
+    products = [index.data(n) for n in index.subtree(partial)]
     do_csv(products, pname)
 
 
-def generate_document(connection_str, output_format, token_path, compact, csvonly, partial):
-    """Given system and level, generates the document content"""
+def generate_document(connection_str, output_format, token_path, compact, csvonly, partial,
+                      snapshot_file="", from_snapshot=""):
+    """Given system and level, generates the document content
+    :param snapshot_file: file where to save the information extracted from MagicDraw and GitHub
+    :param from_snapshot: snapshot file to use instead of MagicDraw and GitHub
+    """
     md_trees = []
 
     subsystem_info = get_yaml()
@@ -596,6 +657,16 @@ def generate_document(connection_str, output_format, token_path, compact, csvonl
     doc_handler = subsystem_info['subsystem']['doc']
     subsystem_name = subsystem_info['subsystem']['name']
     subtrees = subsystem_info['subsystem']['subtrees']
+    Config.OUTPUT_MANIFEST = OutputManifest(os.path.join(Config.CACHE_DIR, "outputs.json"))
+    snapshot = Snapshot()
+    if from_snapshot:
+        print(f"-> Loading snapshot {from_snapshot}  ==========================")
+        snapshot = Snapshot.load(from_snapshot)
+        missing = [subtree for subtree in subtrees if not snapshot.has_subtree(subtree)]
+        if missing and not csvonly:
+            click.echo(f"Subtrees not found in {from_snapshot}: {', '.join(missing)}", err=True)
+            sys.exit(1)
+        snapshot.restore_git()
     if not csvonly:
         for subtree in subtrees.keys():
             print(f"-> Generating {subtree} Product Tree  ==========================")
@@ -605,29 +676,39 @@ def generate_document(connection_str, output_format, token_path, compact, csvonl
             if dotree:
                 print(f"Do Tree ({dotree})")
                 md_trees.append(do_md_section(subsystem_id, level_id, connection_str, output_format, filename,
-                                              compact, doc_handler, dotree))
+                                              compact, doc_handler, dotree, snapshot))
             else:
                 print(f"Don't Do Tree ({dotree})")
                 do_md_section(subsystem_id, level_id, connection_str, output_format, filename,
-                              compact, doc_handler, dotree)
+                              compact, doc_handler, dotree, snapshot)
 
 
     else:
         print("-> Getting csv files  ==========================")
         for subtree in subtrees:
-            prds = get_csvfiles(subtree['filename'])
+            prds = get_csvfiles(subtree)
             if len(prds) > 0:
                 md_trees.append(prds)
         print(f"Loaded {{n}} csv files".format(n=len(md_trees)))
 
     print("-> Generating FULL Product Tree  ==========================")
-    full_tree = do_full_tree(md_trees, subsystem_name, True)
+    with metrics.phase('do_full_tree'):
+        full_tree = do_full_tree(md_trees, subsystem_name, True)
 
     if partial != "":
         print(f"Extracting information for {partial}.")
         do_partial(full_tree, partial)
 
+    Config.OUTPUT_MANIFEST.save()
+    print(f"  {Config.OUTPUT_MANIFEST.skipped} unchanged diagrams not regenerated")
+
     print("-> Generating GitHub Product Tree  ==========================")
-    do_github_section(md_trees, token_path, output_format)
+    with metrics.phase('do_github_section'):
+        pkg_matrix = do_github_section(md_trees, token_path, output_format, offline=bool(from_snapshot))
+
+    if snapshot_file and not from_snapshot and not csvonly:
+        snapshot.add_git(pkg_matrix)
+        snapshot.save(snapshot_file)
+        print(f"  Snapshot saved in {snapshot_file}")
 
     # print("-> [to do] Generating Auxiliary Product Tree  ==========================")
@@ -0,0 +1,176 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Instrumentation of the document generation: wall time per phase, MagicDraw requests
+per element type (count and latency histogram), cache and pandoc counters.
+Phases can also be profiled, with cProfile or pyinstrument (if installed).
+"""
+
+import os
+import json
+import time
+import bisect
+import cProfile
+import threading
+from contextlib import contextmanager
+from .config import Config
+from . import texconv
+
+# upper bounds of the latency histogram buckets (ms), the last bucket is unbounded
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+_lock = threading.Lock()
+_phases = dict()      # name: {'calls', 'seconds'}
+_requests = dict()    # element type: {'count', 'seconds', 'histogram'}
+_counters = dict()    # group: {name: value}
+_active = threading.local()
+_profiles = dict()    # phase name: profiler
+_started = time.perf_counter()
+# profiler used for the phases (None, 'cprofile' or 'pyinstrument') and where to save the profiles
+profiler = None
+profile_dir = "profiles"
+
+
+def reset():
+    global profiler, _started
+    _started = time.perf_counter()
+    with _lock:
+        _phases.clear()
+        _requests.clear()
+        _counters.clear()
+    _profiles.clear()
+    profiler = None
+
+
+def start_profiler(name):
+    """
+    Start the profiler of phase name, the runs of the same phase are accumulated
+    """
+    prof = _profiles.get(name)
+    if profiler == 'pyinstrument':
+        if prof is None:
+            from pyinstrument import Profiler
+            prof = Profiler()
+        prof.start()
+    else:
+        if prof is None:
+            prof = cProfile.Profile()
+        prof.enable()
+    _profiles[name] = prof
+    return prof
+
+
+def save_profile(prof, name):
+    """
+    Stop the profiler and save the profile of phase name in profile_dir
+    """
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+    if profiler == 'pyinstrument':
+        prof.stop()
+        with open(os.path.join(profile_dir, f"{name}.txt"), 'w') as fout:
+            fout.write(prof.output_text())
+    else:
+        prof.disable()
+        prof.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
+
+
+@contextmanager
+def phase(name):
+    """
+    Time (and profile, if a profiler is set) the code in the block as phase name.
+    Nested phases are timed, but only the outermost is profiled.
+    """
+    depth = getattr(_active, 'depth', 0)
+    _active.depth = depth + 1
+    prof = start_profiler(name) if profiler and depth == 0 else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _active.depth = depth
+        if prof:
+            save_profile(prof, name)
+        with _lock:
+            stats = _phases.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            stats['calls'] = stats['calls'] + 1
+            stats['seconds'] = stats['seconds'] + elapsed
+
+
+def record_request(element_type, seconds):
+    """
+    Account a MagicDraw request for an element of element_type, that took seconds
+    """
+    with _lock:
+        stats = _requests.get(element_type)
+        if stats is None:
+            stats = {'count': 0, 'seconds': 0.0, 'histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+            _requests[element_type] = stats
+        stats['count'] = stats['count'] + 1
+        stats['seconds'] = stats['seconds'] + seconds
+        stats['histogram'][bisect.bisect_left(LATENCY_BUCKETS, seconds * 1000)] += 1
+
+
+def set_counters(group, values):
+    """
+    Record the counters (dictionary name: value) of a component
+    """
+    with _lock:
+        _counters.setdefault(group, dict()).update(values)
+
+
+def hit_rate(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+def report():
+    """
+    Returns all the metrics collected, as a dictionary
+    """
+    if Config.MD_CACHE:
+        set_counters('md_cache', {'hits': Config.MD_CACHE.hits, 'misses': Config.MD_CACHE.misses,
+                                  'hit_rate': hit_rate(Config.MD_CACHE.hits, Config.MD_CACHE.misses)})
+    if Config.OUTPUT_MANIFEST:
+        set_counters('diagrams', {'unchanged': Config.OUTPUT_MANIFEST.skipped})
+    set_counters('pandoc', {'runs': texconv.pandoc_runs, 'converted': texconv.converted,
+                            'converted_without_pandoc': texconv.fast_converted})
+    with _lock:
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}ms"]
+        requests = dict()
+        for element_type, stats in sorted(_requests.items()):
+            requests[element_type] = {'count': stats['count'],
+                                      'seconds': round(stats['seconds'], 3),
+                                      'mean_ms': round(1000 * stats['seconds'] / stats['count'], 2),
+                                      'histogram': dict(zip(labels, stats['histogram']))}
+        return {'seconds': round(time.perf_counter() - _started, 3),
+                'phases': {name: {'calls': stats['calls'], 'seconds': round(stats['seconds'], 3)}
+                           for name, stats in _phases.items()},
+                'md_requests': requests,
+                'counters': {group: dict(values) for group, values in _counters.items()}}
+
+
+def save(filename):
+    folder = os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(filename, 'w') as fout:
+        json.dump(report(), fout, indent=1)
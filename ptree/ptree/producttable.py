@@ -0,0 +1,149 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Product tables: csv files with one product per row.
+The columns are given by COLUMNS, all the Product fields; list fields are written
+as space separated values, or as a JSON array when the values are not simple words.
+Tables are read by header name (case insensitive), so that also the MagicDraw
+exports (with a different set and order of columns) can be read.
+"""
+
+import csv
+import json
+from treelib import Tree
+from .util import Product, fix_id_tex, fix_tex
+
+# (header, Product field)
+COLUMNS = [("Product key", "id"),
+           ("Short name", "shortname"),
+           ("Parent", "parent"),
+           ("WBS", "wbs"),
+           ("Team", "teams"),
+           ("Manager", "manager"),
+           ("Product Owner", "owner"),
+           ("Packages", "pkgs"),
+           ("Name", "name"),
+           ("MD Order", "index"),
+           ("Element Server ID", "elId"),
+           ("Kind", "kind"),
+           ("Description", "desc"),
+           ("Depends", "depends"),
+           ("Used in", "usedin"),
+           ("Links", "links"),
+           ("Requirements", "reqs"),
+           ("Documents", "docs")]
+COUNT_HEADER = "#"
+FIELDS = {header.lower(): field for header, field in COLUMNS}
+
+
+def encode(field, value):
+    """
+    Cell text of a Product field value
+    """
+    if Product.__annotations__[field] is not list:
+        # the LaTeX converted by pandoc ends with a new line
+        return str(value).rstrip()
+    if all(isinstance(v, str) and v and v == "".join(v.split()) and not v.startswith('[') for v in value):
+        return " ".join(value)
+    return json.dumps(value)
+
+
+def decode(field, cell):
+    """
+    Product field value of the cell text
+    """
+    if Product.__annotations__[field] is not list:
+        return cell
+    if cell.startswith('['):
+        return json.loads(cell)
+    return cell.split()
+
+
+def write_products(fout, products):
+    """
+    Write the products table in the open file fout, a row at a time
+    :return: number of products written
+    """
+    writer = csv.writer(fout, dialect='excel', quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writer.writerow([COUNT_HEADER] + [header for header, field in COLUMNS])
+    count = 0
+    for p in products:
+        count = count + 1
+        writer.writerow([count] + [encode(field, getattr(p, field)) for header, field in COLUMNS])
+    return count
+
+
+def read_rows(fin):
+    """
+    Rows of the table in the open file fin, as dictionaries Product field: cell text.
+    Columns not in the schema are ignored, the missing ones are not in the rows.
+    """
+    reader = csv.DictReader(fin, dialect='excel')
+    fields = {name: FIELDS[name.strip().lower()] for name in (reader.fieldnames or [])
+              if name and name.strip().lower() in FIELDS}
+    for line in reader:
+        yield {field: line[name] or "" for name, field in fields.items()}
+
+
+def read_products(fin):
+    """
+    Products of the table in the open file fin, the fields missing in the table get the Product defaults
+    """
+    for row in read_rows(fin):
+        values = Product("", "", "", "", [], "", [], "", []).to_dict()
+        for field, cell in row.items():
+            values[field] = decode(field, cell)
+        yield Product.from_dict(values)
+
+
+def open_table(filename):
+    """
+    Open a csv file for reading, as required by the csv module (the utf-8 BOM of the exports is skipped)
+    """
+    return open(filename, 'r', newline='', encoding='utf-8-sig')
+
+
+def construct_tree(fileinput):
+    """Read the tree file (MagicDraw export) and construct a tree structure.
+    The ids are made from the product keys, the names from the short names"""
+    count = 0
+    ptree = Tree()
+
+    with open_table(fileinput) as fin:
+        for row in read_rows(fin):
+            count = count + 1
+            e_id = fix_id_tex(row['id'])  # make an e_id from the name
+            pid = fix_id_tex(row['parent'])  # use the same formaula on the parent name then we are good
+            name = fix_tex(row['shortname'])
+            prod = Product(e_id, name, pid, "", row['wbs'], row['manager'],
+                           row['owner'], "", row['pkgs'], el_id=row.get('elId', ""))
+
+            if count == 1:  # root node
+                ptree.create_node(prod.id, prod.id, data=prod)
+            else:
+                if prod.parent != "":
+                    ptree.create_node(prod.id, prod.id, data=prod,
+                                      parent=prod.parent)
+                else:
+                    print(row['id'] + " no parent")
+
+    print("{} Product lines".format(count + 1))
+    return ptree
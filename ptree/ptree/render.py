@@ -0,0 +1,81 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Rendering of the section templates.
+A single Jinja2 environment is shared by all the sections, and the compiled
+templates are kept in CACHE_DIR between runs.
+"""
+
+import os
+import filecmp
+from jinja2 import Environment, PackageLoader, ChoiceLoader, FileSystemLoader, FileSystemBytecodeCache
+from .config import Config
+from .util import _as_output_format
+from . import metrics
+
+_env = None
+
+
+def environment():
+    """
+    The Jinja2 environment, created at the first use
+    """
+    global _env
+    if _env is None:
+        cache_dir = os.path.join(Config.CACHE_DIR, "templates")
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        _env = Environment(loader=ChoiceLoader([FileSystemLoader(Config.TEMPLATE_DIRECTORY),
+                                                PackageLoader('ptree', 'templates')]),
+                           lstrip_blocks=True, trim_blocks=True, autoescape=None,
+                           bytecode_cache=FileSystemBytecodeCache(cache_dir))
+    return _env
+
+
+def get_template(template_path):
+    """
+    :raise TemplateNotFound: if template_path is not in the template directory nor in the package
+    """
+    return environment().get_template(template_path)
+
+
+def write_template(template, filename, output_format, context):
+    """
+    Render template with the context variables (dictionary) in filename,
+    which is written only if the content changed (see write_if_changed).
+    The output is streamed to the file, unless it has to be converted to output_format.
+    :return: True if the file has been written
+    """
+    folder = os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp_name = filename + ".tmp"
+    with metrics.phase('render'), open(tmp_name, 'w') as fout:
+        if Config.TEMPLATE_LANGUAGE != output_format:
+            fout.write(_as_output_format(template.render(context), output_format))
+        else:
+            template.stream(context).dump(fout)
+        fout.write("\n")
+    if os.path.exists(filename) and filecmp.cmp(tmp_name, filename, shallow=False):
+        os.remove(tmp_name)
+        return False
+    os.replace(tmp_name, filename)
+    return True
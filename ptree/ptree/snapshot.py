@@ -0,0 +1,111 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Offline snapshot of all the information extracted from MagicDraw and GitHub
+"""
+
+import os
+import gzip
+import json
+from treelib import Tree
+from .config import Config
+from .util import Product, GitPkg
+from . import treeview
+
+SNAPSHOT_VERSION = 1
+
+
+class Snapshot(object):
+    """
+    Product trees (with their MagicDraw revision), GitHub packages and package matrix,
+    saved in a single gzip compressed json file
+    """
+
+    def __init__(self):
+        self.subtrees = dict()
+        self.git_repos = dict()
+        self.missing_git_repos = []
+        self.pkg_matrix = dict()
+
+    @classmethod
+    def load(cls, filename):
+        with gzip.open(filename, 'rt', encoding='utf-8') as fin:
+            content = json.load(fin)
+        if content.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {content.get('version')} in {filename}")
+        snapshot = cls()
+        snapshot.subtrees = content['subtrees']
+        snapshot.git_repos = content['git_repos']
+        snapshot.missing_git_repos = content['missing_git_repos']
+        snapshot.pkg_matrix = content['pkg_matrix']
+        return snapshot
+
+    def save(self, filename):
+        folder = os.path.dirname(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        content = {'version': SNAPSHOT_VERSION,
+                   'subtrees': self.subtrees,
+                   'git_repos': self.git_repos,
+                   'missing_git_repos': self.missing_git_repos,
+                   'pkg_matrix': self.pkg_matrix}
+        with gzip.open(filename, 'wt', encoding='utf-8') as fout:
+            json.dump(content, fout)
+
+    def has_subtree(self, name):
+        return name in self.subtrees
+
+    def add_subtree(self, name, ptree, revision):
+        """
+        Store a product tree, the products are saved parents first
+        """
+        self.subtrees[name] = {'revision': revision,
+                               'products': [prod.to_dict() for prod in treeview.products(ptree)]}
+
+    def get_subtree(self, name):
+        """
+        Returns the product tree and its MagicDraw revision
+        """
+        ptree = Tree()
+        products = self.subtrees[name]['products']
+        for count, values in enumerate(products):
+            prod = Product.from_dict(values)
+            if count == 0:
+                ptree.create_node(prod.id, prod.id, data=prod)
+            else:
+                ptree.create_node(prod.id, prod.id, data=prod, parent=prod.parent)
+        return ptree, self.subtrees[name]['revision']
+
+    def add_git(self, pkg_matrix):
+        """
+        Store the GitHub packages found in Config and the package matrix (package: product keys)
+        """
+        self.git_repos = {pkg: Config.CACHED_GIT_REPOS[pkg].to_dict() for pkg in Config.CACHED_GIT_REPOS}
+        self.missing_git_repos = sorted(Config.MISSING_GIT_REPOS)
+        self.pkg_matrix = {pkg: [prod.id for prod in pkg_matrix[pkg]] for pkg in pkg_matrix}
+
+    def restore_git(self):
+        """
+        Put the GitHub packages in Config, so that they are not fetched again
+        """
+        for pkg in self.git_repos:
+            Config.CACHED_GIT_REPOS[pkg] = GitPkg.from_dict(self.git_repos[pkg])
+        Config.MISSING_GIT_REPOS.update(self.missing_git_repos)
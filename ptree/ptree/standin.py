@@ -0,0 +1,597 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Local stand-ins for the Teamwork Cloud REST server and for the GitHub API,
+to run the MagicDraw and GitHub extraction offline.
+Both can add a latency to each request. The Teamwork Cloud stand-in can refuse requests
+with 401, as the real server does when the max number of sessions is reached,
+the GitHub one applies a rate limit, advertised in the X-RateLimit headers.
+"""
+
+import re
+import html
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .config import Config
+from . import treeview
+
+ELEMENTS_PATH = re.compile(r"^/osmc/resources/([^/]+)/elements(?:/([^/?]+))?/?$")
+ORG_PATH = re.compile(r"^/orgs/([^/]+)/?$")
+REPO_PATH = re.compile(r"^/repos/([^/]+)/([^/]+)(?:/(contents|teams|commits/HEAD)(?:/(.*))?)?$")
+
+# product properties, in the order of the slots of a product InstanceSpecification
+PROPERTY_NAMES = ["product key", "short name", "WBS", "manager", "product owner", "packages",
+                  "hyperlinkText", "team", "documents"]
+
+GQL_STR = r'("(?:[^"\\]|\\.)*")'
+GQL_REPO = re.compile(r"(\w+): repository\(owner: " + GQL_STR + r", name: " + GQL_STR + r"\)")
+GQL_OBJECT = re.compile(r"(\w+): object\(expression: " + GQL_STR + r"\)")
+GQL_TEAMS = re.compile(r"organization\(login: " + GQL_STR + r"\)\s*\{\s*teams\(first: (\d+)(?:, after: "
+                       + GQL_STR + r")?\)")
+GQL_TEAM_REPOS = re.compile(r"node\(id: " + GQL_STR + r"\).*?repositories\(first: (\d+), after: " + GQL_STR + r"\)",
+                            re.DOTALL)
+
+
+def stable_id(text):
+    """ Numeric id derived from text, the same in every run """
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:7], 16)
+
+
+def load_model(filename):
+    """
+    Load a model file: a json dictionary element id: element,
+    each element as returned by the REST API ([ldp, kerml])
+    """
+    with open(filename, 'r') as fin:
+        return json.load(fin)
+
+
+class TwcModel(object):
+    """
+    Teamwork Cloud elements of product trees (e.g. synthetic or from a snapshot):
+    each product is a Package containing its properties (InstanceSpecification),
+    its description (Comment) and its sub products.
+    Requirements and dependencies between products are not modelled.
+    """
+
+    def __init__(self, revision="1"):
+        self.revision = revision
+        self.elements = dict()
+        self._count = 0
+        self.features = {name: self.add('uml:Property', {}, name=name) for name in PROPERTY_NAMES}
+
+    def add(self, element_type, esi_data, contains=(), **kerml):
+        self._count = self._count + 1
+        eid = f"e{self._count:06d}"
+        data = {'@id': eid, '@type': element_type, 'kerml:esiData': esi_data}
+        data.update({f"kerml:{key}": value for key, value in kerml.items()})
+        self.elements[eid] = [{'ldp:contains': [{'@id': cid} for cid in contains]}, data]
+        return eid
+
+    def add_properties(self, prod):
+        values = {"product key": [prod.id],
+                  "short name": [prod.shortname],
+                  "WBS": prod.wbs,
+                  "manager": [prod.manager],
+                  "product owner": prod.owner,
+                  "packages": prod.pkgs,
+                  "hyperlinkText": prod.links,
+                  "team": prod.teams,
+                  "documents": [":".join(doc) for doc in prod.docs if doc]}
+        slots = []
+        for name in PROPERTY_NAMES:
+            literals = [self.add('uml:LiteralString', {'value': value}) for value in values[name] if value]
+            slots.append(self.add('uml:Slot', {'definingFeature': {'@id': self.features[name]}}, literals))
+        return self.add('uml:InstanceSpecification', {}, slots)
+
+    def add_tree(self, ptree):
+        """
+        Add the products of ptree, returns the id of the root package
+        """
+        package_ids = dict()
+        for prod in reversed(list(treeview.products(ptree))):
+            contains = [self.add_properties(prod)]
+            if prod.desc:
+                contains.append(self.add('uml:Comment', {'body': f"<p>{html.escape(prod.desc.strip())}</p>"}))
+            contains.extend([package_ids[child.identifier] for child in ptree.children(prod.id)])
+            name = f"{prod.index} {prod.name}" if prod.index != "" else prod.name
+            package_ids[prod.id] = self.add('uml:Package', {'ownedDiagram': []}, contains, name=name,
+                                            revision=f"revisions/{self.revision}")
+        return package_ids[ptree.root]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    # keep the connections alive, as Teamwork Cloud and GitHub do
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately: without this, delayed acks stall the kept alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        return
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.standin.count_connection()
+
+    def send_body(self, code, body, content_type='application/json', headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.headers.get('Connection', '').lower() == 'close':
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, content, headers=None):
+        self.send_body(code, json.dumps(content).encode("utf-8"), headers=headers)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode("utf-8")
+
+
+class TwcHandler(StandinHandler):
+
+    def send_refusal(self):
+        standin = self.server.standin
+        headers = {'Retry-After': str(standin.retry_after)} if standin.retry_after is not None else None
+        self.send_json(401, {'error': 'max number of sessions reached'}, headers)
+
+    def do_GET(self):
+        standin = self.server.standin
+        match = ELEMENTS_PATH.match(self.path)
+        standin.count('GET')
+        with standin.session() as admitted:
+            if not admitted:
+                self.send_refusal()
+            elif not match or not match.group(2):
+                self.send_json(404, {'error': 'not found'})
+            elif match.group(2) not in standin.elements:
+                self.send_json(404, {'error': f'no element {match.group(2)}'})
+            else:
+                self.send_json(200, standin.elements[match.group(2)])
+
+    def do_POST(self):
+        standin = self.server.standin
+        match = ELEMENTS_PATH.match(self.path)
+        ids = self.read_body()
+        standin.count('POST')
+        with standin.session() as admitted:
+            if not admitted:
+                self.send_refusal()
+                return
+            if not match or match.group(2) or not standin.bulk:
+                self.send_json(405, {'error': 'bulk retrieval not supported'})
+                return
+            elements = dict()
+            for eid in ids.split(","):
+                eid = eid.strip()
+                if eid in standin.elements:
+                    elements[eid] = {'data': standin.elements[eid]}
+            self.send_json(200, elements)
+
+
+class GitHubHandler(StandinHandler):
+
+    def do_GET(self):
+        standin = self.server.standin
+        path = self.path.split('?')[0]
+        standin.count('GET')
+        with standin.session():
+            match = REPO_PATH.match(path)
+            if path.rstrip('/') == '/rate_limit':
+                # not counted against the rate limit
+                self.send_json(200, standin.rate_limit_json())
+                return
+            if match and match.group(3) == 'commits/HEAD':
+                self.send_head_commit(match.group(1), match.group(2))
+                return
+            allowed, headers = standin.take('core')
+            if not allowed:
+                self.send_json(403, {'message': 'API rate limit exceeded'}, headers)
+            elif ORG_PATH.match(path):
+                self.send_found(standin.org_json(ORG_PATH.match(path).group(1)), headers)
+            elif not match:
+                self.send_json(404, {'message': 'Not Found'}, headers)
+            elif match.group(3) == 'contents':
+                self.send_found(standin.contents_json(match.group(1), match.group(2), match.group(4) or ""),
+                                headers)
+            elif match.group(3) == 'teams':
+                self.send_found(standin.teams_json(match.group(1), match.group(2)), headers)
+            else:
+                self.send_found(standin.repo_json(match.group(1), match.group(2)), headers)
+
+    def do_POST(self):
+        standin = self.server.standin
+        query = self.read_body()
+        standin.count('POST')
+        with standin.session():
+            allowed, headers = standin.take('graphql')
+            if not allowed:
+                self.send_json(403, {'message': 'API rate limit exceeded'}, headers)
+            elif self.path.split('?')[0].rstrip('/') != '/graphql':
+                self.send_json(404, {'message': 'Not Found'}, headers)
+            else:
+                self.send_json(200, standin.graphql(json.loads(query)['query']), headers)
+
+    def send_found(self, content, headers):
+        if content is None:
+            self.send_json(404, {'message': 'Not Found'}, headers)
+        else:
+            self.send_json(200, content, headers)
+
+    def send_head_commit(self, org, repo):
+        """
+        SHA of the head commit, as plain text. Not modified answers do not count against the rate limit.
+        """
+        standin = self.server.standin
+        gitpkg = standin.repos.get((org, repo))
+        etag = f'"{standin.shas[(org, repo)]}"' if gitpkg else None
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_body(304, b"", headers=dict(standin.rate_headers('core'), ETag=etag))
+            return
+        allowed, headers = standin.take('core')
+        if not allowed:
+            self.send_json(403, {'message': 'API rate limit exceeded'}, headers)
+        elif not gitpkg:
+            self.send_json(404, {'message': 'Not Found'}, headers)
+        else:
+            self.send_body(200, standin.shas[(org, repo)].encode("utf-8"), 'text/plain', dict(headers, ETag=etag))
+
+
+class StandinServer(ThreadingHTTPServer):
+    # clients opening a connection per request would overflow the default backlog (5)
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class Standin(object):
+    """
+    Serves the requests on a local port, adding latency seconds (+/- jitter, as fraction) to each of them.
+    The number of requests received per method is available in requests,
+    the number of client connections accepted in connections.
+    """
+    handler = StandinHandler
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = dict()
+        self.connections = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.server = StandinServer((host, port), self.handler)
+        self.server.standin = self
+        self._thread = None
+
+    def count(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections = self.connections + 1
+
+    def admit(self):
+        """
+        Called when a request starts (with the lock held), returns False if the request has to be refused
+        """
+        return True
+
+    @contextmanager
+    def session(self):
+        """
+        A request in progress, delayed by the latency: yields False if the request has to be refused
+        """
+        with self._lock:
+            self.in_flight = self.in_flight + 1
+            admitted = self.admit()
+        try:
+            if self.latency > 0:
+                time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+            yield admitted
+        finally:
+            with self._lock:
+                self.in_flight = self.in_flight - 1
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class TwcStandin(Standin):
+    """
+    Serves the elements of a model with the same url layout as Teamwork Cloud:
+    GET  /osmc/resources/{res}/elements/{comp}
+    POST /osmc/resources/{res}/elements         (bulk, comma separated ids, if bulk is True)
+    Requests are refused with 401 (with Retry-After, if given) when more than max_sessions
+    are in progress, and one every refuse_every requests; the number of refusals is in refused.
+    """
+    handler = TwcHandler
+
+    def __init__(self, elements, bulk=True, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 max_sessions=0, refuse_every=0, retry_after=0):
+        Standin.__init__(self, host, port, latency, jitter)
+        self.elements = elements
+        self.bulk = bulk
+        self.max_sessions = max_sessions
+        self.refuse_every = refuse_every
+        self.retry_after = retry_after
+        self.received = 0
+        self.refused = 0
+
+    def admit(self):
+        self.received = self.received + 1
+        if (self.max_sessions and self.in_flight > self.max_sessions) or \
+                (self.refuse_every and self.received % self.refuse_every == 0):
+            self.refused = self.refused + 1
+            return False
+        return True
+
+    @property
+    def base_url(self):
+        return self.address + "/osmc/resources"
+
+    def configure(self):
+        """
+        Point the MagicDraw urls in Config to this server
+        """
+        Config.MD_COMP_URL = self.base_url + "/{res}/elements/{comp}"
+        Config.MD_BULK_URL = self.base_url + "/{res}/elements"
+        Config.MD_REVDIFF_URL = self.base_url + "/{res}/revisiondiff?source={source}&target={target}"
+        Config.MD_BULK = True
+
+
+class GitHubStandin(Standin):
+    """
+    Serves the packages (dictionary name: GitPkg) as GitHub repositories, for the API calls done
+    by gittree.get_gitpkg_content, gitcache.GitRepoCache and gitgraphql.GraphQLBackend:
+    GET  /rate_limit
+    GET  /orgs/{org}
+    GET  /repos/{org}/{repo}[/contents/{path}|/teams|/commits/HEAD]
+    POST /graphql
+    Each repository has its READMEs and, if it has dependencies, the ups table.
+    REST and GraphQL requests have separate quotas of rate_limit requests per reset_seconds,
+    when a quota is exhausted the requests are refused with 403 until the reset.
+    """
+    handler = GitHubHandler
+
+    def __init__(self, packages, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 rate_limit=5000, reset_seconds=3600):
+        Standin.__init__(self, host, port, latency, jitter)
+        self.repos = dict()
+        self.shas = dict()
+        self.teams = dict()    # org: {team: [repo names]}
+        for gitpkg in packages.values():
+            key = (gitpkg.org, gitpkg.name)
+            self.repos[key] = gitpkg
+            self.shas[key] = hashlib.sha1(json.dumps(gitpkg.to_dict(), sort_keys=True).encode("utf-8")).hexdigest()
+            for team in gitpkg.teams:
+                self.teams.setdefault(gitpkg.org, dict()).setdefault(team, []).append(gitpkg.name)
+        self.rate_limit = rate_limit
+        self.reset_seconds = reset_seconds
+        self.quotas = dict()    # resource: [remaining, reset time]
+        self.limited = 0
+
+    def quota(self, resource):
+        now = time.time()
+        quota = self.quotas.get(resource)
+        if quota is None or quota[1] <= now:
+            quota = [self.rate_limit, int(now + self.reset_seconds)]
+            self.quotas[resource] = quota
+        return quota
+
+    def rate_headers(self, resource):
+        with self._lock:
+            quota = self.quota(resource)
+            return {'X-RateLimit-Limit': str(self.rate_limit),
+                    'X-RateLimit-Remaining': str(quota[0]),
+                    'X-RateLimit-Reset': str(quota[1]),
+                    'X-RateLimit-Used': str(self.rate_limit - quota[0]),
+                    'X-RateLimit-Resource': resource}
+
+    def rate_limit_json(self):
+        resources = dict()
+        for resource in ('core', 'graphql'):
+            headers = self.rate_headers(resource)
+            resources[resource] = {'limit': int(headers['X-RateLimit-Limit']),
+                                   'remaining': int(headers['X-RateLimit-Remaining']),
+                                   'reset': int(headers['X-RateLimit-Reset']),
+                                   'used': int(headers['X-RateLimit-Used'])}
+        return {'resources': resources, 'rate': resources['core']}
+
+    def take(self, resource):
+        """
+        Account a request against the quota of resource
+        :return: False if the quota is exhausted, the rate limit headers
+        """
+        with self._lock:
+            quota = self.quota(resource)
+            allowed = quota[0] > 0
+            if allowed:
+                quota[0] = quota[0] - 1
+            else:
+                self.limited = self.limited + 1
+        return allowed, self.rate_headers(resource)
+
+    def files(self, org, repo):
+        """
+        Returns the files of a repository, as dictionary path: text
+        """
+        gitpkg = self.repos[(org, repo)]
+        files = dict(gitpkg.readmes)
+        if gitpkg.ups_table:
+            files[f"ups/{repo}.table"] = "".join([f"setupRequired({dep})\n" for dep in gitpkg.ups_table])
+        return files
+
+    def entries(self, org, repo, folder):
+        """
+        Returns the entries of folder ("" for the root), as dictionary name: True if it is a folder
+        """
+        prefix = folder.strip('/') + '/' if folder.strip('/') else ""
+        entries = dict()
+        for path in self.files(org, repo):
+            if path.startswith(prefix):
+                name = path[len(prefix):]
+                entries[name.split('/')[0]] = '/' in name
+        return entries
+
+    def org_json(self, org):
+        if org not in [key[0] for key in self.repos]:
+            return None
+        return {'login': org, 'id': stable_id(org), 'type': 'Organization', 'url': f"{self.address}/orgs/{org}"}
+
+    def repo_json(self, org, repo):
+        gitpkg = self.repos.get((org, repo))
+        if not gitpkg:
+            return None
+        return {'id': stable_id(f"{org}/{repo}"),
+                'name': repo,
+                'full_name': f"{org}/{repo}",
+                'description': gitpkg.summary,
+                'private': False,
+                'default_branch': 'main',
+                'owner': {'login': org, 'type': 'Organization', 'url': f"{self.address}/orgs/{org}"},
+                'url': f"{self.address}/repos/{org}/{repo}"}
+
+    def contents_json(self, org, repo, path):
+        if (org, repo) not in self.repos:
+            return None
+        path = path.strip('/')
+        url = f"{self.address}/repos/{org}/{repo}/contents"
+        files = self.files(org, repo)
+        if path in files:
+            content = files[path].encode("utf-8")
+            return {'type': 'file', 'name': path.split('/')[-1], 'path': path, 'size': len(content),
+                    'encoding': 'base64', 'content': base64.b64encode(content).decode("ascii"), 'url': f"{url}/{path}"}
+        entries = self.entries(org, repo, path)
+        if path and not entries:
+            return None
+        prefix = path + '/' if path else ""
+        return [{'type': 'dir' if is_dir else 'file', 'name': name, 'path': prefix + name,
+                 'url': f"{url}/{prefix}{name}"} for name, is_dir in sorted(entries.items())]
+
+    def teams_json(self, org, repo):
+        gitpkg = self.repos.get((org, repo))
+        if not gitpkg:
+            return None
+        return [{'id': stable_id(f"{org}/{team}"), 'name': team, 'slug': team.lower().replace(' ', '-'),
+                 'url': f"{self.address}/orgs/{org}/teams/{team.lower().replace(' ', '-')}"}
+                for team in gitpkg.teams]
+
+    def git_object(self, org, repo, expression):
+        """
+        The object of a GraphQL object(expression: "HEAD:path") field
+        """
+        path = expression.split(':', 1)[1].strip('/')
+        files = self.files(org, repo)
+        if path in files:
+            return {'text': files[path]}
+        entries = self.entries(org, repo, path)
+        if path and not entries:
+            return None
+        return {'entries': [{'name': name, 'type': 'tree' if is_dir else 'blob'}
+                            for name, is_dir in sorted(entries.items())]}
+
+    def team_repos(self, names, first, after):
+        start = int(after) if after else 0
+        end = start + first
+        return {'pageInfo': {'hasNextPage': end < len(names), 'endCursor': str(end)},
+                'nodes': [{'name': name} for name in names[start:end]]}
+
+    def graphql(self, query):
+        """
+        Answer the queries of gitgraphql.GraphQLBackend: batches of repositories (with their git objects),
+        organization teams and team repositories
+        """
+        data = dict()
+        errors = []
+        match = GQL_TEAMS.search(query)
+        if match:
+            org = json.loads(match.group(1))
+            teams = sorted(self.teams.get(org, dict()).items())
+            start = int(json.loads(match.group(3))) if match.group(3) else 0
+            end = start + int(match.group(2))
+            data['organization'] = {'teams': {
+                'pageInfo': {'hasNextPage': end < len(teams), 'endCursor': str(end)},
+                'nodes': [{'id': f"{org}/{team}", 'name': team, 'repositories': self.team_repos(repos, 100, None)}
+                          for team, repos in teams[start:end]]}}
+            return {'data': data}
+        match = GQL_TEAM_REPOS.search(query)
+        if match:
+            org, team = json.loads(match.group(1)).split('/', 1)
+            repos = self.teams.get(org, dict()).get(team, [])
+            data['node'] = {'repositories': self.team_repos(repos, int(match.group(2)), json.loads(match.group(3)))}
+            return {'data': data}
+        repo_matches = list(GQL_REPO.finditer(query))
+        for count, match in enumerate(repo_matches):
+            alias, org, repo = match.group(1), json.loads(match.group(2)), json.loads(match.group(3))
+            end = repo_matches[count + 1].start() if count + 1 < len(repo_matches) else len(query)
+            fields = query[match.end():end]
+            gitpkg = self.repos.get((org, repo))
+            if not gitpkg:
+                data[alias] = None
+                errors.append({'type': 'NOT_FOUND', 'path': [alias],
+                               'message': f"Could not resolve to a Repository with the name '{org}/{repo}'."})
+                continue
+            content = dict()
+            if 'description' in fields:
+                content.update({'name': repo, 'description': gitpkg.summary,
+                                'defaultBranchRef': {'target': {'oid': self.shas[(org, repo)]}}})
+            for object_match in GQL_OBJECT.finditer(fields):
+                content[object_match.group(1)] = self.git_object(org, repo, json.loads(object_match.group(2)))
+            data[alias] = content
+        response = {'data': data}
+        if errors:
+            response['errors'] = errors
+        return response
+
+    def configure(self):
+        """
+        Point the GitHub urls in Config to this server
+        """
+        Config.GIT_API_URL = self.address
+        Config.GIT_GRAPHQL_URL = self.address + "/graphql"
+
@@ -0,0 +1,132 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Synthetic product trees, with the same shape of data as the ones extracted from MagicDraw
+(already converted to LaTeX), and GitHub packages of their products,
+to benchmark the document generation without a server.
+"""
+
+import random
+from treelib import Tree
+from .util import Product, GitPkg, split_pkg_name
+from . import treeview
+
+WORDS = ["data", "alert", "processing", "pipeline", "science", "image", "catalog", "calibration",
+         "archive", "service", "database", "middleware", "release", "template", "camera", "survey"]
+TEAMS = ["Architecture", "Data Facility", "Science Pipelines", "Middleware", "Science Platform"]
+PEOPLE = ["A. Manager", "B. Owner", "C. Lead", "D. Scientist", "E. Engineer"]
+
+
+def words(rng, n):
+    return " ".join(rng.choice(WORDS) for i in range(n))
+
+
+def dependencies(rng, known):
+    """
+    Up to 2 relations to known products, as returned by mdtree.get_pkg_key
+    """
+    return [{'name': words(rng, 3).title(), 'key': key, 'shortname': "", 'diagrams': []}
+            for key in rng.sample(known, min(len(known), rng.randint(0, 2)))]
+
+
+def synthetic_product(rng, pid, parent, index, known):
+    """
+    A product with all the fields filled as in a real tree
+    :param known: ids of the products already created, for the dependencies
+    """
+    name = words(rng, rng.randint(1, 4)).title()
+    return Product(pid,
+                   name,
+                   parent,
+                   words(rng, rng.randint(10, 60)) + "\n",
+                   [f"1.02C.{rng.randint(1, 12):02d}"],
+                   rng.choice(PEOPLE),
+                   [rng.choice(PEOPLE)],
+                   "",
+                   [f"pkg_{pid.lower()}_{i}" for i in range(rng.randint(0, 3))],
+                   dependencies(rng, known),
+                   f"el-{pid}",
+                   [f"https://example.org/{pid.lower()}"] if rng.random() < 0.3 else [""],
+                   [rng.choice(TEAMS)],
+                   name[:20],
+                   dependencies(rng, known),
+                   [{'id': f"DMS-REQ-{rng.randint(1, 999):04d}", 'name': words(rng, 5)}
+                    for i in range(rng.randint(0, 3))],
+                   [["", f"LDM-{rng.randint(100, 999)}", words(rng, 4)] for i in range(rng.randint(0, 2))],
+                   str(index))
+
+
+def synthetic_tree(size, fanout=5, depth=0, seed=0):
+    """
+    A product tree of size nodes, grown breadth first.
+    :param fanout: average number of children of a product (between 1 and 2 * fanout - 1)
+    :param depth: max depth of the tree (0 for no limit), the tree is smaller than size if the limit is reached
+    :param seed: the same seed gives the same tree
+    """
+    rng = random.Random(seed)
+    ptree = Tree()
+    root = synthetic_product(rng, "P0", "", 1, [])
+    ptree.create_node(root.id, root.id, data=root)
+    known = [root.id]
+    frontier = [(root.id, 0)]
+    while frontier and len(known) < size:
+        next_frontier = []
+        for pid, level in frontier:
+            if depth and level >= depth:
+                continue
+            for i in range(rng.randint(1, 2 * fanout - 1)):
+                if len(known) >= size:
+                    break
+                prod = synthetic_product(rng, f"P{len(known)}", pid, i + 1, known)
+                ptree.create_node(prod.id, prod.id, data=prod, parent=pid)
+                known.append(prod.id)
+                next_frontier.append((prod.id, level + 1))
+        frontier = next_frontier
+    return ptree
+
+
+def readme(rng, name):
+    return f"# {name}\n\n" + "\n".join(words(rng, rng.randint(3, 12)) for i in range(rng.randint(3, 40)))
+
+
+def synthetic_packages(ptree, seed=0, missing=0.05):
+    """
+    GitHub packages of the products in ptree, depending (ups table) on a set of shared libraries.
+    :param missing: fraction of the product packages not on GitHub
+    :return: dictionary package name: GitPkg
+    """
+    rng = random.Random(seed)
+    names = [pkg for prod in treeview.products(ptree) for pkg in prod.pkgs if pkg]
+    libraries = [f"lib_{i}" for i in range(max(1, len(names) // 4))]
+    packages = dict()
+    for count, name in enumerate(libraries):
+        # libraries depend only on the previous ones, the dependencies are not circular
+        deps = rng.sample(libraries[:count], min(count, rng.randint(0, 2)))
+        packages[name] = GitPkg("", name, "lsst", {"README.md": readme(rng, name)}, deps, [rng.choice(TEAMS)],
+                                words(rng, 8))
+    for name in names:
+        if rng.random() < missing:
+            continue
+        org, repo = split_pkg_name(name)
+        packages[name] = GitPkg("", repo, org, {"README.md": readme(rng, repo)},
+                                rng.sample(libraries, min(len(libraries), rng.randint(0, 3))),
+                                [rng.choice(TEAMS)], words(rng, 8))
+    return packages
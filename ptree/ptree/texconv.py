@@ -0,0 +1,123 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Text conversion with pandoc, in batches: the fragments to convert are joined
+with numbered separators, converted with a single pandoc run and split back.
+Each distinct fragment is converted only once. Simple html fragments are converted
+to LaTeX in process (see htmllatex), without running pandoc.
+"""
+
+import re
+import threading
+import pandoc
+
+from . import htmllatex
+
+CHUNK_SIZE = 200  # max fragments per pandoc run
+MARKER = "PTREEFRAGMENT{}X"
+MARKER_PATTERN = re.compile(r"\s*PTREEFRAGMENT(\d+)X\s*")
+
+_cache = dict()
+_lock = threading.Lock()
+pandoc_runs = 0
+converted = 0
+fast_converted = 0
+fast_path = True
+
+
+def run_pandoc(text, src, dst):
+    """
+    Convert text from src to dst format, a new Document is used so that it can run in any thread
+    """
+    global pandoc_runs
+    with _lock:
+        pandoc_runs = pandoc_runs + 1
+    doc = pandoc.Document()
+    setattr(doc, src, text.encode("utf-8"))
+    return getattr(doc, dst).decode("utf-8")
+
+
+def separator(i, src):
+    if src == 'html':
+        return "\n<p>" + MARKER.format(i) + "</p>\n"
+    return "\n\n" + MARKER.format(i) + "\n\n"
+
+
+def convert_chunk(fragments, src, dst):
+    """
+    Convert the fragments with one pandoc run, or one run per fragment
+    if the separators do not survive the conversion
+    """
+    if len(fragments) > 1:
+        joined = "".join([fragment + separator(i, src) for i, fragment in enumerate(fragments)])
+        parts = MARKER_PATTERN.split(run_pandoc(joined, src, dst))
+        # text, index, text, index, ..., text (empty after the last separator)
+        if len(parts) == 2 * len(fragments) + 1 and \
+                [int(n) for n in parts[1::2]] == list(range(len(fragments))):
+            return [part + "\n" for part in parts[0:-1:2]]
+    return [run_pandoc(fragment, src, dst) for fragment in fragments]
+
+
+def convert(fragments, src, dst):
+    """
+    Returns the fragments converted from src to dst format (pandoc format names)
+    """
+    if src == dst:
+        return list(fragments)
+    global converted, fast_converted
+    with _lock:
+        todo = list(dict.fromkeys([fragment for fragment in fragments
+                                   if fragment.strip() and (src, dst, fragment) not in _cache]))
+    if fast_path and src == 'html' and dst == 'latex':
+        fast = [(fragment, htmllatex.html_to_latex(fragment)) for fragment in todo]
+        with _lock:
+            for fragment, result in fast:
+                if result is not None:
+                    _cache[(src, dst, fragment)] = result
+                    fast_converted = fast_converted + 1
+        todo = [fragment for fragment, result in fast if result is None]
+    for start in range(0, len(todo), CHUNK_SIZE):
+        chunk = todo[start:start + CHUNK_SIZE]
+        results = convert_chunk(chunk, src, dst)
+        with _lock:
+            for fragment, result in zip(chunk, results):
+                _cache[(src, dst, fragment)] = result
+            converted = converted + len(chunk)
+    with _lock:
+        # pandoc output for a blank input is a newline
+        return [_cache[(src, dst, fragment)] if fragment.strip() else "\n" for fragment in fragments]
+
+
+def check_fast_path(fragments):
+    """
+    Compare the in process html to LaTeX conversion with pandoc
+    :return: number of fragments converted in process, list of (fragment, in process, pandoc) that differ
+    """
+    fragments = list(dict.fromkeys([fragment for fragment in fragments if fragment.strip()]))
+    fast = [(fragment, htmllatex.html_to_latex(fragment)) for fragment in fragments]
+    fast = [(fragment, result) for fragment, result in fast if result is not None]
+    differ = []
+    for start in range(0, len(fast), CHUNK_SIZE):
+        chunk = fast[start:start + CHUNK_SIZE]
+        results = convert_chunk([fragment for fragment, result in chunk], 'html', 'latex')
+        differ.extend([(fragment, result, expected)
+                       for (fragment, result), expected in zip(chunk, results) if result != expected])
+    return len(fast), differ
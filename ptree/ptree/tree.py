@@ -21,8 +21,11 @@
 Code for generation Product Tree diagrams
 """
 import os
-from .util import Product
-from treelib import Tree
+import io
+import hashlib
+from .config import Config
+from .util import products_digest, write_if_changed
+from . import treeview
 
 txtheight = 36   # pt
 leafHeight = 37  # pt space per leaf box .. height of page calc
@@ -31,37 +34,96 @@ smallGap = 6  # pt between leaf boxes in the same group
 bigGap = 43  # pt between different levels, or leaf boxes
 sep = 3  # pt inner sep
 backgap = 14  # pt
-backrate = (leafWidth - backgap) / leafWidth
+rowHeight = leafHeight + smallGap  # pt between the rows of a portrait subtree
+mm = 72.27 / 25.4  # pt
+pboxWidth = 35 * mm + 2 * sep  # pt, see the pbox style
+wbboxWidth = 30 * mm + 2 * 2  # pt, see the wbbox style
+wbboxHeight = 40  # pt
+BOX_SIZE = {'pbox': (pboxWidth, txtheight), 'wbbox': (wbboxWidth, wbboxHeight)}
 
 WBS = 1  # Put WBS on diagram
 PKG = 1  # put packages on diagram
 outdepth = 100  # set with --depth if you want a shallower tree
+# first line of the diagrams whose pdf page is already cropped to the picture (preview tightpage)
+TIGHT_BBOX_MARK = "% ptree: tight bounding box"
 
+# the diagrams depend on the products and on this code
+_layout_stamp = hashlib.sha1(open(__file__, 'rb').read()).hexdigest()
 
-def tree_slice(ptree, outdepth):
-    """
-    Returns a subproduct with depth equal to outdepth
-    :param ptree: input product tree
-    :param outdepth: depth of the subproduct tree
-    :return: sub product tree
-    """
-    if ptree.depth() == outdepth:
-        return ptree
-    # copy the tree but stopping at given depth
-    ntree = Tree()
-    nodes = ptree.expand_tree(key=lambda x: x.data.index, sorting=True)
-    count = 0
-    for n in nodes:
-        depth = ptree.depth(n)
-        prod = ptree[n].data
-        if depth <= outdepth:
-            if count == 0:
-                ntree.create_node(prod.id, prod.id, data=prod)
+
+class TreeIndex(object):
+    """
+    Per node information of a product tree, computed once in a single traversal:
+    children in the MagicDraw order, depth, subtree size, number of leaves
+    and height (max depth below the node).
+    The nodes are kept in pre-order, so that each subtree is a contiguous slice of it.
+    """
+
+    def __init__(self, ptree):
+        self.ptree = ptree
+        self.root = ptree.root
+        self.order = []
+        self.position = dict()
+        self.children = dict()
+        self.depth = dict()
+        self.size = dict()
+        self.leaves = dict()
+        self.height = dict()
+        stack = [(self.root, 0)]
+        while stack:
+            nid, depth = stack.pop()
+            self.position[nid] = len(self.order)
+            self.order.append(nid)
+            self.depth[nid] = depth
+            children = list(treeview.children(ptree, nid))
+            self.children[nid] = children
+            stack.extend([(child, depth + 1) for child in reversed(children)])
+        for nid in reversed(self.order):
+            children = self.children[nid]
+            if children:
+                self.size[nid] = 1 + sum([self.size[child] for child in children])
+                self.leaves[nid] = sum([self.leaves[child] for child in children])
+                self.height[nid] = 1 + max([self.height[child] for child in children])
             else:
-                ntree.create_node(prod.id, prod.id, data=prod,
-                                  parent=prod.parent)
-            count = count + 1
-    return ntree
+                self.size[nid] = 1
+                self.leaves[nid] = 1
+                self.height[nid] = 0
+
+    def data(self, nid):
+        return self.ptree[nid].data
+
+    def subtree(self, nid):
+        """ Ids of the subtree at nid, in pre-order """
+        start = self.position[nid]
+        return self.order[start:start + self.size[nid]]
+
+
+def diagram_digest(index, root, *extra):
+    """
+    Returns the digest of the inputs of a diagram: the products in the tree and the layout parameters
+    """
+    return products_digest([index.data(n) for n in index.subtree(root)], _layout_stamp, *extra)
+
+
+def diagram_is_current(filename, digest):
+    """
+    True if filename has already been generated from the same inputs
+    """
+    if Config.OUTPUT_MANIFEST is None:
+        return False
+    if Config.OUTPUT_MANIFEST.is_current(filename, digest):
+        print("Unchanged Product Tree in ", filename)
+        return True
+    return False
+
+
+def save_diagram(filename, ofile, digest):
+    """
+    Write the diagram source, leaving the file untouched if the content is the same
+    """
+    write_if_changed(filename, ofile.getvalue())
+    if Config.OUTPUT_MANIFEST is not None:
+        Config.OUTPUT_MANIFEST.update(filename, digest)
 
 
 def print_header(target, pwidth, pheight, ofile):
@@ -74,7 +136,8 @@ def print_header(target, pwidth, pheight, ofile):
     :return: none
     """
     target = target.strip('\n')
-    print("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n"
+    print(f"{TIGHT_BBOX_MARK}\n"
+          "%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n"
           "%\n"
           f"% Document:     {target}  product tree\n"
           "%\n"
@@ -91,6 +154,9 @@ def print_header(target, pwidth, pheight, ofile):
           "\\newcommand\showpage{%\n"
           "\\setlayoutscale{0.5}\setlabelfont{\\tiny}\printheadingsfalse\printparametersfalse\n"
           "\\currentpage\pagedesign}\n"
+          "\\usepackage[active,tightpage]{preview}\n"
+          "\\PreviewEnvironment{tikzpicture}\n"
+          "\\setlength\\PreviewBorder{2pt}\n"
           "\\hypersetup{pdftitle={" + target + " products }, pdfsubject={Diagram illustrating the\n"
           "                products in LSST " + target +" }, pdfauthor={Extracted from MagicDraw}}\n"
           "\\tikzstyle{tbox}=[rectangle,text centered, text width=30mm]\n"
@@ -113,415 +179,249 @@ def print_footer(ofile):
           "\\end{document}", file=ofile)
 
 
-def drawLines(fout, row):
-    for p in row:
-        prod = p.data
-        print(r" \draw[pline]   ({p.id}.north) -- ++(0.0,0.5) -| ({p.parent}.south) ; ".format(p=prod), file=fout)
+class Layout(object):
+    """
+    Absolute placement of the boxes of a diagram:
+    box centers in pt (y growing upwards) and the edges between parent and child boxes
+    """
+
+    def __init__(self):
+        self.boxes = []
+        self.edges = []
+        self.pos = dict()
+        self.xmin = self.ymin = float('inf')
+        self.xmax = self.ymax = float('-inf')
+
+    def place(self, prod, style, x, y):
+        width, height = BOX_SIZE[style]
+        self.boxes.append((prod, style, x, y))
+        self.pos[prod.id] = (x, y, height)
+        self.xmin = min(self.xmin, x - width / 2)
+        self.xmax = max(self.xmax, x + width / 2)
+        self.ymin = min(self.ymin, y - height / 2)
+        self.ymax = max(self.ymax, y + height / 2)
+
+    def connect(self, kind, parent, child):
+        self.edges.append((kind, parent, child))
+
+    def width(self):
+        return self.xmax - self.xmin if self.boxes else 0
+
+    def height(self):
+        return self.ymax - self.ymin if self.boxes else 0
+
+
+def layout_portrait(layout, index, nid, x, row, style='pbox', depth=0):
+    """
+    Place the subtree at nid in PORTRAIT format: one row per leaf, children in the column to the right
+    :param x: center of the column of nid
+    :param row: first row of the subtree
+    """
+    layout.place(index.data(nid), style, x, -row * rowHeight)
+    if depth >= outdepth:
+        return
+    cx = x + BOX_SIZE[style][0] / 2 + bigGap + pboxWidth / 2
+    for child in index.children[nid]:
+        layout.connect('portrait', nid, child)
+        layout_portrait(layout, index, child, cx, row, 'pbox', depth + 1)
+        row = row + index.leaves[child]
+
+
+def layout_compact(layout, index, nid, x, row, depth=0):
+    """
+    Place the subtree at nid in PORTRAIT COMPACT format: one row per product,
+    children indented under their parent
+    :param x: center of the column of nid
+    :param row: first row of the subtree
+    """
+    layout.place(index.data(nid), 'pbox', x, -row * rowHeight)
+    if depth >= outdepth:
+        return
+    row = row + 1
+    for child in index.children[nid]:
+        layout.connect('compact', nid, child)
+        layout_compact(layout, index, child, x + pboxWidth - backgap, row, depth + 1)
+        row = row + index.size[child]
+
+
+def layout_blocks(layout, index, nids, compact, left):
+    """
+    Place side by side, from left, the portrait subtrees at nids, with their root in row 0
+    """
+    for nid in nids:
+        x = left + pboxWidth / 2
+        if compact:
+            layout_compact(layout, index, nid, x, 0)
+            right = x + pboxWidth / 2 + index.height[nid] * (pboxWidth - backgap)
+        else:
+            layout_portrait(layout, index, nid, x, 0)
+            right = x + pboxWidth / 2 + index.height[nid] * (pboxWidth + bigGap)
+        left = right + bigGap
+
+
+def place_above(layout, index, nid, children):
+    """
+    Place nid above the middle of its children row (landscape)
+    """
+    x, y, height = layout.pos[children[(len(children) + 1) // 2 - 1]]
+    layout.place(index.data(nid), 'wbbox', x, y + height / 2 + bigGap + wbboxHeight / 2)
+    for child in children:
+        layout.connect('landscape', nid, child)
+
+
+def layout_tree_portrait(index, root):
+    """ Full tree in portrait """
+    layout = Layout()
+    layout_portrait(layout, index, root, 0, 0, 'wbbox')
+    return layout
 
 
-def outputWBSPKG(fout, prod):
-    print("] {", file=fout, end='')
-    print(r"\textbf{" + prod.shortname + "} };", file=fout, end='')
-    # print("};", file=fout)
+def layout_landmix1(index, root, compact):
+    """
+    First level in landscape, second level subtrees in portrait
+    """
+    layout = Layout()
+    children = index.children[root]
+    if children:
+        layout_blocks(layout, index, children, compact, 0)
+        place_above(layout, index, root, children)
+    else:
+        layout.place(index.data(root), 'wbbox', 0, 0)
+    return layout
+
+
+def layout_full_tree(index, root, compact):
+    """
+    First and second level in landscape, third level subtrees in portrait
+    """
+    layout = Layout()
+    first_level = index.children[root]
+    left = 0
+    for fl in first_level:
+        second_level = index.children[fl]
+        if second_level:
+            layout_blocks(layout, index, second_level, compact, left)
+            place_above(layout, index, fl, second_level)
+        else:
+            layout.place(index.data(fl), 'wbbox', left + wbboxWidth / 2, txtheight / 2 + bigGap + wbboxHeight / 2)
+        left = layout.xmax + bigGap
+    if first_level:
+        place_above(layout, index, root, first_level)
+    else:
+        layout.place(index.data(root), 'wbbox', 0, 0)
+    return layout
+
+
+def tex_box(fout, prod, style, x, y):
+    """ Write a product box, with its WBS and packages """
+    at = f"at ({x:.2f}pt,{y:.2f}pt)"
+    if style == 'wbbox':
+        print(r"\node ({p.id}) [wbbox] {at} {{\textbf{{{p.name}}}}};".format(p=prod, at=at), file=fout)
+        return
+    print(r"\node ({p.id}) [pbox] {at} {{\textbf{{{p.shortname}}}}};".format(p=prod, at=at), file=fout)
     if WBS == 1 and prod.wbs != "":
         print(r"\node [below right] at ({p.id}.north west) {{\footnotesize \color{{blue}}{w}}} ;".
               format(p=prod, w=' '.join(prod.wbs)), file=fout)
     if PKG == 1 and prod.pkgs:
-        print(r"\node ({p.id}pkg) [tbox,below=3mm of {p.id}.north] {{".format(g=smallGap, p=prod), file=fout, end='')
+        print(r"\node ({p.id}pkg) [tbox,below=3mm of {p.id}.north] {{".format(p=prod), file=fout, end='')
         print(r"{\footnotesize \color{black} \begin{verbatim} " + ' '.join(prod.pkgs) + r" \end{verbatim} }  };",
               file=fout)
     print("", file=fout)
-    return
-
-
-def tex_tree_portrait(fout, ptree, width, sib, full):
-    """
-    Write the product tree in PORTRAIT format
-    :param ptree: product tree to dump
-    :param width: the distance from the sibling, that depends from the depth of the previous subtree
-    :param sib: the sibling that has to refer to (the left)
-    :param full: true or false
-    :param fout: output file resource
-    :return:
-    """
-    fnodes = []
-    nodes = ptree.expand_tree(key=lambda x: x.data.index, sorting=True)  # default mode=DEPTH
-    count = 0
-    prev = Product("n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n")
-    # Text height + the gap added to each one
-    for n in nodes:
-        prod = ptree[n].data
-        fnodes.append(prod)
-        depth = ptree.depth(n)
-        count = count + 1
-        # print("{} Product: {p.id} name: {p.name} parent: {p.parent}".format(depth, p=prod))
-        if depth <= outdepth:
-            if count == 1:  # root node
-                if full:  # if the first node of a full tree, no parent
-                    print(r"\node ({p.id}) [wbbox]{{\textbf{{{p.name}}}}};".format(p=prod), file=fout)
-                else:  # some sub tree (portrait) in a landscape tree
-                    print(r"\node ({p.id}) [pbox, ".format(p=prod), file=fout)
-                    if sib:
-                        print("right={d}pt of {p.id}".format(d=width, p=sib), file=fout, end='')
-                    # print(r"] {\textbf{" + prod.shortname + "} };", file=fout)
-                    outputWBSPKG(fout, prod)
-            else:
-                print(r"\node ({p.id}) [pbox,".format(p=prod), file=fout, end='')
-                if prev.parent != prod.parent:  # first child to the right if portrait left if landscape
-                    found = 0
-                    scount = count - 1
-                    while found == 0 and scount > 0:
-                        scount = scount - 1
-                        found = fnodes[scount].parent == prod.parent
-                    if scount <= 0:  # first sib can go righ of parent
-                        print("right={g}pt of {p.parent}".format(g=bigGap, p=prod),
-                              file=fout, end='')
-                    else:  # Figure how low to go  - find my prior sibling
-                        psib = fnodes[scount]
-                        leaves = ptree.leaves(psib.id)
-                        depth = len(leaves) - 1
-                        # the number of leaves below my sibling
-                        dist = depth * (leafHeight + smallGap) + smallGap
-                        print("below={}pt of {}".format(dist, psib.id),
-                              file=fout, end='')
-                else:
-                    # benetih the sibling
-                    dist = smallGap
-                    print("below={}pt of {}".format(dist, prev.id), file=fout, end='')
-                outputWBSPKG(fout, prod)
-                print(r" \draw[pline] ({p.parent}.east) -| ++(0.4,0) |- ({p.id}.west); ".format(p=prod), file=fout)
-            prev = prod
-    return count
-
-
-def tex_tree_portrait0(fout, ptree, width, sib, full):
-    """
-    Write the product tree in PORTRAIT COMPACT format
-    :param ptree: product tree to dump
-    :param width: the distance from the sibling, that depends from the depth of the previous subtree
-    :param sib: the sibling that has to refer to (the left)
-    :param full: true or false
-    :param fout: output file resource
-    :return:
-    """
-    fnodes = []
-    nodes = ptree.expand_tree(key=lambda x: x.data.index, sorting=True)  # default mode=DEPTH
-    count = 0
-    prev = Product("n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n", "n")
-    # Text height + the gap added to each one
-    for n in nodes:
-        prod = ptree[n].data
-        fnodes.append(prod)
-        depth = ptree.depth(n)
-        count = count + 1
-        if depth <= outdepth:
-            if count == 1:  # root node
-                if full:  # if the first node of a full tree, no parent
-                    print(r"\node ({p.id}) [wbbox]{{\textbf{{{p.name}}}}};".format(p=prod), file=fout)
-                else:  # some sub tree (portrait) in a landscape tree
-                    print(r"\node ({p.id}) [pbox, ".format(p=prod), file=fout)
-                    if sib:
-                        print("right={d}pt of {p.id}".format(d=width, p=sib), file=fout, end='')
-                    outputWBSPKG(fout, prod)
-            else:
-                print(r"\node ({p.id}) [pbox,".format(p=prod), file=fout, end='')
-                if prev.parent != prod.parent:  # first child to the right if portrait left if landscape
-                    found = 0
-                    scount = count - 1
-                    while found == 0 and scount > 0:
-                        scount = scount - 1
-                        found = fnodes[scount].parent == prod.parent
-                    if scount <= 0:
-                        print("below right={g}pt and -{b}pt of {p.parent}".format(p=prod, g=smallGap, b=backgap),
-                              file=fout, end='')
-                    else:  # Figure how low to go  - find my prior sibling
-                        psib = fnodes[scount]
-                        sib_sub_tree = ptree.subtree((psib.id))
-                        nnodes = sib_sub_tree.size()
-                        depth = nnodes - 1
-                        # the number of leaves below my sibling
-                        dist = depth * (txtheight + smallGap + 1) + smallGap
-                        print("below={}pt of {}".format(dist, psib.id),
-                              file=fout, end='')
-                else:
-                    # benetih the sibling
-                    print("below={}pt of {}".format(smallGap, prev.id), file=fout, end='')
-                outputWBSPKG(fout, prod)
-                print(r" \draw[pline] ({p.parent}.south) -| ++(0,0) |- ({p.id}.west); ".format(p=prod), file=fout)
-            prev = prod
-    return count
-
-
-def tex_tree_landmix1(fout, ptree, compact):
-    """ Write the product tree diagram:
-        first level in landscape
-        second level subtrees in portrait
-    :param fout: outputfile
-    :param ptree: input product tree
-    :param compact: if the landscape is compact or not
-    :return: none
+
+
+EDGES = {'portrait': r" \draw[pline] ({p}.east) -| ++(0.4,0) |- ({c}.west); ",
+         'compact': r" \draw[pline] ({p}.south) |- ({c}.west); ",
+         'landscape': r" \draw[pline]   ({c}.north) -- ++(0.0,0.5) -| ({p}.south) ; "}
+
+
+def tex_layout(fout, layout):
     """
-    stub = tree_slice(ptree, 1)
-    nodes = stub.expand_tree(mode=Tree.WIDTH, key=lambda x: x.data.index, sorting=True)  # default mode=DEPTH
-    row = []
-    count = 0
-    root = None
-    for n in nodes:
-        count = count + 1
-        if count == 1:  # root node
-            root = ptree[n].data
-        else:
-            row.append(ptree[n])
-    root_position = int(count / 2) -1
-    if root_position < 0:
-        root_position = 0
-    # print(f"Count: {count}, Root position: {root_position}")
-    child = row[root_position].data
-    sib = None
-    count = 1  # will output root after
-    prev = None
-    for n in row:  # for each top level element put it out in portrait
-        p = n.data
-        stree = ptree.subtree(p.id)
-        d = 1
-        if prev:
-            d = prev.depth()
-        if compact:
-            if d != 0:
-                width = d * (leafWidth - backgap)
-            else:
-                width = bigGap
-            count = count + tex_tree_portrait0(fout, stree, width, sib, False)
-        else:
-            width = d * (leafWidth + bigGap) + bigGap
-            count = count + tex_tree_portrait(fout, stree, width, sib, False)
-        sib = p
-        prev = stree
-    # place root node
-    print(r"\node ({p.id}) "
-          r"[wbbox, above={bg}pt of {c.id}]{{\textbf{{{p.name}}}}};".format(bg=bigGap, p=root, c=child), file=fout)
-    drawLines(fout, row)
-    print("{} Product lines in TeX ".format(count))
-
-
-def tex_full_tree(fout, ptree, compact):
-    """ Write the product tree diagram:
-        first level in landscape
-        second level subtrees in portrait
-    :param fout: outputfile
-    :param ptree: input product tree
-    :param compact: if the landscape is compact or not
-    :return: none
+    Write the boxes at their absolute position, then the lines connecting them
     """
-    fl_stub = tree_slice(ptree, 1)
-    fl_nodes = fl_stub.expand_tree(mode=Tree.WIDTH, key=lambda x: x.data.index, sorting=True)  # default mode=DEPTH
-    fl_row = []
-    fl_count = 0
-    root = None
-    sl_d = 0
-    sib = None
-    p_count = 0
-    for fl in fl_nodes:
-        fl_count = fl_count + 1
-        if fl_count == 1:  # root node
-            root = ptree[fl].data
-        else:
-            fl_row.append(ptree[fl])  # superfluous, to remove
-            s = ptree[fl].data
-            sl_subtree = ptree.subtree(s.id)
-            sl_stub = tree_slice(sl_subtree, 1)
-            sl_nodes = sl_stub.expand_tree(key=lambda x: x.data.index, sorting=True)
-            sl_row = []
-            sl_count = 0
-            sl_root = None
-            sl_size = 0
-            for sl in sl_nodes:
-                sl_count = sl_count + 1
-                if sl_count == 1:
-                    sl_root = ptree[sl].data
-                else:
-                    p = ptree[sl].data
-                    sl_row.append(ptree[sl])
-                    stree = ptree.subtree(p.id)
-                    if compact:
-                        if sl_d != 0 and sib is not None:
-                            width = sl_d * (leafWidth - backgap)
-                        else:
-                            width = bigGap
-                        sl_size = sl_size + width
-                        p_count = p_count + tex_tree_portrait0(fout, stree, width, sib, False)
-                    else:
-                        width = sl_d * (leafWidth + bigGap) + bigGap
-                        p_count = p_count + tex_tree_portrait(fout, stree, width, sib, False)
-                    sib = p
-                    sl_d = stree.depth()
-            # position the subtree root
-            sl_root_p = int(sl_count / 2) -1
-            if sl_root_p < 0:
-                sl_root_p = 0
-            # print(sl_count, sl_root_p)
-            sl_child = sl_row[sl_root_p].data
-            print(r"\node ({p.id}) "
-                  r"[wbbox, above={bg}pt of {c.id}]{{\textbf{{{p.name}}}}};".format(bg=bigGap,
-                                                                                    p=sl_root, c=sl_child), file=fout)
-            # print(" second level ", sl_row)
-            drawLines(fout, sl_row)
-    # place root node
-    root_position = int(fl_count / 2) -1
-    if root_position < 0:
-        root_position = 0
-    # print(f"Count: {count}, Root position: {root_position}")
-    child = fl_row[root_position].data
-    print(r"\node ({p.id}) "
-          r"[wbbox, above={bg}pt of {c.id}]{{\textbf{{{p.name}}}}};".format(bg=bigGap, p=root, c=child), file=fout)
-    # print("  first level ", fl_row)
-    drawLines(fout, fl_row)
-    print("{} Product lines in TeX ".format(p_count + fl_count))
-
-
-def make_tree_portrait(ptree, filename, scope):
+    for prod, style, x, y in layout.boxes:
+        tex_box(fout, prod, style, x, y)
+    for kind, parent, child in layout.edges:
+        print(EDGES[kind].format(p=parent, c=child), file=fout)
+    print("{} Product lines in TeX ".format(len(layout.boxes)))
+
+
+def write_diagram(layout, filename, scope, digest):
+    """
+    Write the diagram source, with the paper size given by the layout extents
+    """
+    ofile = io.StringIO()
+    print_header(scope, round(layout.width() + 2 * bigGap, 2), round(layout.height() + 2 * bigGap, 2), ofile)
+    tex_layout(ofile, layout)
+    print_footer(ofile)
+    save_diagram(filename, ofile, digest)
+
+
+def make_tree_portrait(ptree, filename, scope, index=None, root=None):
     """
     Fully portrait product tree diagram
     :param ptree:
     :param filename:
     :param scope:
+    :param index: TreeIndex of ptree, if already available
+    :param root: the node to start from, default the tree root
     :return: none
     """
+    index = index if index else TreeIndex(ptree)
+    root = root if root else index.root
+    digest = diagram_digest(index, root, "portrait", scope)
+    if diagram_is_current(filename, digest):
+        return
     print("Writing Portrait Product Tree in ", filename)
-
-    paperwidth = (ptree.depth() + 1) * (leafWidth + bigGap)
-    paperheight = len(ptree.leaves()) * (leafHeight + smallGap) + bigGap
-
-    ofile = open(filename, "w")
-    print_header(scope, paperwidth, paperheight, ofile)
-    tex_tree_portrait(ofile, ptree, paperwidth, None, True)
-    print_footer(ofile)
-    ofile.close()
+    write_diagram(layout_tree_portrait(index, root), filename, scope, digest)
 
 
-def make_tree_landmix1(ptree, filename, scope, compact):
+def make_tree_landmix1(ptree, filename, scope, compact, index=None, root=None):
     """
     First level landscape, and then portrait
     :param ptree:      tree to render in a graphic form
     :param filename:   filename to save the text source for the tree graph
     :param scope:
+    :param index: TreeIndex of ptree, if already available
+    :param root: the node to start from, default the tree root
     :return: none
     """
+    index = index if index else TreeIndex(ptree)
+    root = root if root else index.root
+    digest = diagram_digest(index, root, "landmix1", scope, compact)
+    if diagram_is_current(filename, digest):
+        return
     print("Writing Mixed (1 level) Landscape Product Tree in ", filename)
-
-    # calculating diagram size
-    first_level = tree_slice(ptree, 1)
-    nodes = first_level.expand_tree(key=lambda x: x.data.index, sorting=True)
-    n_blocks_high = 0
-    n_blocks_width = 0
-    paperwidth = 0
-    c = 0
-    for n in nodes:
-        c += 1
-        if c != 1:  # skip the first, that is the tp level node.
-            p = ptree[n].data
-            sub_tree = ptree.subtree(p.id)
-            if compact:
-                nnodes = sub_tree.size()
-                if nnodes > n_blocks_high:
-                    n_blocks_high = nnodes
-                sub_depth = sub_tree.depth()
-                if sub_depth == 0:
-                    n_blocks_width = n_blocks_width + 1
-                    paperwidth = paperwidth + leafWidth + bigGap
-                else:
-                    # the compression factor has been calculated based on the backgap = 14 pt
-                    n_blocks_width = n_blocks_width + 1 + sub_depth * 0.86
-                    paperwidth = paperwidth + leafWidth * (1 + sub_depth * backrate)
-                    # print(sub_depth, paperwidth)
-            else:
-                if len(sub_tree.leaves()) > n_blocks_high:
-                    n_blocks_high = len(sub_tree.leaves())
-                n_blocks_width = n_blocks_width + sub_tree.depth() + 1
-                paperwidth = (n_blocks_width + 1) * (leafWidth + bigGap)
-    paperheight = (n_blocks_high + 1) * (leafHeight + smallGap) + bigGap * 2
-
-    # dump file
-    ofile = open(filename, "w")
-    # print(n_blocks_width, paperwidth, "backrate:", backrate)
-    print_header(scope, paperwidth, paperheight, ofile)
-    tex_tree_landmix1(ofile, ptree, compact)
-    print_footer(ofile)
-    ofile.close()
+    write_diagram(layout_landmix1(index, root, compact), filename, scope, digest)
 
 
-def make_full_tree(ptree, filename, scope, compact):
+def make_full_tree(ptree, filename, scope, compact, index=None):
     """
     First level landscape, and then portrait
     :param ptree:
     :param filename:
     :param scope:
+    :param index: TreeIndex of ptree, if already available
     :return: none
     """
+    index = index if index else TreeIndex(ptree)
+    digest = diagram_digest(index, index.root, "full", scope, compact)
+    if diagram_is_current(filename, digest):
+        return
     print("Writing Mixed (2 levels) Landscape Full Product Tree in ", filename)
-
-    # calculating diagram size
-    first_level = tree_slice(ptree, 1)
-    fl_nodes = first_level.expand_tree(key=lambda x: x.data.index, sorting=True)
-    n_blocks_high = 0
-    n_blocks_width = 0
-    paperwidth = 0
-    fl_c = 0
-    for fl in fl_nodes:
-        fl_c = fl_c + 1
-        s = ptree[fl].data
-        if fl_c != 1:
-            sub_level = ptree.subtree(s.id)
-            second_level = tree_slice(sub_level,1)
-            sl_nodes = second_level.expand_tree(key=lambda x: x.data.index, sorting=True)
-            c = 0
-            for n in sl_nodes:
-                c = c + 1
-                if c != 1:  # skip the first, that is the tp level node.
-                    p = ptree[n].data
-                    sub_tree = ptree.subtree(p.id)
-                    nnodes = sub_tree.size()
-                    if nnodes > n_blocks_high:
-                        n_blocks_high = nnodes
-                    sub_depth = sub_tree.depth()
-                    if compact:
-                        if sub_depth == 0:
-                            n_blocks_width = n_blocks_width + 1
-                            paperwidth = paperwidth + leafWidth + bigGap
-                        else:
-                            # the compression factor has been calculated based on the backgap = 14 pt
-                            paperwidth = paperwidth + leafWidth * (sub_depth + 1) * backrate + smallGap
-                        # print(p.id, sub_depth, paperwidth, nnodes)
-                    else:
-                        paperwidth = paperwidth + (sub_depth + 1) * (leafWidth + bigGap)
-    paperheight = n_blocks_high * (leafHeight + smallGap) + (leafHeight + bigGap) * 2 + leafHeight
-    paperwidth = paperwidth + leafWidth
-
-    # dump file
-    ofile = open(filename, "w")
-    # print(n_blocks_width, paperwidth, "backrate:", backrate)
-    print_header(scope, paperwidth, paperheight, ofile)
-    tex_full_tree(ofile, ptree, compact)
-    print_footer(ofile)
-    ofile.close()
+    write_diagram(layout_full_tree(index, index.root, compact), filename, scope, digest)
 
 
-def make_subtrees(ptree, filename, scope, compact):
+def make_subtrees(ptree, filename, scope, compact, index=None):
     """
     subtrees in landscape mixed mode
     :param ptree:
+    :param index: TreeIndex of ptree, if already available
     :return: none
     """
     subfolder = "subtrees/"
     if not os.path.exists(subfolder):
         os.makedirs(subfolder)
-    first_level = tree_slice(ptree, 1)
-    nodes = first_level.expand_tree(key=lambda x: x.data.index, sorting=True)
-    c = 0
-    for n in nodes:
-        c = c + 1
-        if c != 1:
-            p = ptree[n].data
-            sub_tree = ptree.subtree(p.id)
-            sub_file_name = subfolder + filename + "_" + p.id + ".tex"
-            make_tree_landmix1(sub_tree, sub_file_name, scope, compact)
+    index = index if index else TreeIndex(ptree)
+    for nid in index.children[index.root]:
+        sub_file_name = subfolder + filename + "_" + index.data(nid).id + ".tex"
+        make_tree_landmix1(ptree, sub_file_name, scope, compact, index, nid)
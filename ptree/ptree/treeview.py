@@ -0,0 +1,68 @@
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+
+"""
+Views over a product tree: generators of node ids in the MagicDraw order,
+that neither copy the tree nor create new nodes
+"""
+
+
+def order_key(node):
+    """ Products are ordered by the position assigned in MagicDraw """
+    return node.data.index
+
+
+def children(ptree, nid=None):
+    """
+    Children of nid (default the root), sorted by index
+    """
+    nid = nid if nid is not None else ptree.root
+    for child in sorted(ptree.children(nid), key=order_key):
+        yield child.identifier
+
+
+def nodes(ptree, nid=None, depth=None):
+    """
+    Nodes of the subtree at nid (default the root) in pre-order, children sorted by index.
+    Same as ptree.expand_tree(nid, key=order_key, sorting=True)
+    :param depth: if given, only the nodes up to depth levels below nid
+    """
+    nid = nid if nid is not None else ptree.root
+    stack = [(nid, 0)]
+    while stack:
+        nid, level = stack.pop()
+        yield nid
+        if depth is None or level < depth:
+            stack.extend(reversed([(child, level + 1) for child in children(ptree, nid)]))
+
+
+def subtree(ptree, nid):
+    """
+    Nodes of the subtree rooted at nid, in pre-order
+    """
+    return nodes(ptree, nid)
+
+
+def products(ptree, nid=None, depth=None):
+    """
+    Products (node data) of the nodes view
+    """
+    for n in nodes(ptree, nid, depth):
+        yield ptree[n].data
@@ -23,20 +23,35 @@ Utility code for product tree generation
 """
 
 import yaml
-import csv
 import re
 import requests
-import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os.path
-from treelib import Tree
-from time import sleep
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from .config import Config
+from .mdthrottle import MDThrottle
+from . import texconv
+from . import metrics
+from time import perf_counter
+
+# requests in flight to the MagicDraw REST server, see md_slots()
+_md_slots = None
+_md_pool = None
+# retry policy of the MagicDraw requests, see md_throttle()
+_md_throttle = None
+# stereotype property names, per resource: {res: {definingFeature id: name}}
+_md_features = dict()
+# answers to a bulk retrieval meaning that the server does not support it
+BULK_UNSUPPORTED = (404, 405, 415)
 
 
 def _as_output_format(text, output_format):
     if Config.TEMPLATE_LANGUAGE != output_format:
-        setattr(Config.DOC, Config.TEMPLATE_LANGUAGE, text.encode("utf-8"))
-        text = getattr(Config.DOC, output_format).decode("utf-8")
+        text = texconv.convert([text], Config.TEMPLATE_LANGUAGE, output_format)[0]
     return text
 
 
@@ -47,74 +62,367 @@ def cite_docushare_handles(text):
 
 
 class Product(object):
+    """
+    A product of the tree, as extracted from MagicDraw.
+    The arguments after pkgs are optional, the lists default to empty lists.
+    """
+    __slots__ = ('id', 'name', 'parent', 'desc', 'wbs', 'manager', 'owner', 'kind', 'pkgs', 'depends',
+                 'elId', 'links', 'teams', 'shortname', 'usedin', 'reqs', 'docs', 'index')
+    id: str              # 1 key (0 is self)
+    name: str            # 2
+    parent: str          # 3
+    desc: str            # 4
+    wbs: list            # 5
+    manager: str         # 6
+    owner: list          # 7
+    kind: str            # 8
+    pkgs: list           # 9
+    depends: list        # 10
+    elId: str            # 11 MagicDraw Element Server Id
+    links: list          # 12
+    teams: list          # 13
+    shortname: str       # 14
+    usedin: list         # 15
+    reqs: list           # 16
+    docs: list           # 17
+    index: str           # 18 the position assigned in MD (number before the name)
+
     def __init__(self, p_id, name, parent, desc, wbs, manager, owner, kind,
-                 pkgs, depends, el_id, links, teams, shortname, usedin, reqs, docs, index):
-        self.id = p_id              # 1 key (0 is self)
-        self.name = name            # 2
-        self.parent = parent        # 3
-        self.desc = desc            # 4
-        self.wbs = wbs              # 5
-        self.manager = manager      # 6
-        self.owner = owner          # 7
-        self.kind = kind            # 8
-        self.pkgs = pkgs            # 9
-        self.depends = depends      # 10
-        self.elId = el_id           # 11 MagicDraw Element Server Id
-        self.links = links          # 12
-        self.teams = teams          # 13
-        self.shortname = shortname  # 14
-        self.usedin = usedin        # 15
-        self.reqs = reqs            # 16
-        self.docs = docs            # 17
-        self.index = index          # 18 the position assigned in MD (number before the name)
+                 pkgs, depends=None, el_id="", links=None, teams=None, shortname="", usedin=None, reqs=None,
+                 docs=None, index=""):
+        self.id = p_id
+        self.name = name
+        self.parent = parent
+        self.desc = desc
+        self.wbs = wbs
+        self.manager = manager
+        self.owner = owner
+        self.kind = kind
+        self.pkgs = pkgs
+        self.depends = depends if depends is not None else []
+        self.elId = el_id
+        self.links = links if links is not None else []
+        self.teams = teams if teams is not None else []
+        self.shortname = shortname
+        self.usedin = usedin if usedin is not None else []
+        self.reqs = reqs if reqs is not None else []
+        self.docs = docs if docs is not None else []
+        self.index = index
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        prod = cls.__new__(cls)
+        for field in cls.__slots__:
+            setattr(prod, field, values[field])
+        return prod
 
 
 class GitPkg(object):
-    def __init__(self, key, name, org, readmes, ups_table, teams, summary, component_id, component_name):
+    """
+    A software package on GitHub, with its ups dependencies
+    """
+    __slots__ = ('key', 'name', 'org', 'readmes', 'ups_table', 'teams', 'summary',
+                 'component_id', 'component_name')
+    key: str
+    name: str
+    org: str
+    readmes: dict
+    ups_table: list
+    teams: list
+    summary: str
+    component_id: str
+    component_name: str
+
+    def __init__(self, key, name, org, readmes=None, ups_table=None, teams=None, summary="",
+                 component_id="", component_name=""):
         self.key = key
         self.name = name
         self.org = org
-        self.readmes = readmes
-        self.ups_table = ups_table
-        self.teams = teams
+        self.readmes = readmes if readmes is not None else {}
+        self.ups_table = ups_table if ups_table is not None else []
+        self.teams = teams if teams is not None else []
         self.summary = summary
         self.component_id = component_id
         self.component_name = component_name
 
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+
+def split_pkg_name(pkg):
+    """
+    Returns organization and repository of a package name given as [org/]repo,
+    the default organization is lsst
+    """
+    spkg = pkg.split("/")
+    if len(spkg) == 2:
+        return spkg[0], spkg[1]
+    return 'lsst', pkg
+
+
+def parse_ups_table(lines):
+    """
+    Returns the packages required (setupRequired) in the lines of an ups table file
+    """
+    ups_table = []
+    for line in lines:
+        if "setupRequired" in line and line[:1] != "#":
+            # dependency = fix_tex(re.search(r'\((.*?)\)', line).group(1))
+            dependency = re.search(r'\((.*?)\)', line).group(1)
+            # use only what in "
+            if dependency[:1] == "\"":
+                dependency = re.search(r'\"(.*?)\"', dependency).group(1)
+            if dependency not in ups_table:
+                ups_table.append(dependency)
+    return ups_table
+
 
 def html_to_latex(string):
     """
     Convert html encoded source text into LaTeX
     Also docushare citations are rendered.
     """
-    Config.DOC.html = string.encode("utf-8")
-    tex_string = getattr(Config.DOC, Config.TEMPLATE_LANGUAGE).decode("utf-8")
+    return html_to_latex_batch([string])[0]
+
+
+def html_to_latex_batch(strings):
+    """
+    Convert a list of html encoded texts into LaTeX, with a single pandoc run
+    Also docushare citations are rendered.
+    """
+    tex_strings = texconv.convert(strings, 'html', Config.TEMPLATE_LANGUAGE)
     if Config.TEMPLATE_LANGUAGE == 'latex':
-        tex_string = cite_docushare_handles(tex_string)
+        tex_strings = [cite_docushare_handles(tex_string) for tex_string in tex_strings]
+    return tex_strings
+
+
+def md_slots():
+    """
+    Returns the semaphore limiting the requests in flight to the MagicDraw server
+    to Config.MD_MAX_IN_FLIGHT
+    """
+    global _md_slots
+    if _md_slots is None:
+        _md_slots = threading.BoundedSemaphore(Config.MD_MAX_IN_FLIGHT)
+    return _md_slots
+
+
+def md_pool():
+    """
+    Returns the thread pool used to fetch MagicDraw elements concurrently
+    """
+    global _md_pool
+    if _md_pool is None:
+        _md_pool = ThreadPoolExecutor(max_workers=Config.MD_MAX_IN_FLIGHT)
+    return _md_pool
+
 
-    return tex_string
+def md_shutdown():
+    """
+    Release the MagicDraw element pool, so the concurrency can be reconfigured
+    """
+    global _md_pool
+    global _md_slots
+    if _md_pool is not None:
+        _md_pool.shutdown()
+    _md_pool = None
+    _md_slots = None
+
+
+def md_session(connection_id):
+    """
+    Returns a session to the MagicDraw server, authenticated with connection_id.
+    The connections are kept alive and pooled, one per request in flight (Config.MD_MAX_IN_FLIGHT),
+    connection errors and gateway errors are retried by the transport.
+    """
+    session = requests.Session()
+    session.headers.update({
+        'accept': 'application/json',
+        'authorization': 'Basic %s' % connection_id
+    })
+    retries = Retry(total=Config.MD_RETRIES, backoff_factor=Config.MD_RETRY_BACKOFF,
+                    status_forcelist=(502, 503, 504), allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.MD_MAX_IN_FLIGHT, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def md_throttle():
+    """
+    Returns the retry policy of the MagicDraw requests (see mdthrottle.MDThrottle), configured from Config
+    """
+    global _md_throttle
+    if _md_throttle is None:
+        _md_throttle = MDThrottle(rate=Config.MD_RATE, burst=Config.MD_MAX_IN_FLIGHT, base=Config.MD_BACKOFF_BASE,
+                                  max_wait=Config.MD_BACKOFF_MAX, max_retries=Config.MD_MAX_RETRIES,
+                                  auth_retries=Config.MD_AUTH_RETRIES)
+    return _md_throttle
+
+
+def md_request(session, method, url, verify, data=None, headers=None):
+    """
+    Send a request to the MagicDraw server, respecting Config.MD_MAX_IN_FLIGHT.
+    The requests refused by the server are retried, see md_throttle().
+    """
+    def request():
+        with md_slots():
+            return session.request(method, url, verify=verify, data=data, headers=headers)
+
+    return md_throttle().send(request, url)
+
+
+def element_type(element):
+    """
+    The @type of a MagicDraw element ([ldp, kerml] as returned by the REST API)
+    """
+    if isinstance(element, list) and len(element) > 1 and isinstance(element[1], dict):
+        return element[1].get('@type', 'unknown')
+    if isinstance(element, dict):
+        return element.get('@type', 'unknown')
+    return 'unknown'
 
 
 # given a a session retun a json
-# in case the max sessions opened is reached,
-# waits 10 minutes before retry (probably not needed using only one session)
-def rsget(session, url, verify):
+# If Config.MD_CACHE is set, the element is taken from the cache when available
+def rsget(session, url, verify, cached=True):
     # print('>> url: ', url, '<<')
 
-    wait = 600
+    if cached and Config.MD_CACHE:
+        result = Config.MD_CACHE.get(url)
+        if result is not None:
+            return result
 
-    req = session.get(url, verify=verify)
-    while req.status_code == 401:
-        now = datetime.datetime.now()
-        print(now.strftime("%H:%M:%S"), 'REST API connexions exceeded. Whaiting ...', wait, ' seconds on request:')
-        print('  --  ', url) 
-        sleep(wait)
-        req = session.get(url, verify=verify)
+    start = perf_counter()
+    req = md_request(session, 'GET', url, verify)
 
     result = req.json()
+    metrics.record_request(element_type(result), perf_counter() - start)
+    if cached and Config.MD_CACHE and req.status_code == 200:
+        Config.MD_CACHE.put(url, result)
     return result
 
 
+def rspost_elements(session, cid, eids, verify):
+    """
+    Bulk retrieval of MagicDraw elements: the list of ids is posted to Config.MD_BULK_URL.
+    Returns a dictionary id: element, or None if the server does not support bulk retrieval
+    (BULK_UNSUPPORTED status, or an answer that is not a dictionary of elements).
+    :raise requests.HTTPError: for the other errors, left after the retries of the session and of md_throttle()
+    """
+    start = perf_counter()
+    req = md_request(session, 'POST', Config.MD_BULK_URL.format(res=cid), verify,
+                     data=",".join(eids), headers={'content-type': 'text/plain'})
+    metrics.record_request("bulk", perf_counter() - start)
+    if req.status_code in BULK_UNSUPPORTED:
+        return None
+    req.raise_for_status()
+    try:
+        resp = req.json()
+    except ValueError:
+        return None
+    if not isinstance(resp, dict):
+        return None
+    elements = dict()
+    for eid, element in resp.items():
+        # the element can be wrapped in a data field
+        if isinstance(element, dict) and 'data' in element:
+            element = element['data']
+        if isinstance(element, list) and len(element) == 2:
+            elements[eid] = element
+    return elements
+
+
+def md_get_elements(rcs, cid, eids):
+    """
+    Returns the MagicDraw elements corresponding to eids, in the same order.
+    Cached elements are not requested again; the others are retrieved in chunks of
+    Config.MD_BULK_SIZE ids, or with single concurrent GETs if bulk retrieval is not available.
+    Not to be called from tasks already running in md_pool().
+    """
+    urls = [Config.MD_COMP_URL.format(res=cid, comp=eid) for eid in eids]
+    found = dict()
+    missing = []
+    for eid, url in zip(eids, urls):
+        if eid in found:
+            continue
+        element = Config.MD_CACHE.get(url) if Config.MD_CACHE else None
+        if element is not None:
+            found[eid] = element
+        elif eid not in missing:
+            missing.append(eid)
+
+    if Config.MD_BULK and len(missing) > 1:
+        chunks = [missing[i:i + Config.MD_BULK_SIZE] for i in range(0, len(missing), Config.MD_BULK_SIZE)]
+        for chunk, elements in zip(chunks, md_pool().map(lambda c: rspost_elements(rcs, cid, c, True), chunks)):
+            if elements is None:
+                print("  Bulk retrieval of elements not available, using single requests")
+                Config.MD_BULK = False
+                break
+            for eid in chunk:
+                if eid in elements:
+                    found[eid] = elements[eid]
+                    if Config.MD_CACHE:
+                        Config.MD_CACHE.put(Config.MD_COMP_URL.format(res=cid, comp=eid), elements[eid])
+        missing = [eid for eid in missing if eid not in found]
+
+    if len(missing) == 1:
+        found[missing[0]] = rsget(rcs, Config.MD_COMP_URL.format(res=cid, comp=missing[0]), True)
+    elif missing:
+        missing_urls = [Config.MD_COMP_URL.format(res=cid, comp=eid) for eid in missing]
+        for eid, element in zip(missing, md_pool().map(lambda url: rsget(rcs, url, True), missing_urls)):
+            found[eid] = element
+
+    return [found[eid] for eid in eids]
+
+
+def md_known_features(cid):
+    """
+    Returns the property names already resolved for the resource cid
+    (definingFeature id: name), loading the persisted ones the first time
+    """
+    if cid not in _md_features:
+        _md_features[cid] = Config.MD_CACHE.get_features(cid) if Config.MD_CACHE else dict()
+    return _md_features[cid]
+
+
+def md_feature_names(rcs, cid, fids):
+    """
+    Returns the property names of the given definingFeature ids as a dictionary id: name.
+    Each feature is retrieved only once per run (and persisted in Config.MD_CACHE, if any).
+    """
+    known = md_known_features(cid)
+    missing = [fid for fid in dict.fromkeys(fids) if fid not in known]
+    if missing:
+        new_features = dict()
+        for fid, feature in zip(missing, md_get_elements(rcs, cid, missing)):
+            new_features[fid] = feature[1]['kerml:name']
+        known.update(new_features)
+        if Config.MD_CACHE:
+            Config.MD_CACHE.put_features(cid, new_features)
+    return {fid: known[fid] for fid in fids}
+
+
+def md_forget_features(cid, changed=None):
+    """
+    Drop the resolved property names of resource cid, only the changed ones if given
+    """
+    if cid not in _md_features:
+        return
+    if changed is None:
+        del _md_features[cid]
+    else:
+        for fid in changed:
+            _md_features[cid].pop(fid, None)
+
+
 # Generate an Id from the text
 def fix_id_tex(text):
     text_id = re.sub(r"\s+", "", text)
@@ -134,83 +442,70 @@ def fix_tex(text):
     return fixed_text
 
 
-# obsolete: to remove
-def reqget(url, local_headers, verify):
-    wait = 600
-    req = requests.get(url, headers=local_headers, verify=verify)
-    while req.status_code == 401:
-        now = datetime.datetime.now()
-        print(now.strftime("%H:%M:%S"), 'REST API connexions exceeded. Whaiting ...', wait, ' seconds on request:')
-        print('  --  ', url) 
-        sleep(wait)
-        req = requests.get(url, headers=local_headers, verify=verify)
-    result = req.json()
-    req.close()
-    return result
+def write_if_changed(filename, text):
+    """
+    Write text in filename only if the file content is different,
+    so that unchanged files keep their modification time (and make does not rebuild them)
+    :return: True if the file has been written
+    """
+    if os.path.exists(filename):
+        with open(filename, 'r') as fin:
+            if fin.read() == text:
+                return False
+    folder = os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(filename, 'w') as fout:
+        fout.write(text)
+    return True
 
 
-# given a file handler, it returns the tree
-def construct_tree(fileinput):
-    """Read the tree file and construct  a tree structure
-    Input csv columns
-    product key,short name,Parent,WBS,team,manager,product owner,packages,Name,Qualified Name,docgen,Element Server ID
-    0           1          2      3   4    5       6             7        8    9              10     11"""
-    count = 0
-    ptree = Tree()
-
-    with open(fileinput, 'r') as fin:
-        reader = csv.reader(fin, dialect='excel')
-        for line in reader:
-            count = count + 1
-            if count == 1:
-                continue
-            e_id = fix_id_tex(line[0])  # make an e_id from the name
-            pid = fix_id_tex(line[2])  # use the same formaula on the parent name then we are good
-            name = fix_tex(line[1])
-            prod = Product(e_id, name, pid, "", line[3], line[5],
-                           line[6], "", line[7], line[11])
-#   def __init__(self, e_id, name, parent, desc, wbs, manager,
-#                       owner, kind, pkgs, elId):
-
-            # print("Product:" + prod.e_id + " name:" + prod.name + " parent:" + prod.parent)
-            if count == 2:  # root node
-                ptree.create_node(prod.id, prod.id, data=prod)
-            else:
-                # print("Creating node:" + prod.e_id + " name:"+ prod.name +
-                #      " parent:" + prod.parent)
-                if prod.parent != "":
-                    ptree.create_node(prod.id, prod.id, data=prod,
-                                      parent=prod.parent)
-                else:
-                    print(line[0] + " no parent")
-
-    print("{} Product lines".format(count))
-    return ptree
-
-
-def tree_slice(ptree, outdepth):
-    if ptree.depth() == outdepth:
-        return ptree
-    # copy the tree but stopping at given depth
-    ntree = Tree()
-    nodes = ptree.expand_tree(key=lambda x: x.data.index, sorting=True)
-    count = 0  # subtree in input
-    for n in nodes:
-        # print("Accesing {}".format(n))
-        depth = ptree.depth(n)
-        prod = ptree[n].data
-
-        # print("outd={od} mydepth={d} Product: {p.id} name: {p.name} parent: {p.parent}".format(od=outdepth,
-        #       d=depth, p=prod))
-        if depth <= outdepth:
-            # print(" YES ", end='')
-            if count == 0:
-                ntree.create_node(prod.id, prod.id, data=prod)
-            else:
-                ntree.create_node(prod.id, prod.id, data=prod,
-                                  parent=prod.parent)
-            count = count + 1
-    return ntree
+# Product fields that affect the product tree diagrams
+DIAGRAM_FIELDS = ('id', 'name', 'shortname', 'parent', 'wbs', 'pkgs', 'index')
+
+
+def products_digest(products, *extra):
+    """
+    Returns a digest of the diagram fields of the products (in the given order)
+    and of any extra value (layout parameters)
+    """
+    sha = hashlib.sha1()
+    for value in extra:
+        sha.update(repr(value).encode("utf-8"))
+    for prod in products:
+        sha.update(repr(tuple(getattr(prod, field) for field in DIAGRAM_FIELDS)).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class OutputManifest(object):
+    """
+    Digests of the inputs each generated file has been produced from,
+    to skip the generation of the files whose inputs did not change
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.digests = dict()
+        self.skipped = 0
+        if os.path.exists(path):
+            with open(path, 'r') as fin:
+                self.digests = json.load(fin)
+
+    def is_current(self, filename, digest):
+        if os.path.exists(filename) and self.digests.get(filename) == digest:
+            self.skipped = self.skipped + 1
+            return True
+        return False
+
+    def update(self, filename, digest):
+        self.digests[filename] = digest
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(self.path, 'w') as fout:
+            json.dump(self.digests, fout, indent=1, sort_keys=True)
 
 
 # get all information from MD for a single element
@@ -238,28 +533,40 @@ def get_pkg_properties(rcs, cid, eid):
     properties['documents'] = []
     properties['docs'] = []
 
-    for el in resp[0]['ldp:contains']:
+    # the slots, then their defining features and values, then the instances referred by the values
+    # are retrieved one level at the time
+    # the property names are the same for all products, see md_feature_names
+    slots = md_get_elements(rcs, cid, [el['@id'] for el in resp[0]['ldp:contains']])
+    feature_ids = []
+    level_ids = []
+    for el, slot in zip(resp[0]['ldp:contains'], slots):
+        if slot[1]['@type'] == 'uml:Slot':
+            feature_ids.append(slot[1]['kerml:esiData']['definingFeature']['@id'])
+            level_ids.extend([entry['@id'] for entry in slot[0]['ldp:contains']])
+    feature_names = md_feature_names(rcs, cid, feature_ids)
+    level = dict(zip(level_ids, md_get_elements(rcs, cid, level_ids)))
+    instance_ids = [pve[1]['kerml:esiData']['instance']['@id'] for pve in level.values()
+                    if pve[1]['@type'] == 'uml:InstanceValue']
+    instances = dict(zip(instance_ids, md_get_elements(rcs, cid, instance_ids)))
+
+    for el, slot in zip(resp[0]['ldp:contains'], slots):
         # print('  uml:Slot', el['@id'])
-        slot = rsget(rcs, Config.MD_COMP_URL.format(res=cid, comp=el['@id']), True)
         if slot[1]['@type'] != 'uml:Slot':
             print('New type: ', slot[1]['@type'], ' on ', el['@id'], '(uml:Slot was expected)')
         else:
             # get property name
             # print('      definingFeature',slot[1]['kerml:esiData']['definingFeature']['@id'])
-            pne = rsget(rcs, Config.MD_COMP_URL.format(res=cid,
-                                                       comp=slot[1]['kerml:esiData']['definingFeature']['@id']), True)
-            pname = pne[1]['kerml:name']
+            pname = feature_names[slot[1]['kerml:esiData']['definingFeature']['@id']]
             # get property value
             pvalue = []
             # pvalue = " "
             for entry in slot[0]['ldp:contains']:
-                pve = rsget(rcs, Config.MD_COMP_URL.format(res=cid, comp=entry['@id']), True)
+                pve = level[entry['@id']]
                 if pve[1]['@type'] in ('uml:LiteralString', 'uml:LiteralBoolean'):
                     pvalue.append(pve[1]['kerml:esiData']['value'])
                     # pvalue = pvalue + pve[1]['kerml:esiData']['value']
                 elif pve[1]['@type'] == 'uml:InstanceValue':
-                    instance = rsget(rcs, Config.MD_COMP_URL.format(res=cid,
-                                                                    comp=pve[1]['kerml:esiData']['instance']['@id']), True)
+                    instance = instances[pve[1]['kerml:esiData']['instance']['@id']]
                     pvalue.append(instance[1]['kerml:name'])
                 else:
                     print('Unmapped property type ', pve[1]['@type'])
@@ -8,7 +8,7 @@ requires = [
     'click',
     'BeautifulSoup4',
     'marshmallow<3',
-    'pygithub',
+    'pygithub>=2',
     'graphviz',
     'setuptools_scm'
 ]
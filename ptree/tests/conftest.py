@@ -0,0 +1,29 @@
+import pytest
+from ptree.config import Config
+from ptree import util
+
+# Config attributes changed by the tests, restored after each of them
+SAVED_CONFIG = ['MD_COMP_URL', 'MD_BULK_URL', 'MD_REVDIFF_URL', 'MD_BULK', 'MD_BULK_SIZE', 'MD_CACHE',
+                'MD_MAX_IN_FLIGHT', 'GIT_API_URL', 'GIT_GRAPHQL_URL', 'OUTPUT_MANIFEST']
+
+
+@pytest.fixture
+def md_config():
+    """
+    Restores Config and the MagicDraw request pool after the test
+    """
+    saved = {name: getattr(Config, name) for name in SAVED_CONFIG}
+    util.md_shutdown()
+    Config.MD_CACHE = None
+    yield Config
+    util.md_shutdown()
+    for name, value in saved.items():
+        setattr(Config, name, value)
+
+
+def make_elements(count):
+    """
+    A model of count comments, as dictionary id: element
+    """
+    return {f"e{i}": [{'ldp:contains': []}, {'@id': f"e{i}", '@type': 'uml:Comment', 'kerml:esiData': {'body': str(i)}}]
+            for i in range(count)}
@@ -0,0 +1,55 @@
+import pytest
+import requests
+from ptree.config import Config
+from ptree.standin import TwcStandin, TwcHandler
+from ptree.util import md_session, md_get_elements
+from conftest import make_elements
+
+
+class FailingHandler(TwcHandler):
+    """ Answers 500 to the bulk requests """
+
+    def do_POST(self):
+        self.read_body()
+        self.server.standin.count('POST')
+        self.send_json(500, {'error': 'internal error'})
+
+
+class FailingStandin(TwcStandin):
+    handler = FailingHandler
+
+
+def get_all(elements):
+    ids = list(elements.keys())
+    with md_session("dGVzdDp0ZXN0") as rs:
+        return ids, md_get_elements(rs, "res", ids)
+
+
+def test_bulk_retrieval(md_config):
+    elements = make_elements(250)
+    Config.MD_BULK_SIZE = 100
+    with TwcStandin(elements) as standin:
+        standin.configure()
+        ids, found = get_all(elements)
+    assert found == [elements[eid] for eid in ids]
+    assert standin.requests == {'POST': 3}
+    assert Config.MD_BULK
+
+
+def test_fallback_to_single_requests(md_config):
+    elements = make_elements(50)
+    with TwcStandin(elements, bulk=False) as standin:
+        standin.configure()
+        ids, found = get_all(elements)
+    assert found == [elements[eid] for eid in ids]
+    assert standin.requests['POST'] == 1
+    assert standin.requests['GET'] == 50
+    assert not Config.MD_BULK
+
+
+def test_server_error_does_not_disable_bulk(md_config):
+    with FailingStandin(make_elements(10)) as standin:
+        standin.configure()
+        with pytest.raises(requests.HTTPError):
+            get_all(standin.elements)
+    assert Config.MD_BULK
@@ -0,0 +1,55 @@
+import github
+from ptree.config import Config
+from ptree.util import GitPkg
+from ptree.gitcache import GitRepoCache
+from ptree.gitscheduler import GitScheduler
+from ptree.standin import GitHubStandin, GitHubHandler
+
+
+class RecordingHandler(GitHubHandler):
+    """ Records the Authorization header of the head checks """
+
+    def do_GET(self):
+        if self.path.endswith("/commits/HEAD"):
+            self.server.standin.authorizations.append(self.headers.get('Authorization'))
+        GitHubHandler.do_GET(self)
+
+
+class RecordingGitHub(GitHubStandin):
+    handler = RecordingHandler
+
+    def __init__(self, packages):
+        GitHubStandin.__init__(self, packages)
+        self.authorizations = []
+
+
+def scheduler(token=None):
+    return GitScheduler(github.Github(token, base_url=Config.GIT_API_URL,
+                                      seconds_between_requests=None, seconds_between_writes=None))
+
+
+def test_head_checks_go_through_the_scheduler(tmp_path, md_config):
+    packages = {'afw': GitPkg("", "afw", "lsst", {"README.md": "afw"}, ["utils"], ["Pipelines"], "Framework")}
+    with RecordingGitHub(packages) as standin:
+        standin.configure()
+        gs = scheduler()
+        cache = GitRepoCache(str(tmp_path / "git_repos.json"), gs)
+        gitpkg, head = cache.lookup("afw")
+        assert gitpkg is None
+        assert head[0] == standin.shas[("lsst", "afw")]
+        cache.store("afw", packages["afw"], head)
+        # not modified: answered 304, not counted by GitHub against the quota
+        gitpkg, head = cache.lookup("afw")
+        assert gitpkg.to_dict() == packages["afw"].to_dict()
+        assert cache.reused == 1
+        assert cache.lookup("missing") == (None, (None, None))
+    assert gs.calls == 3
+    assert gs.g.rate_limiting[0] == standin.rate_limit - 2
+    assert standin.authorizations == [None, None, None]
+
+
+def test_head_checks_use_the_token(tmp_path, md_config):
+    with RecordingGitHub(dict()) as standin:
+        standin.configure()
+        GitRepoCache(str(tmp_path / "git_repos.json"), scheduler("secret")).get_head("afw")
+    assert standin.authorizations == ["token secret"]
@@ -0,0 +1,62 @@
+import os
+import time
+import github
+from ptree.config import Config
+from ptree.util import GitPkg
+from ptree.gittree import get_gitpkg_content
+from ptree.gitgraphql import GraphQLBackend, HttpTransport, RecordingTransport, ReplayTransport
+from ptree.gitscheduler import GitScheduler
+from ptree.standin import GitHubStandin
+
+# responses recorded with RecordingTransport against GitHubStandin(PACKAGES)
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "graphql")
+
+PACKAGES = {'lsst/afw': GitPkg("", "afw", "lsst", {"README.md": "# afw\nAstronomical framework"},
+                               ["lsst/utils", "lsst-dm/verify"], ["Data Management", "Overlords"],
+                               "Astronomical *framework*"),
+            'lsst/utils': GitPkg("", "utils", "lsst", {"README.md": "# utils", "README.rst": "utils\n====="},
+                                 [], ["Data Management"], ""),
+            'lsst-dm/verify': GitPkg("", "verify", "lsst-dm", {"README.md": "verify"},
+                                     ["lsst/utils"], ["DM Verify"], "Metrics")}
+NAMES = ['lsst/afw', 'lsst/utils', 'lsst-dm/verify', 'lsst/gone']
+
+
+def scheduler():
+    return GitScheduler(github.Github(None, base_url=Config.GIT_API_URL,
+                                      seconds_between_requests=None, seconds_between_writes=None))
+
+
+def record(folder=FIXTURES):
+    """
+    Record again the responses, after a change of the queries
+    """
+    with GitHubStandin(PACKAGES) as standin:
+        standin.configure()
+        backend = GraphQLBackend(None, scheduler(), RecordingTransport(HttpTransport(None), folder))
+        backend.get_gitpkgs(NAMES)
+
+
+def test_graphql_replay_matches_rest(md_config):
+    backend = GraphQLBackend(None, scheduler(), ReplayTransport(FIXTURES))
+    graphql = backend.get_gitpkgs(NAMES)
+    with GitHubStandin(PACKAGES) as standin:
+        standin.configure()
+        gs = scheduler()
+        rest = {name: get_gitpkg_content(name, gs) for name in NAMES}
+    assert graphql['lsst/gone'] is None and rest['lsst/gone'] is None
+    for name in NAMES[:-1]:
+        assert graphql[name].to_dict() == rest[name].to_dict()
+
+
+def test_graphql_paced_on_its_own_budget(md_config):
+    with GitHubStandin(PACKAGES, rate_limit=50) as standin:
+        standin.configure()
+        gs = scheduler()
+        backend = GraphQLBackend(None, gs)
+        backend.get_gitpkgs(NAMES)
+        assert gs.graphql_rate[0] == 50 - gs.calls
+        assert gs.graphql_rate[1] > time.time()
+        assert gs.wait_time('graphql') > 0
+    # the REST quota is neither read nor used by the GraphQL queries
+    assert "core" not in standin.quotas
+    assert 'GET' not in standin.requests
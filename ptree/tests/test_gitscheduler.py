@@ -0,0 +1,44 @@
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from ptree.config import Config
+from ptree.gitscheduler import GitScheduler
+from ptree.gittree import fetch_git_packages, GitHubAccessError
+
+
+class FakeGithub(object):
+    """ Rate limit as exposed by github.Github """
+
+    def __init__(self, remaining, reset_in):
+        self.rate_limiting = (remaining, 5000)
+        self.rate_limiting_resettime = time.time() + reset_in
+
+    def get_organization(self, org):
+        raise RuntimeError("organization not reachable")
+
+
+def test_full_speed_above_reserve():
+    gs = GitScheduler(FakeGithub(1000, 60))
+    assert [gs.wait_time() for i in range(5)] == [0] * 5
+
+
+def test_concurrent_calls_get_spread_slots():
+    gs = GitScheduler(FakeGithub(50, 10))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        waits = sorted(pool.map(lambda i: gs.wait_time(), range(8)))
+    # one slot every 10 s / 50 calls
+    for previous, wait in zip(waits, waits[1:]):
+        assert wait - previous == pytest.approx(0.2, abs=0.05)
+
+
+def test_exhausted_quota_waits_for_reset():
+    gs = GitScheduler(FakeGithub(0, 30))
+    assert gs.wait_time() == pytest.approx(31, abs=0.5)
+
+
+def test_organization_error_stops_the_fetch():
+    Config.CACHED_GIT_REPOS = dict()
+    Config.MISSING_GIT_REPOS = set()
+    gs = GitScheduler(FakeGithub(1000, 60))
+    with pytest.raises(GitHubAccessError):
+        fetch_git_packages(["afw", "lsst/utils", "other/pkg"], gs, 2)
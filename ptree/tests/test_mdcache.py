@@ -0,0 +1,32 @@
+from ptree.mdcache import ElementCache
+
+URL = "http://twc/osmc/resources/{res}/elements/{comp}"
+
+
+def fill(cache):
+    for res in ("R1", "R2"):
+        for comp in ("a", "b"):
+            cache.put(URL.format(res=res, comp=comp), [{}, {'@id': comp}])
+
+
+def cached(cache):
+    return sorted((res, comp) for res in ("R1", "R2") for comp in ("a", "b")
+                  if cache.get(URL.format(res=res, comp=comp)) is not None)
+
+
+def test_changed_elements_dropped_only_in_their_resource(tmp_path):
+    for path in (None, str(tmp_path / "elements.sqlite")):
+        cache = ElementCache(path)
+        fill(cache)
+        assert cache.set_revision("R1", "2", {"a"}) == 1
+        assert cached(cache) == [("R1", "b"), ("R2", "a"), ("R2", "b")]
+        cache.close()
+
+
+def test_unknown_changes_drop_the_resource(tmp_path):
+    cache = ElementCache(str(tmp_path / "elements.sqlite"))
+    fill(cache)
+    cache.set_revision("R2", "2")
+    assert cached(cache) == [("R1", "a"), ("R1", "b")]
+    assert cache.get_revision("R2") == "2"
+    cache.close()